@@ -0,0 +1,80 @@
+'''页面提取一致性：ziroom.extract（预编译 lxml）与原 parsel 实现（ziroom.commands.parsecheck）的结果逐字段相同
+
+页面由 ziroom.fakesite 生成（与真实站点结构相同的列表页、详情页）。
+原实现永远提取不到的字段（parsecheck.FIXED_FIELDS），只要求原实现为 None。
+'''
+
+import unittest
+
+from scrapy.http import HtmlResponse
+
+from ziroom.commands import parsecheck
+from ziroom.fakesite import FakeSite
+
+
+def response(path, body):
+    return HtmlResponse('http://sh.ziroom.com' + path, body=body)
+
+
+class ExtractParityTest(unittest.TestCase):
+
+    site = FakeSite(districts=2, pages=3, rooms=6)
+
+    def assertParity(self, old, new):
+        for key in sorted(set(old) | set(new)):
+            field = key.rsplit('.', 1)[-1]
+            if field in parsecheck.FIXED_FIELDS and old.get(key) is None:
+                continue
+            self.assertIn(key, old)
+            self.assertIn(key, new)
+            self.assertEqual(old[key], new[key], key)
+
+    def list_pages(self):
+        for district in range(1, self.site.districts + 1):
+            for page in range(1, self.site.pages + 1):
+                path = f"/z/nl/z3-d{district}.html"
+                _, body = self.site.list_page(path, {'p': [str(page)]})
+                yield path, body
+
+    def detail_pages(self):
+        for path, body in self.list_pages():
+            for room in parsecheck.current_list(response(path, body))['rooms']:
+                detail_path = room['url'].split('ziroom.com', 1)[1]
+                yield detail_path, self.site.detail_page(detail_path, {})[1]
+
+    def test_list(self):
+        count = 0
+        for path, body in self.list_pages():
+            with self.subTest(path=path):
+                old = parsecheck.list_fields(parsecheck.legacy_list(response(path, body)))
+                new = parsecheck.list_fields(parsecheck.current_list(response(path, body)))
+                self.assertEqual(new['rooms'], self.site.rooms)
+                self.assertParity(old, new)
+                count += 1
+        self.assertEqual(count, self.site.districts * self.site.pages)
+
+    def test_detail(self):
+        count = 0
+        for path, body in self.detail_pages():
+            with self.subTest(path=path):
+                old = parsecheck.detail_fields(parsecheck.legacy_detail(response(path, body)))
+                new = parsecheck.detail_fields(parsecheck.current_detail(response(path, body)))
+                self.assertTrue(new['roommates'] and new['photos'])
+                self.assertParity(old, new)
+                count += 1
+        self.assertEqual(count, self.site.districts * self.site.pages * self.site.rooms)
+
+    def test_empty_pages(self):
+        body = '<html><body>我们找不到任何与您的搜索条件匹配的结果</body></html>'.encode()
+        self.assertParity(
+            parsecheck.list_fields(parsecheck.legacy_list(response('/z/nl/z3-d1.html', body))),
+            parsecheck.list_fields(parsecheck.current_list(response('/z/nl/z3-d1.html', body))),
+        )
+        self.assertParity(
+            parsecheck.detail_fields(parsecheck.legacy_detail(response('/z/vr/1.html', body))),
+            parsecheck.detail_fields(parsecheck.current_detail(response('/z/vr/1.html', body))),
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
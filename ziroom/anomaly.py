@@ -0,0 +1,152 @@
+'''异常页面抽样记录
+
+非正常页面（200 但内容异常、302/403/478/510 等）、下载异常不再把整个 response.body 写入日志：
+    1) 抽样保存：每种异常（kind）每个时间窗口（ANOMALY_WINDOW 秒）的前 ANOMALY_SAMPLE_BURST 个全部保存，
+       之后按 ANOMALY_SAMPLE_RATE 概率保存。保存内容为元信息（json）+ body（截断为 ANOMALY_MAX_BODY 字节），
+       zlib 压缩后写入环形缓冲区（最多 ANOMALY_CAPACITY 个，最旧的被覆盖）：
+           redis - 列表 ANOMALY_REDIS_KEY（所有节点共用，LPUSH + LTRIM）
+           disk  - ANOMALY_DIR 下的 0000.z ~ <capacity-1>.z（本节点）
+    2) 日志限流：每种异常每个时间窗口只输出前 ANOMALY_LOG_BURST 条日志，
+       窗口结束时汇总输出：次数、省略的日志数、保存的样本数。
+scrapy anomalies 查看、导出保存的样本。
+'''
+
+import os
+import json
+import time
+import zlib
+import random
+import logging
+from collections import Counter
+
+from scrapy.utils.project import get_project_settings
+from scrapy_redis import connection
+from twisted.internet import task
+
+from ziroom.statscollectors import NODE_ID
+
+project_settings = get_project_settings()
+
+
+def pack(meta, body):
+    '''样本：zlib(元信息 json + 换行 + body)'''
+    return zlib.compress(json.dumps(meta, ensure_ascii=False).encode() + b'\n' + body)
+
+
+def unpack(data):
+    '''@:return (元信息, body)'''
+    header, _, body = zlib.decompress(data).partition(b'\n')
+    return json.loads(header), body
+
+
+class AnomalyRecorder(object):
+
+    def __init__(self, settings):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.store = settings.get('ANOMALY_STORE', 'redis')
+        self.redis_key = settings.get('ANOMALY_REDIS_KEY', 'ziroom:anomalies')
+        self.dir = settings.get('ANOMALY_DIR', 'anomalies')
+        self.capacity = settings.getint('ANOMALY_CAPACITY', 200)
+        self.max_body = settings.getint('ANOMALY_MAX_BODY', 65536)
+        self.sample_burst = settings.getint('ANOMALY_SAMPLE_BURST', 3)
+        self.sample_rate = settings.getfloat('ANOMALY_SAMPLE_RATE', 0.01)
+        self.log_burst = settings.getint('ANOMALY_LOG_BURST', 3)
+        self.window = settings.getfloat('ANOMALY_WINDOW', 60)
+        self.server = connection.from_settings(settings) if self.store == 'redis' else None
+        self.counts = Counter()     # 本窗口内：{kind: 次数}
+        self.sampled = Counter()    # 本窗口内：{kind: 保存的样本数}
+        self.seq = 0                # 本进程保存的样本序号
+        self._slot = None           # disk：下一个写入位置
+        self._loop = None
+
+    def record(self, kind, message, *, response=None, request=None, logger=None,
+               level=logging.WARNING, **meta):
+        '''记录一次异常：限流输出 message，抽样保存 response（body、状态码、headers）与 meta
+        @:return 保存的样本 id，未保存为 None
+        '''
+        if self._loop is None:
+            self._loop = task.LoopingCall(self.summarize)
+            self._loop.start(self.window, now=False)
+        self.counts[kind] += 1
+        sample_id = None
+        if self.counts[kind] <= self.sample_burst or random.random() < self.sample_rate:
+            sample_id = self._save(kind, message, response, request, meta)
+        if self.counts[kind] <= self.log_burst:
+            suffix = f"（样本：{sample_id}）" if sample_id else ''
+            (logger or self.logger).log(level, f"{message}{suffix}")
+            if self.counts[kind] == self.log_burst:
+                (logger or self.logger).log(level, f"{kind}：本窗口内不再输出，{self.window:.0f} s 后汇总")
+        return sample_id
+
+    def summarize(self):
+        '''输出本窗口的汇总（有省略日志的异常），开始新窗口'''
+        for kind, count in self.counts.items():
+            if count > self.log_burst:
+                self.logger.warning(f"{kind}：最近 {self.window:.0f} s 共 {count} 次，"
+                    f"省略日志 {count - self.log_burst} 条，保存样本 {self.sampled[kind]} 个")
+        self.counts.clear()
+        self.sampled.clear()
+
+    def _save(self, kind, message, response, request, meta):
+        self.seq += 1
+        sample_id = f"{NODE_ID}-{self.seq}"
+        body = b''
+        meta = dict(meta, id=sample_id, kind=kind, time=time.time(), message=message)
+        if response is not None:
+            body = response.body[:self.max_body]
+            request = request or response.request
+            meta.update({
+                'url': response.url,
+                'status': response.status,
+                'headers': {k.decode(): [v.decode('latin1') for v in vs]
+                    for k, vs in response.headers.items()},
+                'body_size': len(response.body),
+            })
+        if request is not None:
+            meta.setdefault('url', request.url)
+            meta.setdefault('proxy', request.meta.get('proxy'))
+        try:
+            data = pack(meta, body)
+            if self.store == 'redis':
+                pipe = self.server.pipeline()
+                pipe.lpush(self.redis_key, data)
+                pipe.ltrim(self.redis_key, 0, self.capacity - 1)
+                pipe.execute()
+            else:
+                self._write_slot(data)
+        except Exception as e:
+            self.logger.warning(f"保存异常样本失败：{e}")
+            return None
+        self.sampled[kind] += 1
+        return sample_id
+
+    def _write_slot(self, data):
+        if self._slot is None:
+            os.makedirs(self.dir, exist_ok=True)
+            # 从最近写入的位置之后继续
+            paths = [os.path.join(self.dir, f) for f in os.listdir(self.dir) if f.endswith('.z')]
+            if paths:
+                latest = max(paths, key=os.path.getmtime)
+                self._slot = (int(os.path.basename(latest)[:-2]) + 1) % self.capacity
+            else:
+                self._slot = 0
+        path = os.path.join(self.dir, f"{self._slot:04d}.z")
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        self._slot = (self._slot + 1) % self.capacity
+
+    def samples(self):
+        '''全部样本（新的在前）：[(元信息, body)]'''
+        if self.store == 'redis':
+            entries = self.server.lrange(self.redis_key, 0, -1)
+        else:
+            entries = []
+            if os.path.isdir(self.dir):
+                paths = [os.path.join(self.dir, f) for f in os.listdir(self.dir) if f.endswith('.z')]
+                for path in sorted(paths, key=os.path.getmtime, reverse=True):
+                    with open(path, 'rb') as f:
+                        entries.append(f.read())
+        return [unpack(x) for x in entries]
+
+anomaly_recorder = AnomalyRecorder(project_settings)
@@ -0,0 +1,50 @@
+'''子资源缓存
+
+管家信息按小区（resblock_id）、房屋配置按房屋（house_id）区分，同一小区、同一房屋的房间请求到的 json 相同。
+请求结果（json 中的 data）缓存在 redis 中（集群内所有节点共享），带过期时间：
+    cache:steward:<resblock_id> - 管家信息，过期时间 STEWARD_CACHE_TTL 秒
+    cache:config:<house_id>     - 房屋配置，过期时间 CONFIG_CACHE_TTL 秒
+命中缓存时直接生成 item，不再下载。
+'''
+
+import json
+import logging
+
+
+class SubResourceCache(object):
+    '''管家信息、房屋配置缓存'''
+
+    _REDIS_KEYS = {
+        'steward': 'cache:steward:%s',
+        'config': 'cache:config:%s',
+    }
+
+    def __init__(self, server, ttl):
+        '''@:param ttl {'steward': 秒, 'config': 秒}，0 表示不缓存'''
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.server = server
+        self.ttl = ttl
+
+    def get_many(self, keys):
+        '''批量读取
+        @:param keys [(资源类型, id), ...]
+        @:return [data 或 None, ...]
+        '''
+        keys = list(keys)
+        if not any(self.ttl.get(kind) for kind, _ in keys):
+            return [None] * len(keys)
+        try:
+            values = self.server.mget([self._REDIS_KEYS[kind] % key for kind, key in keys])
+        except Exception as e:
+            self.logger.warning(f"读取缓存失败：{e}")
+            return [None] * len(keys)
+        return [json.loads(v) if v is not None else None for v in values]
+
+    def set(self, kind, key, data):
+        if not self.ttl.get(kind):
+            return
+        try:
+            self.server.set(self._REDIS_KEYS[kind] % key,
+                json.dumps(data, ensure_ascii=False), ex=self.ttl[kind])
+        except Exception as e:
+            self.logger.warning(f"写入缓存失败：{kind} {key} - {e}")
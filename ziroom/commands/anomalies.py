@@ -0,0 +1,80 @@
+'''查看异常页面样本（ziroom.anomaly）
+
+    scrapy anomalies [list] [--kind KIND] [--limit N]     # 样本列表（新的在前）
+    scrapy anomalies stats                                # 按异常种类、节点统计
+    scrapy anomalies dump ID [--output FILE]              # 输出样本的元信息与 body（--output 时 body 原样写入文件）
+'''
+
+import json
+import time
+from collections import Counter
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from ziroom.anomaly import AnomalyRecorder
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return '[list|stats|dump ID] [options]'
+
+    def short_desc(self):
+        return '查看异常页面样本：列表、统计、导出'
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_argument('--kind', help='只列出该种类（如 status_403、abnormal_200）')
+        parser.add_argument('--limit', type=int, default=50, help='列出的样本数（默认 50）')
+        parser.add_argument('--output', metavar='FILE', help='dump：body 写入文件')
+
+    def run(self, args, opts):
+        action = args[0] if args else 'list'
+        samples = AnomalyRecorder(self.settings).samples()
+        if action == 'list':
+            self.list(samples, opts)
+        elif action == 'stats':
+            self.stats(samples)
+        elif action == 'dump':
+            if len(args) < 2:
+                raise UsageError('dump 需要样本 ID')
+            self.dump(samples, args[1], opts)
+        else:
+            raise UsageError(f"未知操作：{action}")
+
+    def list(self, samples, opts):
+        if opts.kind:
+            samples = [x for x in samples if x[0]['kind'] == opts.kind]
+        for meta, body in samples[:opts.limit]:
+            print('{}  {}  {:<22} {:>4}  {:>7}  {}'.format(
+                meta['id'],
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(meta['time'])),
+                meta['kind'],
+                meta.get('status', ''),
+                meta.get('body_size', ''),
+                meta.get('url', ''),
+            ))
+        print(f"共 {len(samples)} 个样本")
+
+    def stats(self, samples):
+        kinds = Counter(meta['kind'] for meta, _ in samples)
+        nodes = Counter(meta['id'].rsplit('-', 1)[0] for meta, _ in samples)
+        print(json.dumps({'kinds': kinds, 'nodes': nodes}, ensure_ascii=False, indent=2))
+
+    def dump(self, samples, sample_id, opts):
+        for meta, body in samples:
+            if meta['id'] == sample_id:
+                break
+        else:
+            raise UsageError(f"未找到样本：{sample_id}（可能已被覆盖）")
+        print(json.dumps(meta, ensure_ascii=False, indent=2))
+        if opts.output:
+            with open(opts.output, 'wb') as f:
+                f.write(body)
+            print(f"body 已写入：{opts.output}")
+        else:
+            print(body.decode('utf8', errors='replace'))
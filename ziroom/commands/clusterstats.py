@@ -0,0 +1,136 @@
+'''集群 stats
+
+    scrapy clusterstats [--json] [--watch SECONDS]
+
+读取各节点 RedisStatsCollector 写入 redis 的 stats，输出每个节点与合计的：
+items、items/s、requests、requests/s、代理更换次数、图片识别失败数；以及调度队列长度、去重集合大小、待抓取起始 url 数、延后的列表页数。
+使用布隆过滤器去重（ziroom.dupefilter.BloomDupeFilter）时，去重集合大小为已加入的指纹数，另输出置位比例、占用内存、估计误判率。
+items/s、requests/s 为各节点最近一个写入间隔的速率（合计只计运行中的节点）。
+'''
+
+import json
+import time
+
+from scrapy.commands import ScrapyCommand
+from scrapy.utils.misc import load_object
+from scrapy_redis import connection
+
+from ziroom.dupefilter import BloomDupeFilter
+from ziroom.statscollectors import stats_key
+
+COLUMNS = (
+    # (标题, 字段, 宽度)
+    ('node', 'node', 28),
+    ('status', 'status', 9),
+    ('age', 'age', 6),
+    ('items', 'items', 9),
+    ('items/s', 'items_per_second', 8),
+    ('requests', 'requests', 9),
+    ('req/s', 'requests_per_second', 8),
+    ('proxies', 'proxy_rotations', 8),
+    ('ocr_fail', 'ocr_failed', 10),
+)
+
+
+def key_size(server, key):
+    '''redis key 的元素个数（按类型），不存在为 0'''
+    key_type = server.type(key)
+    key_type = key_type.decode() if isinstance(key_type, bytes) else key_type
+    size = {
+        'zset': server.zcard, 'list': server.llen, 'set': server.scard, 'hash': server.hlen,
+    }.get(key_type)
+    return size(key) if size else 0
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return '[options]'
+
+    def short_desc(self):
+        return '集群 stats：各节点与合计的 items/s、requests/s、队列长度、去重集合大小、代理更换、识别失败'
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_argument('--spider', default='ziroom', help='spider 名称（默认 ziroom）')
+        parser.add_argument('--json', action='store_true', help='输出 json')
+        parser.add_argument('--watch', type=float, metavar='SECONDS', help='每隔 SECONDS 秒刷新')
+
+    def run(self, args, opts):
+        server = connection.from_settings(self.settings)
+        while True:
+            report = self.collect(server, opts.spider)
+            if opts.json:
+                print(json.dumps(report, ensure_ascii=False, indent=2))
+            else:
+                self.print_table(report)
+            if not opts.watch:
+                break
+            time.sleep(opts.watch)
+
+    def collect(self, server, spider_name):
+        key = stats_key(self.settings, spider_name)
+        node_ids = [x.decode() if isinstance(x, bytes) else x
+            for x in server.zrange(f"{key}:nodes", 0, -1)]
+        values = server.mget([f"{key}:{x}" for x in node_ids]) if node_ids else []
+        now = time.time()
+        nodes = []
+        for node_id, value in zip(node_ids, values):
+            if value is None:
+                # 已过期（进程退出）
+                server.zrem(f"{key}:nodes", node_id)
+                continue
+            node = json.loads(value)
+            stats = node.pop('stats')
+            node.update({
+                'age': int(now - node.pop('time')),
+                'items': stats.get('item_scraped_count', 0),
+                'requests': stats.get('downloader/request_count', 0),
+                'ocr_failed': stats.get('ocr/failed', 0),
+                'ocr_sprite_fallback': stats.get('ocr/sprite_fallback', 0),
+                'finish_reason': stats.get('finish_reason'),
+            })
+            nodes.append(node)
+        running = [x for x in nodes if x['status'] == 'running']
+        total = {
+            'node': 'total',
+            'status': f"{len(running)}/{len(nodes)}",
+            'age': '',
+            'items_per_second': round(sum(x['items_per_second'] for x in running), 2),
+            'requests_per_second': round(sum(x['requests_per_second'] for x in running), 2),
+        }
+        for field in ('items', 'requests', 'proxy_rotations', 'ocr_failed', 'ocr_sprite_fallback'):
+            total[field] = sum(x[field] for x in nodes)
+        fmt = {'spider': spider_name}
+        dupefilter_key = self.settings.get('SCHEDULER_DUPEFILTER_KEY', '%(spider)s:dupefilter') % fmt
+        bloom = None
+        if issubclass(load_object(self.settings.get('DUPEFILTER_CLASS')), BloomDupeFilter):
+            bloom = BloomDupeFilter(server, dupefilter_key, **BloomDupeFilter._bloom_options(self.settings)).info()
+        return {
+            'nodes': nodes,
+            'total': total,
+            'queue': key_size(server,
+                self.settings.get('SCHEDULER_QUEUE_KEY', '%(spider)s:requests') % fmt),
+            'dupefilter': bloom['count'] if bloom else key_size(server, dupefilter_key),
+            'bloom': bloom,
+            'start_urls': key_size(server,
+                self.settings.get('REDIS_START_URLS_KEY', '%(name)s:start_urls') % {'name': spider_name}),
+            'frontier': key_size(server, self.settings.get('FRONTIER_KEY', '%(spider)s:frontier') % fmt),
+        }
+
+    @staticmethod
+    def print_table(report):
+        print(''.join(title.rjust(width) if i else title.ljust(width)
+            for i, (title, _, width) in enumerate(COLUMNS)))
+        for node in report['nodes'] + [report['total']]:
+            print(''.join(str(node.get(field, '')).rjust(width) if i else str(node[field]).ljust(width)
+                for i, (_, field, width) in enumerate(COLUMNS)))
+        print(f"queue: {report['queue']}  dupefilter: {report['dupefilter']}  "
+            f"start_urls: {report['start_urls']}  frontier: {report['frontier']}")
+        bloom = report['bloom']
+        if bloom:
+            print(f"bloom: {bloom['filters']} filters  fill {bloom['fill_ratio']:.2%}  "
+                f"memory {bloom['memory_bytes'] / 1048576:.1f} MB  false positive ~{bloom['false_positive_rate']:.2g}")
@@ -0,0 +1,245 @@
+'''端到端压测
+
+    scrapy loadtest [--districts 2 --pages 5 --rooms 10] [--latency 0.05] [--errors 403=0.01,...]
+                    [--proxies 4] [--redis-url URL] [--mongo-uri URI] [--timeout 600] [--output FILE]
+
+在临时目录中启动：
+    本地 redis（redis-server）、mongo（mongod），或使用 --redis-url、--mongo-uri 指定的服务；
+    模拟站点与代理 api（ziroom.fakesite，站点端口同时作为代理）；
+用模拟站点的价格图片训练数字模板，写入起始 url 后运行 scrapy crawl ziroom，
+结束后输出 json：耗时、items/s、响应/s、下载延迟分位数、调度队列中每个请求的平均字节数、
+站点各类页面的请求数与注入的错误数。
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import tempfile
+import subprocess
+from io import BytesIO
+from urllib.request import urlopen
+
+import redis
+from PIL import Image
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from ziroom.fakesite import digit_permutation, render_sprite
+from ziroom.ocr import DigitDecoder
+
+START_URL = 'http://sh.ziroom.com/z/nl/z3.html'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return '[options]'
+
+    def short_desc(self):
+        return '端到端压测：本地模拟站点 + 代理 api + redis/mongo，输出吞吐与延迟（json）'
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_argument('--districts', type=int, default=2, help='区数（默认 2）')
+        parser.add_argument('--pages', type=int, default=5, help='每个区的列表页数（默认 5）')
+        parser.add_argument('--rooms', type=int, default=10, help='每页房间数（默认 10）')
+        parser.add_argument('--latency', type=float, default=0.05, help='站点响应延迟（秒，默认 0.05）')
+        parser.add_argument('--jitter', type=float, default=0.5, help='延迟抖动比例（默认 0.5）')
+        parser.add_argument('--errors', default='302=0.005,403=0.005,478=0.01,510=0.01',
+            help='注入的错误状态码与概率（默认 302=0.005,403=0.005,478=0.01,510=0.01）')
+        parser.add_argument('--api-busy', type=float, default=0.0, help='代理 api 返回"系统繁忙"的概率')
+        parser.add_argument('--proxies', type=int, default=4, help='代理（站点端口）数（默认 4）')
+        parser.add_argument('--redis-url', help='使用已有的 redis（默认启动本地 redis-server）')
+        parser.add_argument('--mongo-uri', help='使用已有的 mongo（默认启动本地 mongod）')
+        parser.add_argument('--timeout', type=int, default=600, help='最长运行时间（秒，默认 600）')
+        parser.add_argument('--output', metavar='FILE', help='结果同时写入文件')
+        parser.add_argument('--keep', action='store_true', help='保留临时目录（日志、stats）')
+
+    def run(self, args, opts):
+        self.workdir = tempfile.mkdtemp(prefix='ziroom-loadtest-')
+        self.processes = []
+        try:
+            report = self._run(opts)
+        finally:
+            for p in reversed(self.processes):
+                p.terminate()
+                try:
+                    p.wait(10)
+                except subprocess.TimeoutExpired:
+                    p.kill()
+            if opts.keep:
+                print(f"临时目录：{self.workdir}", file=sys.stderr)
+            else:
+                shutil.rmtree(self.workdir, ignore_errors=True)
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        print(output)
+        if opts.output:
+            with open(opts.output, 'w', encoding='utf-8') as f:
+                f.write(output)
+
+    def _run(self, opts):
+        redis_url = opts.redis_url or self._start_redis()
+        mongo_uri = opts.mongo_uri or self._start_mongo()
+        api_port = free_port()
+        ports = [free_port() for _ in range(opts.proxies)]
+        self._spawn('fakesite', [
+            sys.executable, '-m', 'ziroom.fakesite',
+            '--api-port', str(api_port), '--ports', ','.join(map(str, ports)),
+            '--districts', str(opts.districts), '--pages', str(opts.pages),
+            '--rooms', str(opts.rooms), '--latency', str(opts.latency),
+            '--jitter', str(opts.jitter), '--errors', opts.errors, '--api-busy', str(opts.api_busy),
+        ])
+        if not all(wait_port(p) for p in ports + [api_port]):
+            raise UsageError('模拟站点启动失败，见临时目录中的 fakesite.log')
+
+        templates_path = os.path.join(self.workdir, 'ocr_templates.npz')
+        self._train_templates(templates_path)
+        stats_path = os.path.join(self.workdir, 'stats.json')
+        self._write_settings(redis_url, mongo_uri, api_port, len(ports), templates_path)
+
+        server = redis.from_url(redis_url)
+        start_urls_key = self.settings.get('REDIS_START_URLS_KEY', '%(name)s:start_urls') \
+            % {'name': 'ziroom'}
+        if self.settings.getbool('REDIS_START_URLS_AS_SET'):
+            server.sadd(start_urls_key, START_URL)
+        else:
+            server.lpush(start_urls_key, START_URL)
+
+        env = dict(os.environ)
+        env['SCRAPY_SETTINGS_MODULE'] = 'loadtest_settings'
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [self.workdir, os.getcwd(), env.get('PYTHONPATH')]))
+        start_time = time.time()
+        crawl = self._spawn('crawl', [
+            sys.executable, '-m', 'scrapy.cmdline', 'crawl', 'ziroom',
+            '-s', f"LOG_FILE={os.path.join(self.workdir, 'crawl.log')}",
+            '-s', f"STATS_FILE={stats_path}",
+        ], env=env)
+        try:
+            crawl.wait(opts.timeout)
+            timed_out = False
+        except subprocess.TimeoutExpired:
+            # 超时：先正常关闭（写入 stats），关闭卡住时（如 mongo 写入未完成）强制结束
+            crawl.terminate()
+            try:
+                crawl.wait(60)
+            except subprocess.TimeoutExpired:
+                crawl.kill()
+                crawl.wait()
+            timed_out = True
+        seconds = time.time() - start_time
+
+        with urlopen(f"http://127.0.0.1:{api_port}/_stats", timeout=10) as res:
+            site_stats = json.loads(res.read().decode())
+        stats = {}
+        if os.path.exists(stats_path):
+            with open(stats_path, encoding='utf-8') as f:
+                stats = json.load(f)
+        items = stats.get('item_scraped_count', 0)
+        responses = stats.get('response_received_count', 0)
+        # 速率按 crawl 运行时长计算（不含启动、超时后的关闭）
+        elapsed = stats.get('elapsed_time_seconds') or seconds
+        enqueued = stats.get('scheduler/enqueued/redis', 0)
+        return {
+            'seconds': round(seconds, 1),
+            'elapsed_seconds': round(elapsed, 1),
+            'timed_out': timed_out,
+            'finish_reason': stats.get('finish_reason'),
+            'site': {
+                'districts': opts.districts, 'pages': opts.pages, 'rooms': opts.rooms,
+                'latency': opts.latency, 'errors': opts.errors, 'proxies': opts.proxies,
+            },
+            'items': items,
+            'items_per_second': round(items / elapsed, 2) if elapsed else None,
+            'responses': responses,
+            'responses_per_second': round(responses / elapsed, 2) if elapsed else None,
+            'download_latency': stats.get('download_latency'),
+            'status_counts': {k: v for k, v in stats.items()
+                if k.startswith('downloader/response_status_count/')},
+            'retries': stats.get('retry/count', 0),
+            # 每个请求：队列中的字节数、移出队列的房间数据字节数（ziroom.squeue）
+            'queue_bytes_per_request': round(stats.get('scheduler/queue_bytes', 0) / enqueued, 1) if enqueued else None,
+            'payload_bytes_per_request': round(stats.get('scheduler/payload_bytes', 0) / enqueued, 1) if enqueued else None,
+            'site_requests': site_stats,
+        }
+
+    def _spawn(self, name, cmd, env=None):
+        log = open(os.path.join(self.workdir, f"{name}.log"), 'wb')
+        p = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env)
+        self.processes.append(p)
+        return p
+
+    def _start_redis(self):
+        if not shutil.which('redis-server'):
+            raise UsageError('未找到 redis-server，请使用 --redis-url 指定 redis')
+        port = free_port()
+        self._spawn('redis', ['redis-server', '--port', str(port), '--bind', '127.0.0.1',
+            '--save', '', '--appendonly', 'no', '--dir', self.workdir])
+        if not wait_port(port):
+            raise UsageError('redis-server 启动失败，见临时目录中的 redis.log')
+        return f"redis://127.0.0.1:{port}/0"
+
+    def _start_mongo(self):
+        if not shutil.which('mongod'):
+            raise UsageError('未找到 mongod，请使用 --mongo-uri 指定 mongo')
+        port = free_port()
+        dbpath = os.path.join(self.workdir, 'mongo')
+        os.makedirs(dbpath)
+        self._spawn('mongo', ['mongod', '--port', str(port), '--bind_ip', '127.0.0.1',
+            '--dbpath', dbpath, '--quiet'])
+        if not wait_port(port, timeout=60):
+            raise UsageError('mongod 启动失败，见临时目录中的 mongo.log')
+        return f"mongodb://127.0.0.1:{port}"
+
+    def _train_templates(self, path):
+        '''用模拟站点的价格图片训练数字模板（站点图片与真实站点字体不同）'''
+        decoder = DigitDecoder()
+        for seed in range(20):
+            digits = digit_permutation(seed)
+            decoder.learn(Image.open(BytesIO(render_sprite(digits))), digits)
+        decoder.save(path)
+
+    def _write_settings(self, redis_url, mongo_uri, api_port, proxies, templates_path):
+        '''压测配置：在项目配置基础上，改为本地服务'''
+        overrides = {
+            'REDIS_URL': redis_url,
+            'MONGO_URI': mongo_uri,
+            'MONGO_DATABASE': 'ziroom_loadtest',
+            'MONGO_COLLECTION': 'rooms',
+            'MONGO_USERNAME': None,
+            'MONGO_PASSWORD': None,
+            'PROXY_API_URL': f"http://127.0.0.1:{api_port}/xdaili",
+            'PROXY_API_INTERVAL': 0.2,
+            'PROXY_POOL_SIZE': proxies,
+            'PROXY_CHECK_URL': 'http://www.ziroom.com/robots.txt',
+            'FILES_STORE': os.path.join(self.workdir, 'files'),
+            'OCR_TEMPLATES_PATH': templates_path,
+            'IDLE_NUMBER': 3,
+            'FIXTURES_DIR': '',
+        }
+        lines = [f"from {os.environ.get('SCRAPY_SETTINGS_MODULE', 'ziroom.settings')} import *"]
+        lines += [f"{k} = {v!r}" for k, v in overrides.items()]
+        with open(os.path.join(self.workdir, 'loadtest_settings.py'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
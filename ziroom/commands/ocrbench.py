@@ -0,0 +1,112 @@
+'''价格图片识别评测
+
+    scrapy ocrbench [--train] [--labels labels.json] [--limit N]
+
+以 FILES_STORE 中已保存的价格图片为语料：
+--train 时用 tesseract 结果学习数字模板并保存到 OCR_TEMPLATES_PATH；
+统计模板匹配的准确率（以 --labels 标注为准，无标注时以 tesseract 结果为准）、
+置信覆盖率，以及模板匹配与 tesseract 的识别速度（张/秒）。
+'''
+
+import os
+import json
+import time
+import random
+
+from PIL import Image
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from ziroom.ocr import DigitDecoder
+from ziroom.utils import orc_img
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return '[options]'
+
+    def short_desc(self):
+        return '价格图片识别评测：训练数字模板，统计准确率与速度'
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_argument('--train', action='store_true',
+            help='用 tesseract 结果学习数字模板（取语料的 --train-ratio），并保存模板')
+        parser.add_argument('--train-ratio', type=float, default=0.5,
+            help='用于训练的语料比例（默认 0.5）')
+        parser.add_argument('--labels', metavar='FILE',
+            help='标注文件（json）：{"文件相对路径": "10位数字", ...}')
+        parser.add_argument('--limit', type=int, default=0, help='最多使用的图片数')
+        parser.add_argument('--dir', metavar='DIR', help='图片目录（默认 FILES_STORE）')
+
+    def run(self, args, opts):
+        img_dir = opts.dir or self.settings.get('FILES_STORE')
+        if not img_dir or not os.path.isdir(img_dir):
+            raise UsageError(f"图片目录不存在：{img_dir}")
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(img_dir) for name in names
+            if name.lower().endswith('.png')
+        )
+        random.Random(0).shuffle(paths)
+        if opts.limit:
+            paths = paths[:opts.limit]
+        if not paths:
+            raise UsageError(f"未找到图片：{img_dir}")
+        labels = {}
+        if opts.labels:
+            with open(opts.labels, encoding='utf-8') as f:
+                labels = {os.path.join(img_dir, k): v for k, v in json.load(f).items()}
+
+        templates_path = self.settings.get('OCR_TEMPLATES_PATH')
+        decoder = DigitDecoder(
+            templates_path=None if opts.train else templates_path,
+            min_confidence=self.settings.getfloat('OCR_MIN_CONFIDENCE', 0.85),
+        )
+        images = {}
+        for path in paths:
+            img = Image.open(path)
+            img.load()
+            images[path] = img
+
+        # tesseract：作为无标注时的参考结果，同时统计速度
+        start_time = time.time()
+        truth = {path: (orc_img(img) or '').strip() for path, img in images.items()}
+        tesseract_seconds = time.time() - start_time
+        truth.update(labels)
+
+        eval_paths = paths
+        if opts.train:
+            n_train = int(len(paths) * opts.train_ratio)
+            learned = sum(decoder.learn(images[p], truth[p]) for p in paths[:n_train])
+            eval_paths = paths[n_train:]
+            if decoder.templates is None:
+                raise UsageError(f"训练失败：{learned} 张图片可用，未学习到全部 10 个数字")
+            if templates_path:
+                decoder.save(templates_path)
+            print(f"训练：{learned}/{n_train} 张图片，模板已保存：{templates_path}")
+        elif decoder.templates is None:
+            raise UsageError('无可用模板：请先使用 --train 训练')
+
+        start_time = time.time()
+        results = {p: decoder.decode(images[p]) for p in eval_paths}
+        decoder_seconds = time.time() - start_time
+
+        confident = [p for p, (digits, conf) in results.items() if conf >= decoder.min_confidence]
+        correct = [p for p in confident if results[p][0] == truth[p]]
+        report = {
+            'images': len(eval_paths),
+            'reference': 'labels' if labels else 'tesseract',
+            'confident': len(confident),
+            'coverage': round(len(confident) / len(eval_paths), 4) if eval_paths else 0,
+            'accuracy': round(len(correct) / len(confident), 4) if confident else 0,
+            'decoder_images_per_second': round(len(eval_paths) / decoder_seconds, 1) \
+                if decoder_seconds else None,
+            'tesseract_images_per_second': round(len(paths) / tesseract_seconds, 1) \
+                if tesseract_seconds else None,
+        }
+        print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,262 @@
+'''解析、管道离线评测
+
+    scrapy parsebench [FIXTURES_DIR] [--rounds N] [--output FILE] [--baseline FILE]
+
+以 FixtureRecorderDM 记录的响应（FIXTURES_DIR/index.jsonl）为语料，离线（不联网、不连接 redis、mongo）
+评测各阶段；未指定语料目录且未配置 FIXTURES_DIR 时，以模拟站点（ziroom.fakesite）生成的页面为语料
+（写入临时目录，价格图片模板用模拟站点的图片训练）：
+    parse_list、parse_detail、parse_keeper、parse_payment_air、parse_allocation - spider 回调
+    price_sprite    - 价格图片模板匹配识别（需已训练模板，见 scrapy ocrbench；模拟站点语料除外）
+    format_item     - SaveMain.format_item（parse_detail 的结果）
+    string2number   - 面积、楼层、户型、经纬度转换
+    combine_price   - 价格组合
+输出 json：每个阶段的调用次数、产出数、总耗时、每次调用耗时（平均、p95）、items/s、峰值内存（tracemalloc）；
+以及回调产出的请求（列表页价格图片请求的房间另生成详情页请求）在调度队列中每个请求的平均字节数（queue_bytes）：
+    pickle - scrapy_redis 默认序列化；msgpack - ziroom.serializer；
+    offloaded - ziroom.serializer 且房间数据移出队列（payload 为 redis hash 中房间数据的字节数）
+items/s：回调为产出的 item 数（只产出请求的回调为请求数），其他阶段为调用次数。
+--baseline 为之前的输出文件，额外输出各阶段速度比（>1 为变快）。
+'''
+
+import os
+import sys
+import json
+import time
+import copy
+import shutil
+import tempfile
+import platform
+import tracemalloc
+from io import BytesIO
+
+from PIL import Image
+from scrapy import Item
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.http import Request, HtmlResponse, TextResponse
+from scrapy_redis import picklecompat
+
+from ziroom import serializer
+from ziroom.fakesite import digit_permutation, render_sprite, write_fixtures
+from ziroom.items import RoomRecord
+from ziroom.ocr import DigitDecoder
+from ziroom.utils import combine_price, string2number
+
+# 回调 -> 响应类型
+CALLBACKS = {
+    'parse_list': HtmlResponse,
+    'parse_detail': HtmlResponse,
+    'parse_keeper': TextResponse,
+    'parse_payment_air': TextResponse,
+    'parse_allocation': TextResponse,
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return '[FIXTURES_DIR] [options]'
+
+    def short_desc(self):
+        return '解析、管道离线评测：items/s、每次调用耗时、峰值内存（json）'
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_argument('--rounds', type=int, default=3, help='计时轮数（默认 3）')
+        parser.add_argument('--output', metavar='FILE', help='结果同时写入文件')
+        parser.add_argument('--baseline', metavar='FILE', help='对比的历史结果文件')
+
+    def run(self, args, opts):
+        fixtures_dir = args[0] if args else self.settings.get('FIXTURES_DIR')
+        if fixtures_dir:
+            self._run(fixtures_dir, opts, generated=False)
+            return
+        fixtures_dir = tempfile.mkdtemp(prefix='ziroom-parsebench-')
+        try:
+            counts = write_fixtures(fixtures_dir)
+            print(f"未指定语料，使用模拟站点生成的语料：{counts}", file=sys.stderr)
+            self._run(fixtures_dir, opts, generated=True)
+        finally:
+            shutil.rmtree(fixtures_dir, ignore_errors=True)
+
+    def _run(self, fixtures_dir, opts, generated):
+        index_path = os.path.join(fixtures_dir, 'index.jsonl')
+        if not os.path.exists(index_path):
+            raise UsageError(f"未找到语料索引：{index_path}")
+        fixtures = {}
+        with open(index_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    with open(os.path.join(fixtures_dir, record['path']), 'rb') as body:
+                        record['body'] = body.read()
+                    fixtures.setdefault(record['callback'], []).append(record)
+
+        # 离线：不使用 redis 缓存、增量索引、抓取前沿（列表页分页直接作为请求产出）
+        self.settings.set('INCREMENTAL_ENABLED', False, priority='cmdline')
+        self.settings.set('FRONTIER_ENABLED', False, priority='cmdline')
+        self.settings.set('STEWARD_CACHE_TTL', 0, priority='cmdline')
+        self.settings.set('CONFIG_CACHE_TTL', 0, priority='cmdline')
+        spider_cls = self.crawler_process.spider_loader.load('ziroom')
+        spider = spider_cls()
+        spider.settings = self.settings
+        spider.server = None
+
+        stages = {}
+        outputs = {}
+        for callback, response_cls in CALLBACKS.items():
+            if callback not in fixtures:
+                continue
+            method = getattr(spider, callback)
+            calls = [(lambda r=r: list(method(self._response(response_cls, r))))
+                for r in fixtures[callback]]
+            stages[callback], outputs[callback] = self._bench(calls, opts.rounds, collect=True)
+
+        if 'parse_price_sprite' in fixtures:
+            decoder = DigitDecoder(
+                templates_path=self.settings.get('OCR_TEMPLATES_PATH'),
+                min_confidence=self.settings.getfloat('OCR_MIN_CONFIDENCE', 0.85),
+            )
+            if generated:
+                # 模拟站点的图片与真实站点字体不同：用模拟站点的图片训练
+                decoder = DigitDecoder(min_confidence=decoder.min_confidence)
+                for seed in range(20):
+                    digits = digit_permutation(seed)
+                    decoder.learn(Image.open(BytesIO(render_sprite(digits))), digits)
+            if decoder.templates is not None:
+                images = []
+                for r in fixtures['parse_price_sprite']:
+                    img = Image.open(BytesIO(r['body']))
+                    img.load()
+                    images.append(img)
+                calls = [(lambda img=img: decoder.decode(img)) for img in images]
+                stages['price_sprite'], _ = self._bench(calls, opts.rounds)
+
+        items = [o for o in outputs.get('parse_detail', []) if isinstance(o, Item)]
+        if items:
+            from ziroom.pipelines import SaveMain
+            save_main = SaveMain()
+            # format_item 会修改 item：每次调用使用预先复制的 item
+            copies = [copy.deepcopy(dict(item)) for item in items for _ in range(opts.rounds + 1)]
+            calls = [(lambda: save_main.format_item(copies.pop())) for _ in items]
+            stages['format_item'], _ = self._bench(calls, opts.rounds)
+            values = [item.get(k) for item in items
+                for k in ('area', 'floor', 'house_type', 'map_position')]
+            values = [copy.deepcopy(v) for v in values for _ in range(opts.rounds + 1)]
+            calls = [(lambda: string2number(values.pop())) for _ in range(len(values) // (opts.rounds + 1))]
+            stages['string2number'], _ = self._bench(calls, opts.rounds)
+
+        digits = '8160354279'
+        positions = [[(i + j) % 10 for j in range(4)] for i in range(100)]
+        calls = [(lambda p=p: combine_price(digits, p)) for p in positions]
+        stages['combine_price'], _ = self._bench(calls, opts.rounds)
+
+        report = {
+            'time': int(time.time()),
+            'python': platform.python_version(),
+            'rounds': opts.rounds,
+            'corpus': 'fakesite' if generated else fixtures_dir,
+            'fixtures': {k: len(v) for k, v in fixtures.items()},
+            'stages': stages,
+            'queue_bytes': self._queue_bytes(spider, outputs),
+        }
+        if opts.baseline:
+            with open(opts.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)['stages']
+            report['speedup'] = {
+                k: round(baseline[k]['per_call_ms'] / v['per_call_ms'], 2)
+                for k, v in stages.items()
+                if k in baseline and baseline[k]['per_call_ms'] and v['per_call_ms']
+            }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        print(output)
+        if opts.output:
+            with open(opts.output, 'w', encoding='utf-8') as f:
+                f.write(output)
+
+    def _bench(self, calls, rounds, collect=False):
+        '''计时 rounds 轮，另用一轮统计峰值内存
+        @:param collect 是否收集产出（spider 回调）
+        @:return (阶段统计, 第一轮的产出)
+        '''
+        outputs = []
+        durations = []
+        for n in range(rounds):
+            for call in calls:
+                start_time = time.perf_counter()
+                try:
+                    result = call()
+                except Exception as e:
+                    print(f"error: {e!r}", file=sys.stderr)
+                    result = None
+                durations.append(time.perf_counter() - start_time)
+                if collect and n == 0 and result:
+                    outputs.extend(result)
+        tracemalloc.start()
+        for call in calls:
+            try:
+                call()
+            except Exception:
+                pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        seconds = sum(durations)
+        items = sum(1 for o in outputs if isinstance(o, Item))
+        requests = sum(1 for o in outputs if isinstance(o, Request))
+        produced = (items or requests) if collect else len(calls)
+        return {
+            'calls': len(calls),
+            'items': items,
+            'requests': requests,
+            'seconds': round(seconds, 4),
+            'per_call_ms': round(seconds / len(durations) * 1000, 4) if durations else None,
+            'p95_ms': round(percentile(durations, 0.95) * 1000, 4),
+            'items_per_second': round(produced * rounds / seconds, 1) if seconds else None,
+            'peak_memory_bytes': peak,
+        }, outputs
+
+    @staticmethod
+    def _queue_bytes(spider, outputs):
+        '''回调产出的请求序列化后的平均字节数（按请求的回调）'''
+        requests = [o for result in outputs.values() for o in result if isinstance(o, Request)]
+        for request in list(requests):
+            if 'rooms' in request.meta:
+                requests.extend(spider._detail_requests(request.meta['rooms']))
+        sizes = {}
+        for request in requests:
+            obj = request.to_dict(spider=spider)
+            records = []
+            offloaded = serializer.dumps(obj, offload=records.append)
+            payload = sum(len(k) + len(v)
+                for record in records for k, v in serializer.record_to_hash(record).items())
+            size = sizes.setdefault(obj['callback'], [0, 0, 0, 0, 0])
+            for i, n in enumerate((1, len(picklecompat.dumps(obj)), len(serializer.dumps(obj)),
+                    len(offloaded), payload)):
+                size[i] += n
+        return {
+            callback: {
+                'requests': n,
+                'pickle': round(pickled / n, 1),
+                'msgpack': round(packed / n, 1),
+                'offloaded': round(offloaded / n, 1),
+                'payload': round(payload / n, 1),
+            }
+            for callback, (n, pickled, packed, offloaded, payload) in sizes.items()
+        }
+
+    @staticmethod
+    def _response(response_cls, record):
+        meta = dict(record['meta'])
+        if record['callback'] == 'parse_detail':
+            meta = {'item': RoomRecord(room_id=meta.get('room_id'), price_position=[])}
+        request = Request(record['url'], meta=meta)
+        return response_cls(record['url'], body=record['body'], request=request)
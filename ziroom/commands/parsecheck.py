@@ -0,0 +1,339 @@
+'''页面提取一致性检查
+
+    scrapy parsecheck FILE_OR_DIR [...] [--url URL] [--rounds N]
+
+以保存的列表页、详情页（html）为语料，对比 ziroom.extract（预编译 lxml）与原 parsel 实现
+（本文件中的 legacy_list、legacy_detail，保留原 XPath 作为参照）的提取结果与速度（页/秒）。
+页面类型按内容判断：含 houseList 为列表页，含 room_id 为详情页。
+room_style、is_near_subway 在原实现中永远为 None（XPath 中混入了续行空白），单独统计为 fixed。
+列表页同时统计排队中的详情页请求（meta['item']）平均占用的内存与序列化大小：
+原 ZiroomItem（legacy_room_item）与 RoomRecord（current_room_record）对比。
+'''
+
+import os
+import json
+import time
+import pickle
+import tracemalloc
+from urllib.parse import urlparse
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.http import HtmlResponse, Request
+
+from ziroom.extract import parse_html, extract_list, detail_ids, extract_detail
+from ziroom.items import ZiroomItem, RoomRecord
+
+# 原实现有误、新实现已修正的字段
+FIXED_FIELDS = {'room_style', 'is_near_subway'}
+
+
+def legacy_list(response):
+    '''原 parse_list 的提取逻辑（parsel），返回值与 extract_list 相同'''
+    scheme = urlparse(response.url).scheme
+    price_png_url = response.xpath('//script[contains(text(), \
+        "offset_unit")]').re_first(r'image":"//(.+)",')
+    price_positions_str = response.xpath('//script[contains(text(), \
+        "offset_unit")]').re_first(r'"offset":\[(.+)\]\};')
+    page = {
+        'price_png_url': price_png_url,
+        'price_positions': None,
+        'city': response.xpath('//span[@id="curCityName"]/text()').extract_first(),
+        'total_page': response.xpath('//div[@id="page"]/span[contains(text(), \
+            "共")]/text()').re_first(r'共(\d+)页'),
+        'rooms': [],
+    }
+    if price_positions_str:
+        page['price_positions'] = list(map(
+            lambda x: list(map(int, x.split(','))),
+            price_positions_str.strip('[').strip(']').split('],[')
+        ))
+    for v in response.xpath('//ul[@id="houseList"]/li'):
+        room = {}
+        room['payment'] = v.xpath('div[@class="priceDetail"]/p[@class="price"]\
+            /span[@class="gray-6"]/text()').re_first(r'\((.+)\)')
+        room['thumb_src'] = scheme + '://' + \
+            v.xpath('div[@class="img pr"]/a/img/@_src').re_first(r'^//(.+)')
+        room['room_id'] = int(v.xpath('div[@class="txt"]/h3/a/@href')\
+            .re_first(r'/(\d+)\.html'))
+        room['product'] = v.xpath('div[@class="txt"]/h3/a/text()')\
+            .re_first(r'(\S+) · .+')
+        room['room_name'] = v.xpath('div[@class="txt"]/h3/a/text()')\
+            .re_first(r'\S+ · (.+)')
+        room['room_style'] = v.xpath('div[@class="txt"]/p[@class="room_tags \
+            clearfix"]//span[@class="style"]/text()').extract_first()
+        room['is_first_rent'] = v.xpath('div[@class="txt"]/h4/span\
+            [@class="green"][contains(text(), "首次出租")]/text()').re_first(r'\S+')
+        room['is_near_subway'] = v.xpath('div[@class="txt"]/p[@class="room_tags \
+            clearfix"]//span[text()="离地铁近"]/text()').extract_first()
+        room['is_private_bathroom'] = v.xpath('div[@class="txt"]/\
+            p[@class="room_tags clearfix"]//span[text()="独卫"]/text()').extract_first()
+        room['is_private_balcony'] = v.xpath('div[@class="txt"]/\
+            p[@class="room_tags clearfix"]//span[text()="独立阳台"]/text()').extract_first()
+        room['heating'] = v.xpath('div[@class="txt"]/p[@class=\
+            "room_tags clearfix"]//span[text()="集体供暖" \
+            or text()="独立供暖" or text()="中央空调"]/text()').extract_first()
+        room['url'] = scheme + '://' + \
+            v.xpath('div[@class="txt"]/h3/a/@href').re_first(r'//(.+html)')
+        page['rooms'].append(room)
+    return page
+
+
+def legacy_detail(response):
+    '''原 parse_detail 的提取逻辑（parsel），返回 (ids, 主信息)，与 detail_ids、extract_detail 相同'''
+    scheme = urlparse(response.url).scheme
+    ids = {
+        'room_id': response.xpath('//input[@id="room_id"]/@value').extract_first(),
+        'house_id': response.xpath('//input[@id="house_id"]/@value').extract_first(),
+        'resblock_id': response.xpath('//input[@id="resblock_id"]/@value').extract_first(),
+    }
+    if not all(ids.values()):
+        return ids, None
+    item = {}
+    item['district'] = response.xpath('//span[@class="ellipsis"]/text()')\
+        .re(r'\[?(\S+)\s+(\S+)\]?')
+    item['room_sn'] = response.xpath('//h3[@class="fb"]/text()').re_first(r'\S+')
+    item['room_introduce'] = response.xpath('//p/strong[text()="房源介绍："]\
+        /parent::node()/text()').extract_first()
+    item['community'] = response.xpath('//div[@class="node_infor area"]/\
+        a[last()]/text()').re_first('(.+)租房信息')
+    detail_room = response.xpath('//ul[@class="detail_room"]')
+    item['subway'] = detail_room.xpath('li[contains(text(), "交通：")]/span/text() | \
+        li[contains(text(), "交通：")]/span/span/p/text()').re(r'距[\s\S+]+米')
+    item['rent_type'] = detail_room.xpath('//span[@class="icons"]/text()').extract_first()
+    item['area'] = detail_room.xpath('li[contains(text(), "面积：")]/text()')\
+        .re_first(r'面积：\s*(\S+)\s+')
+    item['floor'] = detail_room.xpath('li[contains(text(), "楼层：")]/text()')\
+        .re(r'楼层：\s*(\d+)/(\d+)层')
+    item['towards'] = detail_room.xpath('li[contains(text(), "朝向：")]/text()')\
+        .re_first(r'朝向：\s*(\S+)\s*')
+    item['house_type'] = detail_room.xpath('li[contains(text(), "户型：")]/text()')\
+        .re(r'户型：\s*(\d+)室(?:(\d+)厅)?')
+    item['rent_status'] = response.xpath('//a[@id="zreserve"]/text()').extract_first()
+    img_sel =  response.xpath('//div[@id="lofslidecontent45"]//\
+        ul[@class="lof-main-wapper"]/li/a/img')
+    if img_sel:
+        item['photos'] = []
+        for img in img_sel:
+            tmp_src = img.xpath('@src').extract_first()
+            if tmp_src.find('http:') == -1:
+                tmp_src = scheme + '://' + tmp_src.strip('//').strip('/')
+            item['photos'].append({
+                'path': None,
+                'thumb_path': None,
+                'title': img.xpath('@title').extract_first(),
+                'origin_src': tmp_src.replace('v180x135', 'v800x600'),
+            })
+    item['map_position'] = response.xpath('//input[@id="mapsearchText"]/\
+        @data-lng | //input[@id="mapsearchText"]/@data-lat').extract()
+    roommates_sel = response.xpath('//div[@class="greatRoommate"]/ul/li/div')
+    if roommates_sel:
+        item['roommates'] = []
+        for mate_sel in roommates_sel:
+            mate = {}
+            mate['gender'] = mate_sel.xpath('parent::node()/@class').re_first(r'\S+')
+            mate['room'] = mate_sel.xpath('div[@class="user_top clearfix"]/\
+                p/text()').extract_first()
+            mate['status'] = mate_sel.xpath('div[@class="user_top clearfix"]/\
+                span[@class="tags"]/text()').extract_first()
+            mate['sign'] = mate_sel.xpath('div[@class="user_center"]/p[1]/\
+                text()').extract_first()
+            mate['jobs'] = mate_sel.xpath('div[@class="user_center"]/p[2]/\
+                span[1]/text()').extract_first()
+            mate['check_in_time'] = mate_sel.xpath('div[@class="user_bottom"]/\
+                p/text()').re_first(r'\S+')
+            item['roommates'].append(mate)
+    return ids, item
+
+
+def legacy_room_item(page, room, k, referer):
+    '''原 parse_list 中随请求传递的 ZiroomItem'''
+    item = ZiroomItem()
+    item['city'] = page['city']
+    item['price'] = {
+        'num': None,
+        'payment': room['payment'],
+        'path': None,
+        'origin_src': page['price_png_url'],
+        'position': page['price_positions'][k],
+        'referer': referer,
+    }
+    item['title_thumb'] = {'path': None, 'referer': referer, 'origin_src': room['thumb_src']}
+    for field in RoomRecord.item_fields:
+        if field in room:
+            item[field] = room[field]
+    return item
+
+
+def current_room_record(page, room, k, referer):
+    '''parse_list 中随请求传递的 RoomRecord'''
+    return RoomRecord(
+        city=page['city'],
+        price_payment=room['payment'],
+        price_position=page['price_positions'][k],
+        price_src=page['price_png_url'],
+        thumb_src=room['thumb_src'],
+        referer=referer,
+        **{field: room[field] for field in RoomRecord.item_fields if field in room}
+    )
+
+
+def current_list(response):
+    return extract_list(parse_html(response), urlparse(response.url).scheme)
+
+
+def current_detail(response):
+    ids = detail_ids(response.text)
+    if not all(ids.values()):
+        return ids, None
+    return ids, extract_detail(parse_html(response), urlparse(response.url).scheme)
+
+
+def page_kind(body):
+    if b'houseList' in body:
+        return 'list'
+    if b'room_id' in body:
+        return 'detail'
+    return None
+
+
+def list_fields(page):
+    '''列表页结果展开为 {字段: 值}，房间字段为 rooms[i].字段'''
+    fields = {k: v for k, v in page.items() if k != 'rooms'}
+    fields['rooms'] = len(page['rooms'])
+    for i, room in enumerate(page['rooms']):
+        for k, v in room.items():
+            fields[f"rooms[{i}].{k}"] = v
+    return fields
+
+
+def detail_fields(result):
+    ids, item = result
+    fields = dict(ids)
+    fields.update(item or {})
+    return fields
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return 'FILE_OR_DIR [...] [options]'
+
+    def short_desc(self):
+        return '页面提取一致性检查：对比预编译 lxml 提取与原 parsel 实现的结果、速度'
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_argument('--url', default='http://sh.ziroom.com/',
+            help='页面 url（用于补全协议，默认 http://sh.ziroom.com/）')
+        parser.add_argument('--rounds', type=int, default=5, help='计时轮数（默认 5）')
+
+    def run(self, args, opts):
+        paths = []
+        for arg in args:
+            if os.path.isdir(arg):
+                paths.extend(sorted(
+                    os.path.join(root, name)
+                    for root, _, names in os.walk(arg) for name in names
+                    if name.lower().endswith(('.html', '.htm'))
+                ))
+            else:
+                paths.append(arg)
+        pages = {'list': [], 'detail': []}
+        for path in paths:
+            with open(path, 'rb') as f:
+                body = f.read()
+            kind = page_kind(body)
+            if kind:
+                pages[kind].append((path, body))
+        if not (pages['list'] or pages['detail']):
+            raise UsageError('未找到列表页、详情页')
+
+        checks = {
+            'list': (legacy_list, current_list, list_fields),
+            'detail': (legacy_detail, current_detail, detail_fields),
+        }
+        report = {}
+        for kind, (legacy, current, flatten) in checks.items():
+            if not pages[kind]:
+                continue
+            report[kind] = self._compare(pages[kind], legacy, current, flatten, opts)
+        if pages['list']:
+            report['list']['pending_request'] = self._pending_request(pages['list'], opts)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    def _compare(self, pages, legacy, current, flatten, opts):
+        mismatches, fixed, errors = {}, {}, []
+        for path, body in pages:
+            results = []
+            for func in (legacy, current):
+                try:
+                    results.append(flatten(func(self._response(body, opts.url))))
+                except Exception as e:
+                    results.append(None)
+                    errors.append(f"{func.__name__} {path}: {e!r}")
+            if None in results:
+                continue
+            old, new = results
+            for key in sorted(set(old) | set(new)):
+                if old.get(key) == new.get(key):
+                    continue
+                field = key.rsplit('.', 1)[-1]
+                target = fixed if field in FIXED_FIELDS and old.get(key) is None else mismatches
+                target.setdefault(field, []).append(
+                    {'page': path, 'key': key, 'legacy': old.get(key), 'current': new.get(key)})
+
+        speed = {}
+        for func in (legacy, current):
+            # 每轮重新构建 response，避免 parsel 缓存的 Selector 影响计时
+            responses = [self._response(body, opts.url) for _ in range(opts.rounds)
+                for _, body in pages]
+            start_time = time.perf_counter()
+            for response in responses:
+                try:
+                    func(response)
+                except Exception:
+                    pass
+            seconds = time.perf_counter() - start_time
+            speed[func.__name__] = round(len(responses) / seconds, 1) if seconds else None
+        return {
+            'pages': len(pages),
+            'errors': errors,
+            'mismatches': {k: {'count': len(v), 'examples': v[:3]} for k, v in mismatches.items()},
+            'fixed': {k: len(v) for k, v in fixed.items()},
+            'pages_per_second': speed,
+            'speedup': round(speed[current.__name__] / speed[legacy.__name__], 2) \
+                if all(speed.values()) else None,
+        }
+
+    def _pending_request(self, pages, opts):
+        '''排队中的详情页请求（meta['item']）的平均内存占用、序列化大小（字节）'''
+        rooms = []
+        for _, body in pages:
+            response = self._response(body, opts.url)
+            page = current_list(response)
+            if page['price_positions']:
+                rooms.extend((page, room, k, response.url) for k, room in enumerate(page['rooms']))
+        if not rooms:
+            return None
+        rtn = {}
+        for build in (legacy_room_item, current_room_record):
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            requests = [Request(room['url'], meta={'item': build(page, room, k, referer)})
+                for page, room, k, referer in rooms]
+            memory = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+            pickled = sum(len(pickle.dumps(r.meta['item'], protocol=-1)) for r in requests)
+            rtn[build.__name__] = {
+                'memory_bytes': round(memory / len(requests)),
+                'pickled_item_bytes': round(pickled / len(requests)),
+            }
+        return rtn
+
+    @staticmethod
+    def _response(body, url):
+        return HtmlResponse(url, body=body)
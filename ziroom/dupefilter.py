@@ -0,0 +1,195 @@
+'''布隆过滤器去重（DUPEFILTER_CLASS）
+
+scrapy_redis RFPDupeFilter 在 redis 集合中为每个请求保存 40 字符的指纹，SCHEDULER_PERSIST 时只增不减。
+BloomDupeFilter 改为可扩展布隆过滤器（scalable bloom filter），每个指纹约占 -log2(p)/ln2 位：
+    {<SCHEDULER_DUPEFILTER_KEY>}:bloom     - hash：过滤器个数（filters），每个过滤器的位数（m:i）、哈希函数个数（k:i）、
+                                             容量（n:i）、已加入的指纹数（count:i）
+    {<SCHEDULER_DUPEFILTER_KEY>}:bloom:<i> - 第 i 个过滤器的位图
+第 i 个过滤器容量为 BLOOM_CAPACITY * BLOOM_GROWTH^i，误判率为 BLOOM_ERROR_RATE * (1 - r) * r^i（r 为 BLOOM_TIGHTENING），
+总误判率不超过 BLOOM_ERROR_RATE；当前过滤器满时新建下一个。
+检查与加入在 lua 脚本中完成（原子操作，多个节点共用），一次调用可检查一批指纹（requests_seen）。
+位图 key 在 lua 中由前缀拼接（过滤器个数不固定，无法全部在 KEYS 中声明）；
+所有 key 以 {<SCHEDULER_DUPEFILTER_KEY>} 为 hash tag，位于 Redis Cluster 的同一个 slot，脚本在集群中同样可用。
+过滤器参数在新建时写入 redis，之后修改配置只影响新建的过滤器。
+'''
+
+import time
+import logging
+
+from scrapy_redis import defaults
+from scrapy_redis.connection import get_redis_from_settings
+from scrapy_redis.dupefilter import RFPDupeFilter
+
+
+class BloomDupeFilter(RFPDupeFilter):
+
+    # 检查一批指纹，未出现过的加入最后一个过滤器（满时新建）
+    # KEYS[1]：参数 hash；KEYS[2]：位图 key 前缀（与 KEYS[1] 同一 hash tag，拼接出的位图 key 与其在同一 slot）
+    # ARGV：容量、总误判率、容量增长倍数、误判率收紧比例，之后每个指纹两个哈希值（h1、h2）
+    # 返回：每个指纹是否已出现过（1/0）
+    _LUA_CHECK_ADD = '''
+    local meta, prefix = KEYS[1], KEYS[2]
+    local capacity, error_rate = tonumber(ARGV[1]), tonumber(ARGV[2])
+    local growth, tightening = tonumber(ARGV[3]), tonumber(ARGV[4])
+    local fields = {}
+    local info = redis.call('HGETALL', meta)
+    for i = 1, #info, 2 do
+        fields[info[i]] = tonumber(info[i + 1])
+    end
+    local filters = {}
+    for i = 0, (fields['filters'] or 0) - 1 do
+        filters[i + 1] = {key = prefix .. i, m = fields['m:' .. i], k = fields['k:' .. i],
+            n = fields['n:' .. i], count = fields['count:' .. i] or 0, added = 0}
+    end
+    local function new_filter()
+        local i = #filters
+        local n = math.floor(capacity * growth ^ i)
+        local p = error_rate * (1 - tightening) * tightening ^ i
+        -- 位图最大 2^32 位（redis 字符串 512MB）
+        local m = math.min(math.ceil(-n * math.log(p) / math.log(2) ^ 2), 4294967296)
+        local k = math.max(math.ceil(-math.log(p) / math.log(2)), 1)
+        local f = {key = prefix .. i, m = m, k = k, n = n, count = 0, added = 0}
+        filters[i + 1] = f
+        redis.call('HSET', meta, 'filters', i + 1, 'm:' .. i, m, 'k:' .. i, k, 'n:' .. i, n)
+        return f
+    end
+    local result = {}
+    for j = 5, #ARGV, 2 do
+        local h1, h2 = tonumber(ARGV[j]), tonumber(ARGV[j + 1])
+        local seen = 0
+        for _, f in ipairs(filters) do
+            seen = 1
+            for x = 0, f.k - 1 do
+                if redis.call('GETBIT', f.key, math.fmod(h1 + x * h2, f.m)) == 0 then
+                    seen = 0
+                    break
+                end
+            end
+            if seen == 1 then
+                break
+            end
+        end
+        if seen == 0 then
+            local f = filters[#filters]
+            if f == nil or f.count >= f.n then
+                f = new_filter()
+            end
+            for x = 0, f.k - 1 do
+                redis.call('SETBIT', f.key, math.fmod(h1 + x * h2, f.m), 1)
+            end
+            f.count = f.count + 1
+            f.added = f.added + 1
+        end
+        result[#result + 1] = seen
+    end
+    for i, f in ipairs(filters) do
+        if f.added > 0 then
+            redis.call('HINCRBY', meta, 'count:' .. (i - 1), f.added)
+        end
+    end
+    return result
+    '''
+
+    def __init__(self, server, key, debug=False, capacity=1000000, error_rate=0.001,
+                 growth=2, tightening=0.5):
+        super().__init__(server, key, debug)
+        if not 0 < error_rate < 1 or not 0 < tightening < 1 or growth < 1 or capacity < 1:
+            raise ValueError('BLOOM_ERROR_RATE、BLOOM_TIGHTENING 应在 (0, 1) 之间，'
+                'BLOOM_GROWTH、BLOOM_CAPACITY 应不小于 1')
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        # hash tag：参数 hash 与位图 key 在 Redis Cluster 的同一个 slot
+        self.meta_key = f"{{{key}}}:bloom"
+        self.error_rate = error_rate
+        self.options = [capacity, error_rate, growth, tightening]
+        self._check_add = server.register_script(self._LUA_CHECK_ADD)
+
+    @staticmethod
+    def _bloom_options(settings):
+        return {
+            'capacity': settings.getint('BLOOM_CAPACITY', 1000000),
+            'error_rate': settings.getfloat('BLOOM_ERROR_RATE', 0.001),
+            'growth': settings.getfloat('BLOOM_GROWTH', 2),
+            'tightening': settings.getfloat('BLOOM_TIGHTENING', 0.5),
+        }
+
+    @classmethod
+    def from_settings(cls, settings):
+        key = defaults.DUPEFILTER_KEY % {'timestamp': int(time.time())}
+        return cls(get_redis_from_settings(settings), key,
+            settings.getbool('DUPEFILTER_DEBUG'), **cls._bloom_options(settings))
+
+    @classmethod
+    def from_spider(cls, spider):
+        settings = spider.settings
+        key = settings.get('SCHEDULER_DUPEFILTER_KEY', defaults.SCHEDULER_DUPEFILTER_KEY) % {'spider': spider.name}
+        return cls(get_redis_from_settings(settings), key,
+            settings.getbool('DUPEFILTER_DEBUG'), **cls._bloom_options(settings))
+
+    @staticmethod
+    def hashes(fingerprint):
+        '''指纹（sha1 十六进制）-> 两个 40 位哈希值（双重哈希：第 x 个位置为 (h1 + x * h2) mod m，
+        lua 中以双精度浮点数计算，40 位保证精确）
+        '''
+        return int(fingerprint[:10], 16), int(fingerprint[10:20], 16) or 1
+
+    def request_seen(self, request):
+        return self.requests_seen([request])[0]
+
+    def requests_seen(self, requests):
+        '''批量检查（一次 redis 调用），未出现过的请求同时加入
+        @:return [是否已出现过, ...]
+        '''
+        if not requests:
+            return []
+        args = list(self.options)
+        for request in requests:
+            args.extend(self.hashes(self.request_fingerprint(request)))
+        result = self._check_add(keys=[self.meta_key, f"{self.meta_key}:"], args=args)
+        return [bool(x) for x in result]
+
+    def _filters(self):
+        '''[(位图 key, {m, k, n, count}), ...]'''
+        fields = {
+            (k.decode() if isinstance(k, bytes) else k): int(v)
+            for k, v in self.server.hgetall(self.meta_key).items()
+        }
+        return [
+            (f"{self.meta_key}:{i}",
+                {name: fields.get(f"{name}:{i}", 0) for name in ('m', 'k', 'n', 'count')})
+            for i in range(fields.get('filters', 0))
+        ]
+
+    def info(self):
+        '''过滤器状态：
+        filters - 过滤器个数；count - 已加入的指纹数；capacity - 总容量；
+        fill_ratio - 已置位的比例；memory_bytes - 位图占用的字节数；
+        false_positive_rate - 按当前置位比例估计的误判率；error_rate - 配置的误判率上限
+        '''
+        filters = self._filters()
+        pipe = self.server.pipeline()
+        for key, _ in filters:
+            pipe.bitcount(key)
+            pipe.strlen(key)
+        values = pipe.execute() if filters else []
+        bits = sum(f['m'] for _, f in filters)
+        not_false_positive = 1.0
+        for (_, f), set_bits in zip(filters, values[::2]):
+            if f['m']:
+                not_false_positive *= 1 - (set_bits / f['m']) ** f['k']
+        return {
+            'filters': len(filters),
+            'count': sum(f['count'] for _, f in filters),
+            'capacity': sum(f['n'] for _, f in filters),
+            'fill_ratio': round(sum(values[::2]) / bits, 4) if bits else 0.0,
+            'memory_bytes': sum(values[1::2]),
+            'false_positive_rate': float(f"{1 - not_false_positive:.3g}"),
+            'error_rate': self.error_rate,
+        }
+
+    def __len__(self):
+        '''已加入的指纹数'''
+        return sum(f['count'] for _, f in self._filters())
+
+    def clear(self):
+        keys = [key for key, _ in self._filters()]
+        self.server.delete(self.meta_key, *keys)
@@ -1,12 +1,20 @@
+import json
+import signal
 import logging
 import time
+from collections import deque
 from scrapy import signals
 from scrapy.exceptions import NotConfigured
-from ziroom.pipelines import mongo
+from scrapy.utils.reactor import listen_tcp
+from scrapy_redis import connection
+from twisted.internet import task
+from ziroom import metrics
+from ziroom.profiling import profiler
+from ziroom.pipelines import mongo, mongo_writer, room_coalescer
         
 
 class CloseSpiderExtension(object):
-    '''关闭spider，防止防止空跑，同时关闭mongo连接池。
+    '''关闭spider，防止防止空跑，同时写完待合并房间、mongo 批量写入缓冲区并关闭mongo连接池。
     关闭条件：
     1、redis_key为空
     2、空闲时间超过 n 个时间单位
@@ -31,8 +39,15 @@ class CloseSpiderExtension(object):
         return ext
 
     def spider_closed(self, spider):
+        '''写入待合并房间、写完 mongo 批量写入缓冲区后，再关闭连接池'''
+        room_coalescer.close()
+        d = mongo_writer.close()
+        d.addBoth(self._disconnect_mongo)
+        return d
+
+    def _disconnect_mongo(self, _):
         self.logger.warning('txmongo 关闭连接池 !')
-        mongo.conn_pool.disconnect()
+        return mongo.conn_pool.disconnect()
 
     def spider_idle(self, spider):
         self.idle_count += 1
@@ -40,7 +55,10 @@ class CloseSpiderExtension(object):
         idle_list_len = len(self.idle_list)
        
         # 判断 redis 中是否存在关键key, 如果key 被用完，则key就会不存在
-        if idle_list_len > 2 and spider.server.exists(spider.redis_key):
+        # 延后的列表页（ziroom.frontier）未放完时也不是空闲
+        frontier = getattr(spider, 'frontier', None)
+        if idle_list_len > 2 and (spider.server.exists(spider.redis_key)
+                or (frontier is not None and len(frontier))):
             self.idle_list = [self.idle_list[-1]]
         elif idle_list_len > self.idle_number:
             self.logger.warning(f"空闲已持续{self.idle_number}个时间单位，符合spider关闭条件。")
@@ -54,3 +72,345 @@ class CloseSpiderExtension(object):
             self.crawler.engine.close_spider(spider, '长期空闲')
 
 
+
+
+class StatsFileExtension(object):
+    '''关闭 spider 时将 scrapy stats 与下载延迟分位数写入 json 文件（STATS_FILE 非空时启用），
+    供 scrapy loadtest 等工具读取。
+    '''
+
+    def __init__(self, path, crawler):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.path = path
+        self.crawler = crawler
+        self.latencies = deque(maxlen=100000)  # 最近的下载延迟（秒）
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('STATS_FILE')
+        if not path:
+            raise NotConfigured
+        ext = cls(path, crawler)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.latencies.append(latency)
+
+    def spider_closed(self, spider, reason):
+        stats = dict(self.crawler.stats.get_stats())
+        latencies = sorted(self.latencies)
+        if latencies:
+            stats['download_latency'] = {
+                f"p{p}": round(latencies[min(len(latencies) - 1, len(latencies) * p // 100)], 4)
+                for p in (50, 90, 95, 99)
+            }
+        stats['finish_reason'] = reason
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, ensure_ascii=False, indent=2, default=str)
+        self.logger.warning(f"stats 已写入：{self.path}")
+
+
+class MetricsExtension(object):
+    '''通过 http 提供 Prometheus 指标（/metrics，指标见 ziroom.metrics）。
+    端口为 METRICS_PORT 范围内第一个可用端口（同一主机可运行多个 spider）；
+    下载延迟、响应状态码在下载器返回响应时（downloader middleware 处理之前）记录，
+    调度队列长度、去重集合大小（以及布隆过滤器的置位比例、占用内存）在请求 /metrics 时读取。
+    '''
+
+    def __init__(self, crawler):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.crawler = crawler
+        self.port = None
+        metrics.scheduler_queue_size.set_function(self._queue_size)
+        metrics.dupefilter_size.set_function(self._dupefilter_size)
+        metrics.dupefilter_fill_ratio.set_function(lambda: self._dupefilter_info('fill_ratio'))
+        metrics.dupefilter_memory_bytes.set_function(lambda: self._dupefilter_info('memory_bytes'))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        if metrics.prometheus_client is None:
+            raise NotConfigured('prometheus_client is not installed')
+        ext = cls(crawler)
+        crawler.signals.connect(ext.engine_started, signal=signals.engine_started)
+        crawler.signals.connect(ext.engine_stopped, signal=signals.engine_stopped)
+        crawler.signals.connect(ext.response_downloaded, signal=signals.response_downloaded)
+        return ext
+
+    def engine_started(self):
+        from prometheus_client.twisted import MetricsResource
+        from twisted.web.resource import Resource
+        from twisted.web.server import Site
+        root = Resource()
+        root.putChild(b'metrics', MetricsResource())
+        self.port = listen_tcp(
+            self.crawler.settings.getlist('METRICS_PORT'),
+            self.crawler.settings.get('METRICS_HOST'),
+            Site(root),
+        )
+        h = self.port.getHost()
+        self.logger.info(f"metrics：http://{h.host}:{h.port}/metrics")
+
+    def engine_stopped(self):
+        if self.port is not None:
+            self.port.stopListening()
+
+    def response_downloaded(self, response, request, spider):
+        callback = getattr(request.callback, '__name__', None) or 'parse'
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            metrics.download_latency.labels(callback).observe(latency)
+        metrics.responses.labels(str(response.status)).inc()
+
+    def _scheduler(self):
+        slot = getattr(self.crawler.engine, 'slot', None)
+        return getattr(slot, 'scheduler', None)
+
+    def _queue_size(self):
+        scheduler = self._scheduler()
+        return len(scheduler) if scheduler is not None else 0
+
+    def _dupefilter_size(self):
+        '''去重集合大小：去重器实现了 __len__ 时使用，否则为 redis 集合（scrapy_redis RFPDupeFilter）的大小'''
+        df = getattr(self._scheduler(), 'df', None)
+        if df is None:
+            return 0
+        if hasattr(df, '__len__'):
+            return len(df)
+        return df.server.scard(df.key)
+
+    def _dupefilter_info(self, field):
+        '''去重器实现了 info() 时（BloomDupeFilter）的状态字段，否则为 0'''
+        df = getattr(self._scheduler(), 'df', None)
+        return df.info()[field] if hasattr(df, 'info') else 0
+
+
+class ProfilerExtension(object):
+    '''运行时开启性能分析（ziroom.profiling），持续固定时长后写出结果到 PROFILE_DIR。
+    开启方式：
+    1、redis key：set ziroom:profile <秒数> ex <秒数>（所有节点每 PROFILE_POLL_INTERVAL 秒检查一次；
+       同一个 key 只触发一次，key 过期或删除后可再次触发）
+    2、信号：kill -USR2 <pid>（持续 PROFILE_SECONDS 秒）
+    '''
+
+    def __init__(self, crawler):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.crawler = crawler
+        settings = crawler.settings
+        self.redis_key = settings.get('PROFILE_REDIS_KEY', 'ziroom:profile')
+        self.poll_interval = settings.getfloat('PROFILE_POLL_INTERVAL', 5)
+        self.seconds = settings.getfloat('PROFILE_SECONDS', 60)
+        self.sample_interval = settings.getfloat('PROFILE_SAMPLE_INTERVAL', 0.005)
+        self.output_dir = settings.get('PROFILE_DIR', 'profiles')
+        self.server = None
+        self.triggered = False      # 当前 redis key 已触发过
+        self._loop = None
+        self._stop_call = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PROFILE_ENABLED'):
+            raise NotConfigured
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.server = connection.from_settings(self.crawler.settings)
+        self._loop = task.LoopingCall(self.poll)
+        self._loop.start(self.poll_interval, now=True)
+        if hasattr(signal, 'SIGUSR2'):
+            signal.signal(signal.SIGUSR2, self._on_signal)
+
+    def spider_closed(self, spider):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        if self._stop_call is not None and self._stop_call.active():
+            self._stop_call.cancel()
+            self.stop()
+
+    def poll(self):
+        try:
+            value = self.server.get(self.redis_key)
+        except Exception as e:
+            self.logger.debug(f"读取 {self.redis_key} 失败：{e}")
+            return
+        if value is None:
+            self.triggered = False
+        elif not self.triggered:
+            self.triggered = True
+            try:
+                seconds = float(value)
+            except ValueError:
+                seconds = self.seconds
+            self.start(seconds)
+
+    def start(self, seconds):
+        from twisted.internet import reactor
+        if not profiler.start(self.sample_interval):
+            return
+        self.logger.warning(f"开始性能分析：{seconds:.0f} s")
+        self._stop_call = reactor.callLater(seconds, self.stop)
+
+    def stop(self):
+        json_path, collapsed_path = profiler.stop(self.output_dir)
+        top = [f"{x['name']} {x['cpu_seconds']}s" for x in profiler.report()['functions'][:5]]
+        self.logger.warning(f"性能分析结束：{json_path}、{collapsed_path}（{profiler.samples} 次采样）")
+        self.logger.warning(f"CPU 时间最多：{top}")
+
+    def _on_signal(self, signum, frame):
+        from twisted.internet import reactor
+        reactor.callFromThread(self.start, self.seconds)
+
+
+class AdaptiveConcurrencyExtension(object):
+    '''按代理（下载槽位）自适应调整并发与下载延迟（AIMD），自动找到每个代理可持续的最大吞吐。
+    每 ADAPTIVE_INTERVAL 秒，对本周期内响应数达到 ADAPTIVE_MIN_SAMPLES（或出现限流响应）的代理：
+    1、限流响应（ADAPTIVE_THROTTLE_CODES，默认 478、510、503）比例超过 ADAPTIVE_ERROR_RATE：
+       并发乘以 ADAPTIVE_DECREASE_FACTOR，延迟加倍（至少 ADAPTIVE_DELAY_STEP，最多 ADAPTIVE_MAX_DELAY）；
+       减小后的并发记为已学习到的可持续并发，作为新代理的初始并发
+    2、平均下载延迟超过 ADAPTIVE_TARGET_LATENCY：并发减 1
+    3、否则并发加 1（最多 PROXY_SLOT_CONCURRENCY），延迟减半；
+       剩余租期不足 PROXY_PREFETCH_SECONDS 的代理（即将被替换）保持不变
+    '''
+
+    def __init__(self, crawler):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.crawler = crawler
+        settings = crawler.settings
+        self.interval = settings.getfloat('ADAPTIVE_INTERVAL', 5)
+        self.min_samples = settings.getint('ADAPTIVE_MIN_SAMPLES', 5)
+        self.throttle_codes = set(int(x) for x in settings.getlist('ADAPTIVE_THROTTLE_CODES', [478, 510, 503]))
+        self.error_rate = settings.getfloat('ADAPTIVE_ERROR_RATE', 0.05)
+        self.target_latency = settings.getfloat('ADAPTIVE_TARGET_LATENCY', 3)
+        self.decrease_factor = settings.getfloat('ADAPTIVE_DECREASE_FACTOR', 0.5)
+        self.min_concurrency = settings.getint('ADAPTIVE_MIN_CONCURRENCY', 1)
+        self.max_concurrency = settings.getint('PROXY_SLOT_CONCURRENCY', 16)
+        self.delay_step = settings.getfloat('ADAPTIVE_DELAY_STEP', 0.25)
+        self.max_delay = settings.getfloat('ADAPTIVE_MAX_DELAY', 5)
+        self.windows = {}   # 本周期：{代理: [响应数, 限流响应数, 下载延迟之和]}
+        self._loop = None
+        from ziroom.proxy import proxy_ins
+        self.proxy = proxy_ins
+        # 新代理从 ADAPTIVE_START_CONCURRENCY 开始增加
+        self.proxy.pool_settings['slot_start_concurrency'] = settings.getint('ADAPTIVE_START_CONCURRENCY', 4)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED'):
+            raise NotConfigured
+        if crawler.settings.get('DOWNLOADER') != 'ziroom.mydownloader.MyDownloader':
+            raise NotConfigured('requires ziroom.mydownloader.MyDownloader (per-proxy slots)')
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_downloaded, signal=signals.response_downloaded)
+        return ext
+
+    def spider_opened(self, spider):
+        self._loop = task.LoopingCall(self.adjust)
+        self._loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+
+    def response_downloaded(self, response, request, spider):
+        proxy = request.meta.get('proxy')
+        if proxy not in self.proxy.pool:
+            return
+        window = self.windows.setdefault(proxy, [0, 0, 0.0])
+        window[0] += 1
+        if response.status in self.throttle_codes:
+            window[1] += 1
+        window[2] += request.meta.get('download_latency', 0)
+
+    def adjust(self):
+        slots = self.crawler.engine.downloader.slots
+        now = time.time()
+        for proxy in list(self.windows):
+            lease = self.proxy.pool.get(proxy)
+            slot = slots.get(proxy)
+            if lease is None or slot is None:
+                # 代理已移出代理池
+                del self.windows[proxy]
+                continue
+            responses, throttled, latency_total = self.windows[proxy]
+            if responses < self.min_samples and not throttled:
+                continue
+            del self.windows[proxy]
+            concurrency, delay = lease.concurrency, slot.delay
+            latency = latency_total / responses
+            if throttled / responses > self.error_rate:
+                concurrency = max(self.min_concurrency, int(concurrency * self.decrease_factor))
+                delay = min(self.max_delay, max(delay * 2, self.delay_step))
+                self.proxy.pool_settings['slot_start_concurrency'] = concurrency
+                self.crawler.stats.inc_value('adaptive/decrease')
+                self.logger.info(f"限流 {throttled}/{responses}：{proxy} 并发 {lease.concurrency} -> {concurrency}，"
+                    f"延迟 {slot.delay:.2f} -> {delay:.2f} s")
+            elif latency > self.target_latency:
+                concurrency = max(self.min_concurrency, concurrency - 1)
+                self.crawler.stats.inc_value('adaptive/latency_decrease')
+                self.logger.debug(f"延迟 {latency:.2f} s：{proxy} 并发 {lease.concurrency} -> {concurrency}")
+            elif lease.remaining(now) > self.proxy.pool_settings['prefetch_seconds']:
+                concurrency = min(self.max_concurrency, concurrency + 1)
+                delay = delay / 2 if delay >= self.delay_step / 2 else 0
+                self.crawler.stats.inc_value('adaptive/increase')
+            lease.concurrency = slot.concurrency = concurrency
+            slot.delay = delay
+
+
+class FrontierExtension(object):
+    '''延后的列表页（ziroom.frontier）：每 FRONTIER_INTERVAL 秒（以及 spider 空闲时）检查调度队列长度，
+    低于 FRONTIER_LOW_WATERMARK 时取出至多 FRONTIER_BATCH 个列表页放入调度队列
+    '''
+
+    def __init__(self, crawler):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.crawler = crawler
+        self.interval = crawler.settings.getfloat('FRONTIER_INTERVAL', 1)
+        self.low_watermark = crawler.settings.getint('FRONTIER_LOW_WATERMARK', 2000)
+        self.batch = crawler.settings.getint('FRONTIER_BATCH', 5)
+        self._loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('FRONTIER_ENABLED'):
+            raise NotConfigured
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.spider_idle, signal=signals.spider_idle)
+        return ext
+
+    def spider_opened(self, spider):
+        self._loop = task.LoopingCall(self.release, spider)
+        self._loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+
+    def spider_idle(self, spider):
+        self.release(spider)
+
+    def release(self, spider):
+        try:
+            queue_size = len(self.crawler.engine.slot.scheduler)
+            if queue_size >= self.low_watermark:
+                return
+            pages = spider.frontier.pop(self.batch)
+        except Exception as e:
+            self.logger.warning(f"读取延后的列表页失败：{e}")
+            return
+        for url, referer in pages:
+            self.crawler.engine.crawl(spider.list_request(url, referer))
+        if pages:
+            self.crawler.stats.inc_value('frontier/released', len(pages))
+            self.logger.debug(f"调度队列 {queue_size} 个请求，放入列表页 {len(pages)} 个")
@@ -0,0 +1,237 @@
+'''列表页、详情页信息提取
+
+XPath、正则均在模块加载时编译（lxml.etree.XPath / re.compile），提取时不再重复解析表达式；
+直接用 lxml 构建 DOM（不经过 parsel Selector），XPath 结果为普通字符串（smart_strings=False），
+不会持有 DOM 的引用。
+列表页每个房间（li）的标签只遍历一次；详情页先用正则检查隐藏的 room_id、house_id、resblock_id，
+缺失时（非正常页面）不构建 DOM。
+提取结果与原 parsel 实现一致（scrapy parsecheck 对比），但修正了原实现中 room_style、
+is_near_subway 的 XPath（class 中混入了续行的空白，永远匹配不到）。
+'''
+
+import re
+
+from lxml import etree
+
+
+def _xpath(path):
+    return etree.XPath(path, smart_strings=False)
+
+
+def _re(regex, texts):
+    '''同 parsel 的 SelectorList.re：所有匹配（有分组时为展开后的分组）'''
+    rtn = []
+    for text in texts:
+        for match in regex.findall(text):
+            if isinstance(match, tuple):
+                rtn.extend(match)
+            else:
+                rtn.append(match)
+    return rtn
+
+
+def _re_first(regex, texts):
+    '''同 parsel 的 SelectorList.re_first：第一个匹配（有分组时为第一个分组）'''
+    for text in texts:
+        match = regex.search(text)
+        if match:
+            return match.group(1) if regex.groups else match.group(0)
+    return None
+
+
+def _first(values):
+    return values[0] if values else None
+
+
+_parser = etree.HTMLParser(recover=True, encoding='utf8')
+
+
+def parse_html(response):
+    '''构建 DOM（与 parsel 相同的解析方式）'''
+    body = response.text.strip().replace('\x00', '').encode('utf8') or b'<html/>'
+    return etree.fromstring(body, parser=_parser, base_url=response.url)
+
+
+_TEXT = _xpath('text()')
+
+# 列表页
+_PRICE_SCRIPT = _xpath('//script[contains(text(), "offset_unit")]/text()')
+_PRICE_PNG_URL_RE = re.compile(r'image":"//(.+)",')
+_PRICE_POSITIONS_RE = re.compile(r'"offset":\[(.+)\]\};')
+_HOUSE_LIST = _xpath('//ul[@id="houseList"]/li')
+_CITY = _xpath('//span[@id="curCityName"]/text()')
+_TOTAL_PAGE = _xpath('//div[@id="page"]/span[contains(text(), "共")]/text()')
+_TOTAL_PAGE_RE = re.compile(r'共(\d+)页')
+_ROOM_PAYMENT = _xpath('div[@class="priceDetail"]/p[@class="price"]/span[@class="gray-6"]/text()')
+_ROOM_THUMB = _xpath('div[@class="img pr"]/a/img/@_src')
+_ROOM_LINK = _xpath('div[@class="txt"]/h3/a')
+_ROOM_FIRST_RENT = _xpath('div[@class="txt"]/h4/span[@class="green"][contains(text(), "首次出租")]/text()')
+_ROOM_TAGS = _xpath('div[@class="txt"]/p[@class="room_tags clearfix"]//span')
+_PAYMENT_RE = re.compile(r'\((.+)\)')
+_SCHEMELESS_RE = re.compile(r'^//(.+)')
+_ROOM_ID_RE = re.compile(r'/(\d+)\.html')
+_PRODUCT_RE = re.compile(r'(\S+) · .+')
+_ROOM_NAME_RE = re.compile(r'\S+ · (.+)')
+_DETAIL_URL_RE = re.compile(r'//(.+html)')
+_NON_SPACE_RE = re.compile(r'\S+')
+# 房间标签：字段 -> 标签文字
+_TAG_FIELDS = (
+    ('is_near_subway', ('离地铁近',)),
+    ('is_private_bathroom', ('独卫',)),
+    ('is_private_balcony', ('独立阳台',)),
+    ('heating', ('集体供暖', '独立供暖', '中央空调')),
+)
+
+
+def extract_list(root, scheme):
+    '''列表页
+    @:return dict：price_png_url（不含协议）、price_positions、city、total_page、
+        rooms（每个房间的字段，顺序与价格位置一致）
+    '''
+    scripts = _PRICE_SCRIPT(root)
+    positions_str = _re_first(_PRICE_POSITIONS_RE, scripts)
+    page = {
+        'price_png_url': _re_first(_PRICE_PNG_URL_RE, scripts),
+        'price_positions': None,
+        'city': _first(_CITY(root)),
+        'total_page': _re_first(_TOTAL_PAGE_RE, _TOTAL_PAGE(root)),
+        'rooms': [],
+    }
+    if positions_str:
+        page['price_positions'] = [
+            list(map(int, x.split(',')))
+            for x in positions_str.strip('[').strip(']').split('],[')
+        ]
+    for li in _HOUSE_LIST(root):
+        links = _ROOM_LINK(li)
+        hrefs = [a.get('href') for a in links if a.get('href') is not None]
+        titles = [t for a in links for t in _TEXT(a)]
+        room = {
+            'room_id': int(_re_first(_ROOM_ID_RE, hrefs)),
+            'product': _re_first(_PRODUCT_RE, titles),
+            'room_name': _re_first(_ROOM_NAME_RE, titles),
+            'room_style': None,
+            'is_first_rent': _re_first(_NON_SPACE_RE, _ROOM_FIRST_RENT(li)),
+            'payment': _re_first(_PAYMENT_RE, _ROOM_PAYMENT(li)),
+            'thumb_src': scheme + '://' + _re_first(_SCHEMELESS_RE, _ROOM_THUMB(li)),
+            'url': scheme + '://' + _re_first(_DETAIL_URL_RE, hrefs),
+        }
+        room.update(dict.fromkeys(field for field, _ in _TAG_FIELDS))
+        for span in _ROOM_TAGS(li):
+            texts = _TEXT(span)
+            if not texts:
+                continue
+            if room['room_style'] is None and span.get('class') == 'style':
+                room['room_style'] = texts[0]
+            for field, tags in _TAG_FIELDS:
+                if room[field] is None and any(t in tags for t in texts):
+                    room[field] = texts[0]
+        page['rooms'].append(room)
+    return page
+
+
+# 详情页
+_HIDDEN_INPUT_RE = re.compile(
+    r'<input\b[^>]*?(?<![\w-])id=["\'](room_id|house_id|resblock_id)["\'][^>]*>', re.I)
+_VALUE_RE = re.compile(r'(?<![\w-])value=["\']([^"\']*)["\']', re.I)
+_DISTRICT = _xpath('//span[@class="ellipsis"]/text()')
+_DISTRICT_RE = re.compile(r'\[?(\S+)\s+(\S+)\]?')
+_ROOM_SN = _xpath('//h3[@class="fb"]/text()')
+_ROOM_INTRODUCE = _xpath('//p/strong[text()="房源介绍："]/parent::node()/text()')
+_COMMUNITY = _xpath('//div[@class="node_infor area"]/a[last()]/text()')
+_COMMUNITY_RE = re.compile(r'(.+)租房信息')
+_DETAIL_ROOM = _xpath('//ul[@class="detail_room"]')
+_DETAIL_ROOM_LI = _xpath('li')
+_SUBWAY = _xpath('span/text() | span/span/p/text()')
+_SUBWAY_RE = re.compile(r'距[\s\S+]+米')
+_RENT_TYPE = _xpath('//span[@class="icons"]/text()')
+_AREA_RE = re.compile(r'面积：\s*(\S+)\s+')
+_FLOOR_RE = re.compile(r'楼层：\s*(\d+)/(\d+)层')
+_TOWARDS_RE = re.compile(r'朝向：\s*(\S+)\s*')
+_HOUSE_TYPE_RE = re.compile(r'户型：\s*(\d+)室(?:(\d+)厅)?')
+_RENT_STATUS = _xpath('//a[@id="zreserve"]/text()')
+_PHOTOS = _xpath('//div[@id="lofslidecontent45"]//ul[@class="lof-main-wapper"]/li/a/img')
+_MAP_POSITION = _xpath('//input[@id="mapsearchText"]/@data-lng | //input[@id="mapsearchText"]/@data-lat')
+_ROOMMATES = _xpath('//div[@class="greatRoommate"]/ul/li/div')
+_MATE_ROOM = _xpath('div[@class="user_top clearfix"]/p/text()')
+_MATE_STATUS = _xpath('div[@class="user_top clearfix"]/span[@class="tags"]/text()')
+_MATE_SIGN = _xpath('div[@class="user_center"]/p[1]/text()')
+_MATE_JOBS = _xpath('div[@class="user_center"]/p[2]/span[1]/text()')
+_MATE_CHECK_IN = _xpath('div[@class="user_bottom"]/p/text()')
+# 房屋信息：标签 -> (字段, 正则, 是否只取第一个匹配)
+_DETAIL_ROOM_FIELDS = (
+    ('面积：', 'area', _AREA_RE, True),
+    ('楼层：', 'floor', _FLOOR_RE, False),
+    ('朝向：', 'towards', _TOWARDS_RE, True),
+    ('户型：', 'house_type', _HOUSE_TYPE_RE, False),
+)
+
+
+def detail_ids(text):
+    '''详情页隐藏的 room_id、house_id、resblock_id（正则匹配，不构建 DOM），缺失的为 None'''
+    ids = {'room_id': None, 'house_id': None, 'resblock_id': None}
+    for match in _HIDDEN_INPUT_RE.finditer(text):
+        name = match.group(1).lower()
+        if ids[name] is None:
+            value = _VALUE_RE.search(match.group(0))
+            if value:
+                ids[name] = value.group(1)
+    return ids
+
+
+def extract_detail(root, scheme):
+    '''详情页主信息
+    @:return dict：item 字段（无图片、无室友时不含 photos、roommates）
+    '''
+    detail_rooms = _DETAIL_ROOM(root)
+    texts = {label: [] for label, *_ in _DETAIL_ROOM_FIELDS}
+    subway = []
+    for ul in detail_rooms:
+        for li in _DETAIL_ROOM_LI(ul):
+            li_texts = _TEXT(li)
+            head = li_texts[0] if li_texts else ''
+            if '交通：' in head:
+                subway.extend(_SUBWAY(li))
+            for label in texts:
+                if label in head:
+                    texts[label].extend(li_texts)
+    item = {
+        'district': _re(_DISTRICT_RE, _DISTRICT(root)),
+        'room_sn': _re_first(_NON_SPACE_RE, _ROOM_SN(root)),
+        'room_introduce': _first(_ROOM_INTRODUCE(root)),
+        'community': _re_first(_COMMUNITY_RE, _COMMUNITY(root)),
+        'subway': _re(_SUBWAY_RE, subway),
+        'rent_type': _first(_RENT_TYPE(root)) if detail_rooms else None,
+        'rent_status': _first(_RENT_STATUS(root)),
+        'map_position': _MAP_POSITION(root),
+    }
+    for label, field, regex, first in _DETAIL_ROOM_FIELDS:
+        item[field] = _re_first(regex, texts[label]) if first else _re(regex, texts[label])
+
+    photos = _PHOTOS(root)
+    if photos:
+        item['photos'] = []
+        for img in photos:
+            src = img.get('src')
+            if src.find('http:') == -1:
+                src = scheme + '://' + src.strip('//').strip('/')
+            item['photos'].append({
+                'path': None,
+                'thumb_path': None,
+                'title': img.get('title'),
+                'origin_src': src.replace('v180x135', 'v800x600'),
+            })
+
+    roommates = _ROOMMATES(root)
+    if roommates:
+        item['roommates'] = []
+        for mate in roommates:
+            item['roommates'].append({
+                'gender': _re_first(_NON_SPACE_RE, [mate.getparent().get('class') or '']),
+                'room': _first(_MATE_ROOM(mate)),
+                'status': _first(_MATE_STATUS(mate)),
+                'sign': _first(_MATE_SIGN(mate)),
+                'jobs': _first(_MATE_JOBS(mate)),
+                'check_in_time': _re_first(_NON_SPACE_RE, _MATE_CHECK_IN(mate)),
+            })
+    return item
@@ -0,0 +1,333 @@
+'''本地模拟站点与代理 api（压测用）
+
+    python -m ziroom.fakesite --api-port 18000 --ports 18001,18002 [--latency 0.05] [--errors 403=0.01]
+    python -m ziroom.fakesite --fixtures DIR [--districts 2] [--pages 5] [--rooms 10]
+
+--fixtures：不启动服务，将模拟站点的页面写为离线评测语料（与 FixtureRecorderDM 记录的格式相同，见 scrapy parsebench）。
+
+站点端口同时充当 http 代理：spider 经代理发出的请求（绝对 url）直接由本站点响应，不区分域名。
+    /z/nl/z3.html                   起始页（各区列表页链接）
+    /z/nl/z3-d<区>.html[?p=<页>]    列表页（价格图片 + 价格位置）
+    /z/vr/<room_id>.html            详情页
+    /detail/steward、/detail/info、/detail/config   管家、支付详情 && 空气、房屋配置（json）
+    /...<seed>.png                  价格图片（0-9 按 seed 打乱）
+    /robots.txt                     代理检测地址
+每个响应延迟 latency 秒（±jitter 比例的均匀抖动），并按概率注入 302/403/478/510。
+api 端口：
+    /xdaili     讯代理格式的代理 api（ERRORCODE/RESULT），轮流返回站点端口
+    /_stats     请求统计（json）
+'''
+
+import io
+import os
+import json
+import random
+import argparse
+import hashlib
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image, ImageDraw, ImageFont
+from twisted.web import resource, server
+
+
+def digit_permutation(seed):
+    '''价格图片中 0-9 的排列（按 seed 确定）'''
+    digits = list('0123456789')
+    random.Random(seed).shuffle(digits)
+    return ''.join(digits)
+
+
+def render_sprite(digits):
+    '''绘制价格图片：透明背景上横向排列的数字'''
+    font = ImageFont.load_default()
+    img = Image.new('RGBA', (20 * len(digits) + 10, 30), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for i, digit in enumerate(digits):
+        draw.text((5 + 20 * i, 8), digit, font=font, fill=(51, 51, 51, 255))
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def room_price(room_id):
+    return 1500 + room_id * 37 % 4000
+
+
+def positions(price, digits):
+    return [digits.index(d) for d in str(price)]
+
+
+class FakeSite(resource.Resource):
+    '''模拟自如站点'''
+
+    isLeaf = True
+
+    def __init__(self, districts=2, pages=5, rooms=10, latency=0.05, jitter=0.5, errors=None):
+        super().__init__()
+        self.districts = districts
+        self.pages = pages
+        self.rooms = rooms
+        self.latency = latency
+        self.jitter = jitter
+        self.errors = errors or {}     # {状态码: 概率}
+        self.stats = Counter()
+        self._sprites = {}
+
+    def render_GET(self, request):
+        from twisted.internet import reactor
+        url = urlparse(request.uri.decode())
+        kind, status, headers, body = self.dispatch(url.path, parse_qs(url.query))
+        self.stats[f"{kind}/{status}"] += 1
+        delay = self.latency * random.uniform(1 - self.jitter, 1 + self.jitter)
+        call = reactor.callLater(max(delay, 0), self._finish, request, status, headers, body)
+        # 客户端提前断开：取消响应
+        request.notifyFinish().addErrback(lambda _: call.active() and call.cancel())
+        return server.NOT_DONE_YET
+
+    def _finish(self, request, status, headers, body):
+        request.setResponseCode(status)
+        for k, v in headers.items():
+            request.setHeader(k, v)
+        request.write(body)
+        request.finish()
+
+    def dispatch(self, path, query):
+        '''@:return (页面类型, 状态码, headers, body)'''
+        kind, handler = self.route(path)
+        if kind != 'robots':
+            for status, rate in self.errors.items():
+                if random.random() < rate:
+                    headers = {'Location': '/login'} if status == 302 else {}
+                    return kind, status, headers, f"status {status}".encode()
+        if handler is None:
+            return kind, 404, {}, b'not found'
+        content_type, body = handler(path, query)
+        return kind, 200, {'Content-Type': content_type}, body
+
+    def route(self, path):
+        if path.endswith('.png'):
+            return 'sprite', self.sprite
+        if path == '/robots.txt':
+            return 'robots', lambda p, q: ('text/plain', b'User-agent: *\n')
+        if path.startswith('/z/nl/'):
+            if '-d' in path:
+                return 'list', self.list_page
+            return 'start', self.start_page
+        if path.startswith('/z/vr/'):
+            return 'detail', self.detail_page
+        if path == '/detail/steward':
+            return 'steward', self.steward
+        if path == '/detail/info':
+            return 'info', self.info
+        if path == '/detail/config':
+            return 'config', self.config
+        return 'other', None
+
+    def start_page(self, path, query):
+        links = ''.join(f'<span class="tag"><a href="//sh.ziroom.com/z/nl/z3-d{d}.html">区{d}</a></span>'
+            for d in range(1, self.districts + 1))
+        html = f'''<html><head><meta charset="utf-8"></head><body>
+<dl class="clearfix zIndex6"><dd><div class="con"><span class="tag">全部</span>{links}</div></dd></dl>
+</body></html>'''
+        return 'text/html; charset=utf-8', html.encode()
+
+    def list_page(self, path, query):
+        district = int(path.rsplit('-d', 1)[1].split('.')[0])
+        page = int(query.get('p', ['1'])[0])
+        seed = district * 1000 + page
+        digits = digit_permutation(seed)
+        lis, offsets = [], []
+        for i in range(self.rooms):
+            room_id = 60000000 + district * 100000 + page * 100 + i
+            offsets.append(positions(room_price(room_id), digits))
+            tags = '<span>离地铁近</span>' if room_id % 3 else ''
+            lis.append(f'''<li class="clearfix">
+<div class="img pr"><a href="//sh.ziroom.com/z/vr/{room_id}.html"><img _src="//static8.ziroom.com/phoenix/pc/images/{room_id}.jpg"/></a></div>
+<div class="txt"><h3><a href="//sh.ziroom.com/z/vr/{room_id}.html">友家 · 模拟小区{i % 4 + 1}居室-南卧</a></h3>
+<h4><a>[区{district}] 6号线</a><span class="green">首次出租</span></h4>
+<p class="room_tags clearfix"><span class="style">木棉</span>{tags}<span>独卫</span><span>集体供暖</span></p></div>
+<div class="priceDetail"><p class="price"><span class="gray-6">(每月)</span></p></div>
+</li>''')
+        offset = ','.join('[' + ','.join(map(str, x)) + ']' for x in offsets)
+        html = f'''<html><head><meta charset="utf-8"></head><body><span id="curCityName">上海</span>
+<ul id="houseList">{''.join(lis)}</ul><div id="page"><span>共{self.pages}页</span></div>
+<script>var ROOM_PRICE = {{"image":"//static8.ziroom.com/phoenix/pc/images/price/{seed}.png","offset":[{offset}]}};
+var offset_unit = 21.4;</script></body></html>'''
+        return 'text/html; charset=utf-8', html.encode()
+
+    def detail_page(self, path, query):
+        room_id = int(path.rsplit('/', 1)[1].split('.')[0])
+        house_id, resblock_id = room_id // 3, room_id // 50
+        mates = ''.join(f'''<li class="woman"><div><div class="user_top clearfix"><p>0{i}卧</p>
+<span class="tags">已入住</span></div><div class="user_center"><p>天秤座</p><p><span>IT</span></p></div>
+<div class="user_bottom"><p>2018/05-2019/05</p></div></div></li>''' for i in range(2))
+        imgs = ''.join(f'<li><a><img src="//pic.ziroom.com/house_images/{room_id}_{i}_v180x135.jpg" '
+            f'title="卧室{i}"/></a></li>' for i in range(4))
+        html = f'''<html><head><meta charset="utf-8"></head><body>
+<input type="hidden" id="room_id" value="{room_id}"/><input type="hidden" id="house_id" value="{house_id}"/>
+<input type="hidden" id="resblock_id" value="{resblock_id}"/>
+<div class="node_infor area"><a>首页</a><a>模拟小区租房信息</a></div>
+<h3 class="fb">SH{room_id}</h3><span class="ellipsis">[浦东 张江] 2号线张江高科</span>
+<ul class="detail_room"><li>面积： 12.5㎡ <span class="icons">合</span></li><li>朝向： 南</li>
+<li>户型： 3室1厅 </li><li>楼层： 5/6层</li><li>交通：<span>距2号线张江高科站800米</span></li></ul>
+<p><strong>房源介绍：</strong> 模拟房源 </p><a id="zreserve">我要看房</a>
+<div id="lofslidecontent45"><ul class="lof-main-wapper">{imgs}</ul></div>
+<input id="mapsearchText" data-lng="121.5" data-lat="31.2"/>
+<div class="greatRoommate"><ul>{mates}</ul></div></body></html>'''
+        return 'text/html; charset=utf-8', html.encode()
+
+    def _json(self, data):
+        body = {'code': 200, 'message': 'success', 'data': data}
+        return 'application/json', json.dumps(body, ensure_ascii=False).encode()
+
+    def steward(self, path, query):
+        resblock_id = query.get('resblock_id', ['0'])[0]
+        return self._json({
+            'keeperId': resblock_id[-6:], 'keeperName': '模拟管家', 'keeperPhone': '4001001111',
+            'headCorn': f"http://pic.ziroom.com/keeper/{resblock_id}.jpg",
+        })
+
+    def info(self, path, query):
+        room_id = int(query.get('id', ['0'])[0])
+        seed = room_id % 100000
+        digits = digit_permutation(seed)
+        price = room_price(room_id)
+        return self._json({
+            'payment': [{
+                'period': period,
+                'rent': [None, f"//static8.ziroom.com/phoenix/pc/images/pay/{seed}.png",
+                    positions(price + k * 100, digits)],
+                'deposit': [None, None, positions(price, digits)],
+                'service_charge': [None, None, positions(price // 10, digits)],
+            } for k, period in enumerate(('月付', '季付', '年付'))],
+            'air_part': {'air_quality': {'result_list': [], 'show_info': {'status': '合格'}}},
+            'vr_video': {'video_url': None},
+        })
+
+    def config(self, path, query):
+        return self._json({'bed': 1, 'desk': 1, 'chest': 1, 'washing': 1, 'wifi': 1, 'lock': 1})
+
+    def sprite(self, path, query):
+        name = path.rsplit('/', 1)[1][:-len('.png')]
+        seed = int(name) if name.isdigit() else int(hashlib.md5(name.encode()).hexdigest()[:8], 16)
+        if seed not in self._sprites:
+            self._sprites[seed] = render_sprite(digit_permutation(seed))
+        return 'image/png', self._sprites[seed]
+
+
+def write_fixtures(fixtures_dir, districts=2, pages=5, rooms=10):
+    '''将模拟站点的列表页、价格图片、详情页、管家、支付详情 && 空气、房屋配置写入 fixtures_dir
+    （FIXTURES_DIR 格式：按回调分目录，索引为 index.jsonl）
+    @:return {回调: 响应数}
+    '''
+    site = FakeSite(districts, pages, rooms)
+    host = 'http://sh.ziroom.com'
+    fixtures = []   # [(回调, 路径, query, meta)]
+    for district in range(1, districts + 1):
+        list_path = f"/z/nl/z3-d{district}.html"
+        for page in range(1, pages + 1):
+            query = {'p': [str(page)]} if page > 1 else {}
+            fixtures.append(('parse_list', list_path, query, {}))
+            fixtures.append(('parse_price_sprite',
+                f"/phoenix/pc/images/price/{district * 1000 + page}.png", {}, {}))
+            for i in range(rooms):
+                room_id = 60000000 + district * 100000 + page * 100 + i
+                house_id, resblock_id = room_id // 3, room_id // 50
+                detail_url = f"{host}/z/vr/{room_id}.html"
+                meta = {'referer': detail_url, 'room_id': room_id}
+                fixtures.extend((
+                    ('parse_detail', f"/z/vr/{room_id}.html", {}, {'room_id': room_id}),
+                    ('parse_keeper', '/detail/steward', {'resblock_id': [str(resblock_id)]},
+                        dict(meta, resblock_id=str(resblock_id))),
+                    ('parse_payment_air', '/detail/info',
+                        {'id': [str(room_id)], 'house_id': [str(house_id)]}, meta),
+                    ('parse_allocation', '/detail/config',
+                        {'house_id': [str(house_id)], 'id': [str(room_id)]},
+                        dict(meta, house_id=str(house_id))),
+                ))
+    counts = Counter()
+    with open(os.path.join(fixtures_dir, 'index.jsonl'), 'w', encoding='utf-8') as index:
+        for callback, path, query, meta in fixtures:
+            _, handler = site.route(path)
+            _, body = handler(path, query)
+            url = host + path
+            if query:
+                url += '?' + '&'.join(f"{k}={v[0]}" for k, v in query.items())
+            os.makedirs(os.path.join(fixtures_dir, callback), exist_ok=True)
+            name = os.path.join(callback, hashlib.sha1(url.encode()).hexdigest())
+            with open(os.path.join(fixtures_dir, name), 'wb') as f:
+                f.write(body)
+            index.write(json.dumps({'callback': callback, 'url': url, 'path': name, 'meta': meta},
+                ensure_ascii=False) + '\n')
+            counts[callback] += 1
+    return dict(counts)
+
+
+class FakeProxyApi(resource.Resource):
+    '''讯代理格式的代理 api：轮流返回站点端口；/_stats 返回站点请求统计'''
+
+    isLeaf = True
+
+    def __init__(self, site, ports, busy_rate=0.0):
+        super().__init__()
+        self.site = site
+        self.ports = ports
+        self.busy_rate = busy_rate
+        self.issued = 0
+
+    def render_GET(self, request):
+        path = urlparse(request.uri.decode()).path
+        request.setHeader('Content-Type', 'application/json')
+        if path == '/_stats':
+            stats = dict(self.site.stats, proxies_issued=self.issued)
+            return json.dumps(stats).encode()
+        if random.random() < self.busy_rate:
+            return json.dumps({'ERRORCODE': '10001', 'RESULT': '系统繁忙'}).encode()
+        port = self.ports[self.issued % len(self.ports)]
+        self.issued += 1
+        return json.dumps({'ERRORCODE': '0', 'RESULT': [{'ip': '127.0.0.1', 'port': str(port)}]}).encode()
+
+
+def parse_errors(text):
+    '''"302=0.01,403=0.02" -> {302: 0.01, 403: 0.02}'''
+    errors = {}
+    for part in filter(None, (text or '').split(',')):
+        status, rate = part.split('=')
+        errors[int(status)] = float(rate)
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本地模拟自如站点与代理 api')
+    parser.add_argument('--api-port', type=int)
+    parser.add_argument('--ports', help='站点（代理）端口，逗号分隔')
+    parser.add_argument('--fixtures', metavar='DIR', help='不启动服务，将页面写为离线评测语料')
+    parser.add_argument('--districts', type=int, default=2)
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.5)
+    parser.add_argument('--errors', default='', help='注入的错误状态码与概率，如 302=0.01,403=0.01')
+    parser.add_argument('--api-busy', type=float, default=0.0, help='代理 api 返回"系统繁忙"的概率')
+    args = parser.parse_args(argv)
+    if args.fixtures:
+        os.makedirs(args.fixtures, exist_ok=True)
+        print(json.dumps(write_fixtures(args.fixtures, args.districts, args.pages, args.rooms)))
+        return
+    if not (args.api_port and args.ports):
+        parser.error('--api-port、--ports 为必填项（--fixtures 除外）')
+
+    from twisted.internet import reactor
+    ports = [int(x) for x in args.ports.split(',')]
+    site = FakeSite(args.districts, args.pages, args.rooms, args.latency, args.jitter,
+        parse_errors(args.errors))
+    for port in ports:
+        reactor.listenTCP(port, server.Site(site), interface='127.0.0.1')
+    reactor.listenTCP(args.api_port, server.Site(FakeProxyApi(site, ports, args.api_busy)),
+        interface='127.0.0.1')
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
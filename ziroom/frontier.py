@@ -0,0 +1,51 @@
+'''抓取前沿（crawl frontier）
+
+调度队列按请求种类设置优先级（REQUEST_PRIORITIES，数值大的先抓取）：
+    管家信息、支付详情、房屋配置 > 列表页价格图片 > 详情页 > 列表页
+优先完成已发现的房间，而不是继续发现新的列表页。
+列表页的分页（?p=2..N）不直接进入调度队列，而是写入 redis 列表 FRONTIER_KEY（url、referer，集群共用），
+调度队列长度低于 FRONTIER_LOW_WATERMARK 时由 FrontierExtension 分批放入调度队列，
+调度队列（以及请求携带的 item）的大小因此有上限。
+'''
+
+import json
+import logging
+
+# 请求种类 -> 优先级（REQUEST_PRIORITIES 覆盖）
+DEFAULT_PRIORITIES = {
+    'subresource': 30,  # 管家信息、支付详情、房屋配置
+    'sprite': 20,       # 列表页价格图片
+    'detail': 10,       # 详情页
+    'list': 0,          # 列表页
+}
+
+
+def request_priorities(settings):
+    return dict(DEFAULT_PRIORITIES, **settings.getdict('REQUEST_PRIORITIES'))
+
+
+class Frontier(object):
+    '''延后的列表页：redis 列表，先进先出'''
+
+    def __init__(self, server, key):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.server = server
+        self.key = key
+
+    def push(self, pages):
+        '''@:param pages [(url, referer), ...]'''
+        if pages:
+            self.server.rpush(self.key, *[json.dumps([url, referer]) for url, referer in pages])
+
+    def pop(self, count):
+        '''取出最早写入的至多 count 个（事务：多个节点不会取出同一页）
+        @:return [(url, referer), ...]
+        '''
+        pipe = self.server.pipeline(transaction=True)
+        pipe.lrange(self.key, 0, count - 1)
+        pipe.ltrim(self.key, count, -1)
+        entries, _ = pipe.execute()
+        return [tuple(json.loads(x)) for x in entries]
+
+    def __len__(self):
+        return self.server.llen(self.key)
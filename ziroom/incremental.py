@@ -0,0 +1,62 @@
+'''增量抓取
+
+列表页即可得到房间的价格、标签、风格、缩略图等信息，以这些信息计算房间指纹，保存在 redis 中：
+    ziroom:room_fingerprints - hash：room_id -> "指纹:上次完整抓取时间戳"
+指纹未变化、且上次完整抓取未超过 INCREMENTAL_MAX_AGE 秒的房间，只更新 uptime，
+不再请求详情页、管家、支付详情、房屋配置。
+'''
+
+import json
+import time
+import hashlib
+
+
+class RoomIndex(object):
+    '''房间指纹索引'''
+
+    _REDIS_KEY = 'ziroom:room_fingerprints'
+
+    def __init__(self, server, max_age=259200):
+        self.server = server
+        self.max_age = max_age
+
+    @staticmethod
+    def fingerprint(record):
+        '''列表页信息指纹（RoomRecord）：价格（价格图片与价格位置，不需要识别价格图片）、标签、风格、缩略图'''
+        fields = [
+            record.price_src,
+            record.price_position,
+            record.price_payment,
+            record.room_style,
+            record.is_first_rent,
+            record.is_near_subway,
+            record.is_private_bathroom,
+            record.is_private_balcony,
+            record.heating,
+            record.thumb_src,
+        ]
+        data = json.dumps(fields, ensure_ascii=False, sort_keys=True).encode()
+        return hashlib.sha1(data).hexdigest()[:16]
+
+    def unchanged(self, fingerprints):
+        '''指纹未变化且未过期的房间
+        @:param fingerprints {room_id: 指纹}
+        @:return set(room_id)
+        '''
+        if not fingerprints:
+            return set()
+        room_ids = list(fingerprints)
+        values = self.server.hmget(self._REDIS_KEY, room_ids)
+        deadline = time.time() - self.max_age
+        rtn = set()
+        for room_id, value in zip(room_ids, values):
+            if not value:
+                continue
+            fingerprint, _, crawled_time = value.decode().partition(':')
+            if fingerprint == fingerprints[room_id] and int(crawled_time or 0) > deadline:
+                rtn.add(room_id)
+        return rtn
+
+    def update(self, room_id, fingerprint):
+        '''完整抓取房间后记录指纹'''
+        self.server.hset(self._REDIS_KEY, room_id, f"{fingerprint}:{int(time.time())}")
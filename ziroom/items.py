@@ -39,4 +39,66 @@ class ZiroomItem(Item):
     allocation = Field()            # 房间配置 - {"bed":1,"desk":1,"chest":1,"calorifier":0,"washing":1,"microwave":1,"wifi":1,"airCondition":1,"lock":1}
     uptime = Field()                # 更新时间（时间戳） - $int
     rent_status = Field()           # 房间出租状态 - 已出租/未出租
-    video_src = Field()             # 房间展示视频地址
\ No newline at end of file
+    video_src = Field()             # 房间展示视频地址
+    fingerprint = Field()           # 列表页信息指纹（增量抓取，房间写入 mongo 后记入 RoomIndex，不写入 mongo）
+
+class RoomRecord(object):
+    '''抓取中的房间：列表页提取的信息，随请求（meta['item']）传递到详情页
+    使用 __slots__ 且不含嵌套 dict，排队的请求占用更少内存、序列化更小；
+    详情页中用 to_item() 转为 ZiroomItem 后进入管道。
+    '''
+
+    # 与 ZiroomItem 同名的字段
+    item_fields = (
+        'room_id', 'city', 'product', 'room_name', 'room_style', 'is_first_rent',
+        'is_near_subway', 'is_private_bathroom', 'is_private_balcony', 'heating',
+    )
+    __slots__ = item_fields + (
+        'price_num',        # 价格（列表页价格图片识别失败时为 None，交由 Price 管道识别）
+        'price_payment',    # 付款方式 - '每月'
+        'price_position',   # 价格数字在价格图片中的位置 - [$int, ...]
+        'price_src',        # 价格图片地址
+        'thumb_src',        # 标题缩略图地址
+        'referer',          # 列表页地址
+    )
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+    def __getstate__(self):
+        # 序列化（scrapy-redis 请求队列）时只保存字段值，不保存字段名
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"<RoomRecord {self.room_id}>"
+
+    def to_item(self):
+        item = ZiroomItem()
+        for field in self.item_fields:
+            item[field] = getattr(self, field)
+        item['price'] = {
+            'num': self.price_num,
+            'payment': self.price_payment,
+            'path': None,
+            'origin_src': self.price_src,
+            'position': self.price_position,
+            'referer': self.referer,
+        }
+        item['title_thumb'] = {
+            'path': None,
+            'referer': self.referer,
+            'origin_src': self.thumb_src,
+        }
+        return item
+
+
+class RoomPartMissing(Item):
+    '''房间片段请求失败（下载失败、接口返回异常）：合并时该片段记为已到达且没有字段，房间不必等待超时'''
+
+    room_id = Field()
+    part = Field()                  # 片段 - 'keeper/payment_air/allocation'
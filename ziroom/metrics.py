@@ -0,0 +1,70 @@
+'''Prometheus 指标
+
+各模块在此声明的指标上记录（observe / inc），由 MetricsExtension 通过 http 提供 /metrics。
+未安装 prometheus_client 时指标为空操作（接口相同，不记录），MetricsExtension 不启用。
+
+    ziroom_download_latency_seconds{callback}   下载延迟（按回调）
+    ziroom_responses_total{status}              响应数（按状态码，含 302、403、478、510）
+    ziroom_ocr_seconds{method}                  价格图片识别耗时：cache、template、tesseract、failed
+    ziroom_mongo_write_seconds{source}          mongo 写操作从管道提交到写入完成的耗时（按来源管道：SaveMain、Keeper、
+                                                PaymentAir、Allocation；合并写入的房间每个片段记录一次）
+    ziroom_mongo_bulk_write_seconds             mongo 批量写入（一个批次）耗时
+    ziroom_proxy_fetch_seconds                  请求代理 api 耗时
+    ziroom_proxy_check_seconds{result}          检测代理耗时：ok、failed
+    ziroom_proxy_rotations_total                从代理 api 获取的代理数（used_proxy_num）
+    ziroom_scheduler_queue_size                 redis 调度队列长度
+    ziroom_dupefilter_size                      去重集合大小
+'''
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+class _NullMetric(object):
+    '''空指标：未安装 prometheus_client 时使用'''
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, amount):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def set_function(self, f):
+        pass
+
+
+def _metric(kind, name, documentation, labelnames=(), **kwargs):
+    if prometheus_client is None:
+        return _NullMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labelnames, **kwargs)
+
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+_OCR_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+download_latency = _metric('Histogram', 'ziroom_download_latency_seconds',
+    '下载延迟（秒）', ['callback'], buckets=_LATENCY_BUCKETS)
+responses = _metric('Counter', 'ziroom_responses_total', '响应数', ['status'])
+ocr_seconds = _metric('Histogram', 'ziroom_ocr_seconds',
+    '价格图片识别耗时（秒）', ['method'], buckets=_OCR_BUCKETS)
+mongo_write_seconds = _metric('Histogram', 'ziroom_mongo_write_seconds',
+    'mongo 写操作从进入缓冲区到写入完成的耗时（秒）', ['source'], buckets=_LATENCY_BUCKETS)
+mongo_bulk_write_seconds = _metric('Histogram', 'ziroom_mongo_bulk_write_seconds',
+    'mongo 批量写入耗时（秒）', buckets=_LATENCY_BUCKETS)
+proxy_fetch_seconds = _metric('Histogram', 'ziroom_proxy_fetch_seconds',
+    '请求代理 api 耗时（秒）', buckets=_LATENCY_BUCKETS)
+proxy_check_seconds = _metric('Histogram', 'ziroom_proxy_check_seconds',
+    '检测代理耗时（秒）', ['result'], buckets=_LATENCY_BUCKETS)
+proxy_rotations = _metric('Counter', 'ziroom_proxy_rotations_total', '从代理 api 获取的代理数')
+scheduler_queue_size = _metric('Gauge', 'ziroom_scheduler_queue_size', 'redis 调度队列长度')
+dupefilter_size = _metric('Gauge', 'ziroom_dupefilter_size', '去重集合大小')
+dupefilter_fill_ratio = _metric('Gauge', 'ziroom_dupefilter_fill_ratio', '布隆过滤器已置位的比例')
+dupefilter_memory_bytes = _metric('Gauge', 'ziroom_dupefilter_memory_bytes', '布隆过滤器位图占用的字节数')
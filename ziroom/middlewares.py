@@ -1,4 +1,10 @@
-from scrapy import signals
+import os
+import json
+import logging
+import hashlib
+
+from scrapy import signals, Request
+from scrapy.exceptions import NotConfigured
 
 from fake_useragent import UserAgent
 
@@ -16,3 +22,92 @@ class RandomUserAgentDM(object):
     @classmethod
     def from_crawler(cls, crawler):
         return cls(crawler)
+
+
+class FixtureRecorderDM(object):
+    '''记录响应作为离线评测语料（scrapy parsebench） - downloader middleware
+    FIXTURES_DIR 非空时启用：状态码 200 的响应按回调分目录保存，索引追加到 FIXTURES_DIR/index.jsonl；
+    每种回调最多记录 FIXTURES_MAX_PER_CALLBACK 个响应。
+    '''
+
+    # 回放回调所需的 meta
+    meta_keys = ('room_id', 'referer', 'resblock_id', 'house_id')
+
+    def __init__(self, fixtures_dir, max_per_callback):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.fixtures_dir = fixtures_dir
+        self.max_per_callback = max_per_callback
+        self.counts = {}
+        os.makedirs(fixtures_dir, exist_ok=True)
+        self.index = open(os.path.join(fixtures_dir, 'index.jsonl'), 'a', encoding='utf-8')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        fixtures_dir = crawler.settings.get('FIXTURES_DIR')
+        if not fixtures_dir:
+            raise NotConfigured
+        ins = cls(fixtures_dir, crawler.settings.getint('FIXTURES_MAX_PER_CALLBACK', 200))
+        crawler.signals.connect(ins.spider_closed, signal=signals.spider_closed)
+        return ins
+
+    def process_response(self, request, response, spider):
+        callback = getattr(request.callback, '__name__', 'parse')
+        if response.status != 200 or self.counts.get(callback, 0) >= self.max_per_callback:
+            return response
+        self.counts[callback] = self.counts.get(callback, 0) + 1
+        path = os.path.join(callback, hashlib.sha1(response.url.encode()).hexdigest())
+        meta = {k: request.meta[k] for k in self.meta_keys if k in request.meta}
+        if 'item' in request.meta:
+            meta['room_id'] = getattr(request.meta['item'], 'room_id', None)
+        try:
+            os.makedirs(os.path.join(self.fixtures_dir, callback), exist_ok=True)
+            with open(os.path.join(self.fixtures_dir, path), 'wb') as f:
+                f.write(response.body)
+            self.index.write(json.dumps(
+                {'callback': callback, 'url': response.url, 'path': path, 'meta': meta},
+                ensure_ascii=False) + '\n')
+            self.index.flush()
+        except Exception as e:
+            self.logger.warning(f"记录响应失败：{response.url} - {e}")
+        return response
+
+    def spider_closed(self, spider):
+        self.index.close()
+        self.logger.warning(f"已记录响应：{self.counts}")
+
+
+class BatchDupeFilterSM(object):
+    '''批量去重 - spider middleware
+    去重器支持批量检查（requests_seen，如 ziroom.dupefilter.BloomDupeFilter）时，回调产出的请求一次检查完：
+    重复的请求在此丢弃；未重复的请求已加入去重器，标记 dont_filter，调度器不再逐个检查。
+    '''
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('DUPEFILTER_BATCH_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def process_spider_output(self, response, result, spider):
+        df = getattr(getattr(self.crawler.engine.slot, 'scheduler', None), 'df', None)
+        if not hasattr(df, 'requests_seen'):
+            yield from result
+            return
+        requests = []
+        for x in result:
+            if isinstance(x, Request) and not x.dont_filter:
+                requests.append(x)
+            else:
+                yield x
+        if not requests:
+            return
+        for request, seen in zip(requests, df.requests_seen(requests)):
+            if seen:
+                df.log(request, spider)
+                self.crawler.stats.inc_value('dupefilter/filtered')
+            else:
+                request.dont_filter = True
+                yield request
@@ -5,14 +5,37 @@ from ziroom.proxy import proxy_ins
 class MyDownloader(Downloader):
     '''自定义下载器：在下载前添加代理。
     针对代理有时效限制的情况，长效代理请无视。
+
+    代理获取是异步的（Deferred）：更换代理期间请求在此等待，
+    reactor 线程继续处理其他下载与管道。
+    每个代理使用独立的下载槽位（slot），并发上限为代理的 concurrency
+    （默认 PROXY_SLOT_CONCURRENCY，启用 AdaptiveConcurrencyExtension 时动态调整）。
     '''
 
-    def _download(self, slot, request, spider):
-        '''在下载前添加代理'''
-        proxy = proxy_ins.get_proxy()  # 获取一个可用代理（非异步）
+    def _enqueue_request(self, request, spider):
+        '''进入下载槽位（slot）前添加代理'''
+        d = proxy_ins.get_proxy_async()
+        d.addCallback(self._set_proxy, request, spider)
+        return d
+
+    def _set_proxy(self, proxy, request, spider):
         if proxy:
             request.meta['proxy'] = proxy
+            request.meta[self.DOWNLOAD_SLOT] = proxy
         else:
             raise CloseSpider('代理使用失败，关闭 spider')
-        
-        return super()._download(slot, request, spider)
\ No newline at end of file
+        d = super()._enqueue_request(request, spider)
+        d.addBoth(self._release_proxy, proxy)
+        return d
+
+    def _release_proxy(self, result, proxy):
+        proxy_ins.release(proxy)
+        return result
+
+    def _get_slot(self, request, spider):
+        '''代理的下载槽位：新建时使用代理的并发上限'''
+        is_new = request.meta.get(self.DOWNLOAD_SLOT) not in self.slots
+        key, slot = super()._get_slot(request, spider)
+        if is_new and key in proxy_ins.pool:
+            slot.concurrency = proxy_ins.pool[key].concurrency
+        return key, slot
@@ -0,0 +1,375 @@
+'''价格图片数字识别
+
+价格图片为 0-9 十个数字横向排列的图片（顺序随机），价格由数字在图片中的位置组合而成。
+DigitDecoder 将图片按列切分为 10 个字符，与学习到的数字模板做匹配（numpy），
+匹配置信度低时回退 tesseract（orc_img），并用 tesseract 的结果继续学习模板。
+OcrService 的子进程把学习样本返回主进程：主进程的识别器学习后定期保存到 OCR_TEMPLATES_PATH，
+子进程在模板文件更新后重新加载（未配置 OCR_TEMPLATES_PATH 时只有主进程能用到学习结果）。
+OcrCache 以图片内容的 sha1 为 key 缓存识别结果：进程内 LRU + redis 共享（集群内所有节点）。
+OcrService 在进程池中识别（不占用 reactor 线程），子进程启动时加载最新模板，此后每个任务前检查模板文件是否更新。
+'''
+
+import io
+import os
+import time
+import logging
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+from scrapy.utils.project import get_project_settings
+from scrapy_redis import connection
+from twisted.internet import defer
+
+from ziroom import metrics
+from ziroom.utils import orc_img
+
+project_settings = get_project_settings()
+logger = logging.getLogger(__name__)
+
+
+class DigitDecoder(object):
+    '''模板匹配数字识别'''
+
+    glyph_size = (12, 18)   # 字符归一化尺寸（宽，高）
+
+    def __init__(self, templates_path=None, min_confidence=0.85):
+        self.templates_path = templates_path
+        self.min_confidence = min_confidence    # 低于该置信度时回退 tesseract
+        self.sums = np.zeros((10, self.glyph_size[0] * self.glyph_size[1]), dtype=np.float64)
+        self.counts = np.zeros(10, dtype=np.int64)
+        self.templates = None   # 归一化后的模板矩阵 (10, w*h)，所有数字都学习过后才可用
+        self._lock = threading.Lock()
+        self._mtime = None      # 已加载的模板文件的修改时间
+        self.reload()
+
+    def reload(self):
+        '''模板文件存在且比已加载的新时重新加载，返回是否加载'''
+        if not self.templates_path:
+            return False
+        try:
+            mtime = os.stat(self.templates_path).st_mtime
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        with np.load(self.templates_path) as data:
+            sums, counts = data['sums'], data['counts']
+        with self._lock:
+            self.sums, self.counts = sums, counts
+            self._mtime = mtime
+            self._update_templates()
+        return True
+
+    def segment(self, img):
+        '''将图片切分为字符，返回归一化后的字符向量矩阵 (n, w*h)，切分失败返回 None'''
+        ink = self._ink_mask(img)
+        columns = ink.any(axis=0)
+        # 连续有墨迹的列为一个字符
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], columns.view(np.int8), [0]))))
+        spans = edges.reshape(-1, 2)
+        if len(spans) != 10:
+            return None
+        glyphs = []
+        for start, end in spans:
+            glyph = ink[:, start:end]
+            rows = np.flatnonzero(glyph.any(axis=1))
+            glyph = glyph[rows[0]:rows[-1] + 1]
+            glyph = Image.fromarray((glyph * 255).astype(np.uint8)).resize(
+                self.glyph_size, Image.BILINEAR)
+            glyphs.append(np.asarray(glyph, dtype=np.float64).ravel())
+        return self._normalize(np.array(glyphs))
+
+    def decode(self, img):
+        '''识别图片中的数字
+        @:return (str, float) 数字字符串与置信度（各字符最佳匹配度的最小值），无法识别时为 (None, 0)
+        '''
+        if self.templates is None:
+            return None, 0.0
+        glyphs = self.segment(img)
+        if glyphs is None:
+            return None, 0.0
+        similarity = glyphs @ self.templates.T
+        digits = similarity.argmax(axis=1)
+        confidence = float(similarity[np.arange(len(digits)), digits].min())
+        return ''.join(map(str, digits)), confidence
+
+    def learn(self, img, digits):
+        '''用已知结果（如 tesseract 识别结果）学习模板'''
+        if not self._valid(digits):
+            return False
+        return self.learn_glyphs(self.segment(img), digits)
+
+    def learn_glyphs(self, glyphs, digits):
+        '''用已切分的字符向量（segment 的结果）学习模板'''
+        if glyphs is None or not self._valid(digits):
+            return False
+        with self._lock:
+            for glyph, digit in zip(glyphs, digits):
+                self.sums[int(digit)] += glyph
+                self.counts[int(digit)] += 1
+            self._update_templates()
+        return True
+
+    def save(self, templates_path=None):
+        '''保存模板（先写临时文件再替换，子进程不会读到写了一半的文件）'''
+        path = templates_path or self.templates_path
+        with self._lock:
+            # 写入文件对象，np.savez 不会追加 .npz 后缀
+            with open(path + '.tmp', 'wb') as f:
+                np.savez(f, sums=self.sums, counts=self.counts)
+        os.replace(path + '.tmp', path)
+        if path == self.templates_path:
+            self._mtime = os.stat(path).st_mtime
+
+    @staticmethod
+    def _valid(digits):
+        return isinstance(digits, str) and len(digits) == 10 and digits.isdigit()
+
+    def _update_templates(self):
+        if self.counts.min() > 0:
+            self.templates = self._normalize(self.sums / self.counts[:, None])
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = vectors - vectors.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    @staticmethod
+    def _ink_mask(img):
+        '''墨迹（数字笔画）掩码：透明图片取 alpha 通道，否则取与背景色差异大的像素'''
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            alpha = np.asarray(img.convert('RGBA'))[:, :, 3]
+            return alpha > 127
+        gray = np.asarray(img.convert('L'), dtype=np.int16)
+        background = np.median(np.concatenate((gray[0], gray[-1], gray[:, 0], gray[:, -1])))
+        return np.abs(gray - background) > 64
+
+
+class OcrCache(object):
+    '''识别结果缓存
+    一级：进程内 LRU（OCR_CACHE_SIZE 条）；二级：redis 共享缓存（过期时间 OCR_CACHE_TTL 秒）。
+    redis 的 hash 无法对单个 field 设置过期时间，因此每个结果单独保存为带过期时间的 key。
+    '''
+
+    _REDIS_KEY = 'ocr:digits:%s'   # redis key：图片 sha1 -> 识别结果
+
+    def __init__(self, server, max_size=1024, ttl=86400):
+        self.server = server
+        self.max_size = max_size
+        self.ttl = ttl
+        self.local = OrderedDict()
+        self.stats = {
+            'local_hits': 0,    # 命中进程内缓存
+            'redis_hits': 0,    # 命中 redis 缓存
+            'misses': 0,        # 未命中（需识别）
+            'redis_errors': 0,  # redis 读写异常
+        }
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha1(data).hexdigest()
+
+    def get(self, digest):
+        with self._lock:
+            value = self.local.get(digest)
+            if value is not None:
+                self.local.move_to_end(digest)
+                self.stats['local_hits'] += 1
+                return value
+        try:
+            value = self.server.get(self._REDIS_KEY % digest)
+        except Exception as e:
+            self.stats['redis_errors'] += 1
+            logger.warning(f"ocr cache: redis get failed - {e}")
+            value = None
+        if value is not None:
+            value = value.decode()
+            self._set_local(digest, value)
+            self.stats['redis_hits'] += 1
+        else:
+            self.stats['misses'] += 1
+        return value
+
+    def set(self, digest, value):
+        self._set_local(digest, value)
+        try:
+            self.server.set(self._REDIS_KEY % digest, value, ex=self.ttl)
+        except Exception as e:
+            self.stats['redis_errors'] += 1
+            logger.warning(f"ocr cache: redis set failed - {e}")
+
+    def export_stats(self, stats):
+        '''写入 scrapy stats'''
+        for k, v in self.stats.items():
+            stats.set_value(f"ocr_cache/{k}", v)
+
+    def _set_local(self, digest, value):
+        with self._lock:
+            self.local[digest] = value
+            self.local.move_to_end(digest)
+            while len(self.local) > self.max_size:
+                self.local.popitem(last=False)
+
+
+digit_decoder = DigitDecoder(
+    templates_path=project_settings.get('OCR_TEMPLATES_PATH'),
+    min_confidence=project_settings.getfloat('OCR_MIN_CONFIDENCE', 0.85),
+)
+
+ocr_cache = OcrCache(
+    connection.from_settings(project_settings),
+    max_size=project_settings.getint('OCR_CACHE_SIZE', 1024),
+    ttl=project_settings.getint('OCR_CACHE_TTL', 86400),
+)
+
+
+def recognize_digits(img, decoder=digit_decoder, cache=ocr_cache, fallback=True):
+    '''识别价格图片中的数字：先查缓存，模板匹配优先，置信度低时回退 tesseract
+    img 为图片内容（bytes）或图片路径；fallback=False 时不回退 tesseract（识别失败返回 None）
+    '''
+    start_time = time.perf_counter()
+    digits, method = _recognize(img, decoder, cache, fallback)
+    metrics.ocr_seconds.labels(method).observe(time.perf_counter() - start_time)
+    return digits
+
+
+def _recognize(img, decoder=digit_decoder, cache=ocr_cache, fallback=True, samples=None):
+    '''同 recognize_digits，返回 (识别结果, 识别方式)，识别方式：cache、template、tesseract、failed
+    samples 不为 None 时，tesseract 结果学习到的样本 (字符向量, 数字) 加入 samples
+    '''
+    if isinstance(img, bytes):
+        data, img_path = img, '<memory>'
+    else:
+        img_path = img
+        try:
+            with open(img_path, 'rb') as f:
+                data = f.read()
+        except Exception as e:
+            logger.critical(f"open image failed: {img_path}")
+            logger.critical(e)
+            return None, 'failed'
+    digest = cache.digest(data)
+    digits = cache.get(digest)
+    if digits:
+        return digits, 'cache'
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Exception as e:
+        logger.critical(f"open image failed: {img_path} - sha1：{digest}")
+        logger.critical(e)
+        return None, 'failed'
+    method = 'template'
+    digits, confidence = decoder.decode(img)
+    if not (digits and confidence >= decoder.min_confidence):
+        if not fallback:
+            return None, 'failed'
+        method = 'tesseract'
+        digits = (orc_img(img) or '').strip() or None
+        glyphs = decoder.segment(img) if digits else None
+        if decoder.learn_glyphs(glyphs, digits) and samples is not None:
+            samples.append((glyphs, digits))
+    if digits and len(digits) == 10:
+        cache.set(digest, digits)
+    return digits, method if digits else 'failed'
+
+
+def _init_worker():
+    '''子进程初始化：加载最新保存的模板（子进程继承或导入时加载的模板可能已过时）'''
+    digit_decoder.reload()
+
+
+def _worker_recognize(img):
+    '''子进程中识别，返回 (识别结果, 本次缓存统计增量, 识别方式, 耗时, 学习样本)
+    子进程中的指标不会被导出：识别方式、耗时返回主进程记录；
+    子进程学习的模板不会保存：学习样本返回主进程学习、保存，主进程保存后子进程重新加载模板
+    '''
+    digit_decoder.reload()
+    before = dict(ocr_cache.stats)
+    samples = []
+    start_time = time.perf_counter()
+    digits, method = _recognize(img, samples=samples)
+    elapsed = time.perf_counter() - start_time
+    return digits, {k: v - before[k] for k, v in ocr_cache.stats.items()}, method, elapsed, samples
+
+
+class OcrService(object):
+    '''图片识别进程池
+    recognize(img) 返回 Deferred（结果为识别字符串，失败为 None），各请求的结果互不影响。
+    img 为图片内容（bytes，传给子进程时会复制一次）或图片路径。
+    max_pending 限制的是提交到进程池的任务数（进行中与在进程池中排队的），超出的任务在 DeferredSemaphore
+    的等待队列中等待（背压）；等待队列本身不设上限，其长度受调用方并发处理的 item 数
+    （SCRAPER_SLOT_MAX_ACTIVE_SIZE）限制。
+    子进程返回的学习样本由主进程的 decoder 学习，每学习 save_every 个样本、以及 close 时保存模板。
+    '''
+
+    def __init__(self, workers=None, max_pending=64, decoder=digit_decoder, save_every=20):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.workers = workers or os.cpu_count() or 1
+        self.semaphore = defer.DeferredSemaphore(max_pending)
+        self.executor = None
+        self.decoder = decoder
+        self.save_every = save_every
+        self.unsaved = 0    # 学习后尚未保存的样本数
+
+    def recognize(self, img):
+        return self.semaphore.run(self._submit, img)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        if self.unsaved:
+            self.save_templates()
+
+    def save_templates(self):
+        if not self.decoder.templates_path:
+            return
+        try:
+            self.decoder.save()
+        except Exception as e:
+            self.logger.error(f"保存数字模板失败：{self.decoder.templates_path}")
+            self.logger.error(e)
+        else:
+            self.logger.info(f"保存数字模板：{self.decoder.templates_path}，各数字样本数：{self.decoder.counts.tolist()}")
+            self.unsaved = 0
+
+    def _submit(self, img):
+        from twisted.internet import reactor
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=_init_worker)
+        d = defer.Deferred()
+        future = self.executor.submit(_worker_recognize, img)
+        img_path = img if isinstance(img, str) else '<memory>'
+        future.add_done_callback(lambda f: reactor.callFromThread(self._done, f, d, img_path))
+        return d
+
+    def _done(self, future, d, img_path):
+        try:
+            digits, cache_stats, method, elapsed, samples = future.result()
+        except Exception as e:
+            self.logger.critical(f"识别图片异常：{img_path}")
+            self.logger.critical(e)
+            digits = None
+        else:
+            for k, v in cache_stats.items():
+                ocr_cache.stats[k] += v
+            metrics.ocr_seconds.labels(method).observe(elapsed)
+            self.unsaved += sum(self.decoder.learn_glyphs(glyphs, x) for glyphs, x in samples)
+            if self.unsaved >= self.save_every:
+                self.save_templates()
+        d.callback(digits)
+
+
+ocr_service = OcrService(
+    workers=project_settings.getint('OCR_WORKERS', 0),
+    max_pending=project_settings.getint('OCR_MAX_PENDING', 64),
+    save_every=project_settings.getint('OCR_TEMPLATES_SAVE_EVERY', 20),
+)
@@ -4,24 +4,32 @@ import copy
 import time
 import logging
 import hashlib
+from io import BytesIO
+from collections import OrderedDict
 
 from functools import reduce
 import pytesseract
 from PIL import Image
 
+from twisted.internet import defer, task
 from twisted.internet.defer import inlineCallbacks, returnValue, Deferred
-from twisted.internet.threads import deferToThread
-from twisted.python.failure import Failure
 
 from txmongo.connection import ConnectionPool
+from pymongo import UpdateOne
 
 import scrapy
+from scrapy_redis import connection
 from scrapy.exceptions import DropItem
 from scrapy.utils.python import to_bytes
 from scrapy.utils.project import get_project_settings
 from scrapy.pipelines.images import FilesPipeline
 
-from ziroom.utils import deep_strip, remove_wrap, string2number, orc_img, combine_price
+from ziroom import metrics
+from ziroom.utils import deep_strip, remove_wrap, string2number, combine_price
+from ziroom.items import RoomPartMissing
+from ziroom.incremental import RoomIndex
+from ziroom.ocr import ocr_service, ocr_cache
+from ziroom.profiling import profiled
 
 project_settings = get_project_settings()
 
@@ -48,50 +56,300 @@ class MongoClient(object):
 mongo = MongoClient()
 
 
-class Price(FilesPipeline):
+class MongoBulkWriter(object):
+    '''mongo 批量写入：各管道的 upsert 先进入缓冲区，
+    缓冲数量达到 MONGO_BULK_SIZE、或每隔 MONGO_BULK_INTERVAL 秒，以无序 bulk_write 批量提交。
+    关闭 spider 时须调用 close()，将缓冲区写完后再断开连接池。
+    每个写操作记录来源（管道）与进入缓冲区的时间，写入完成后按来源记录耗时（ziroom_mongo_write_seconds）；
+    合并写入（RoomCoalescer）的操作记录每个片段的来源与提交时间，写入完成后每个片段记录一次。
+    写操作可带回调（callback），写入成功后调用，写入失败的操作不调用。
+    '''
+
+    def __init__(self, col):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.col = col
+        self.batch_size = project_settings.getint('MONGO_BULK_SIZE', 200)
+        self.flush_interval = project_settings.getfloat('MONGO_BULK_INTERVAL', 2)
+        self.buffer = []        # [(UpdateOne, [(来源, 进入缓冲区的时间), ...], 写入成功后的回调)]
+        self.flushing = set()   # 提交中的批次（Deferred）
+        self.stats = {
+            'batches': 0,           # 已提交批次数
+            'ops': 0,               # 已提交写操作数
+            'errors': 0,            # 出错的写操作数
+            'failed_batches': 0,    # 整批失败的批次数
+            'latency_total': 0.0,   # 批次总耗时（秒）
+            'latency_max': 0.0,     # 批次最大耗时（秒）
+        }
+        self._loop = None
+
+    def update(self, spec, document, upsert=True, source='', callback=None, sources=None):
+        '''加入一个 update 操作（不等待写入），source 为来源（管道名），callback 为写入成功后的回调（无参数）
+        sources 为合并写入的各片段 [(来源, 提交时间), ...]，传入时代替 source 记录耗时
+        '''
+        if self._loop is None:
+            self._loop = task.LoopingCall(self.flush)
+            self._loop.start(self.flush_interval, now=False)
+        sources = sources or [(source, time.time())]
+        self.buffer.append((UpdateOne(spec, document, upsert=upsert), sources, callback))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''提交缓冲区中的全部操作，返回 Deferred'''
+        if not self.buffer:
+            return defer.succeed(None)
+        batch, self.buffer = self.buffer, []
+        start_time = time.time()
+        d = self.col.bulk_write([op for op, _, _ in batch], ordered=False)
+        d.addCallbacks(
+            self._flushed, self._flush_failed,
+            callbackArgs=(batch, start_time), errbackArgs=(batch, start_time)
+        )
+        self.flushing.add(d)
+        d.addBoth(self._discard, d)
+        return d
+
+    def close(self):
+        '''停止定时提交，写完缓冲区，返回 Deferred'''
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self.flush()
+        d = defer.DeferredList(list(self.flushing))
+        d.addCallback(lambda _: self.logger.warning(f"mongo 批量写入统计：{self.stats}"))
+        return d
+
+    def _discard(self, result, d):
+        self.flushing.discard(d)
+        return result
+
+    def _record(self, batch, start_time, errors):
+        now = time.time()
+        latency = now - start_time
+        self.stats['batches'] += 1
+        self.stats['ops'] += len(batch)
+        self.stats['errors'] += errors
+        self.stats['latency_total'] += latency
+        self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+        metrics.mongo_bulk_write_seconds.observe(latency)
+        for _, sources, _ in batch:
+            for source, enqueue_time in sources:
+                metrics.mongo_write_seconds.labels(source).observe(now - enqueue_time)
+        return latency
+
+    def _callback(self, batch, failed=()):
+        '''调用写入成功的操作的回调，failed 为写入失败的操作序号'''
+        for i, (_, _, callback) in enumerate(batch):
+            if callback is None or i in failed:
+                continue
+            try:
+                callback()
+            except Exception as e:
+                self.logger.error(f"mongo 写入回调 Exception：{e}")
+
+    def _flushed(self, result, batch, start_time):
+        latency = self._record(batch, start_time, 0)
+        self.logger.info(f"mongo 批量写入：{len(batch)} 条 - {latency * 1000:.1f} ms")
+        self._callback(batch)
+
+    def _flush_failed(self, failure, batch, start_time):
+        details = getattr(failure.value, 'details', None) or {}
+        errors = len(details.get('writeErrors', ())) or len(batch)
+        latency = self._record(batch, start_time, errors)
+        if errors == len(batch):
+            self.stats['failed_batches'] += 1
+        self.logger.critical(f"mongo 批量写入 Exception：{len(batch)} 条，失败 {errors} 条 - "\
+            f"{latency * 1000:.1f} ms")
+        self.logger.critical(failure.getErrorMessage())
+        if errors < len(batch):
+            # 无序写入：writeErrors 以外的操作已写入
+            self._callback(batch, {error.get('index') for error in details['writeErrors']})
+
+mongo_writer = MongoBulkWriter(mongo.col)
+
+
+class RoomCoalescer(object):
+    '''按 room_id 合并同一房间的 item 片段（主干、管家、支付详情&&空气质量、房屋配置），
+    片段齐全、或等待超过 ROOM_COALESCE_TTL 秒后，合并为一个文档写入一次。
+    子资源请求失败时（RoomPartMissing）片段以空字段加入，房间仍可齐全，不必等待超时。
+    待合并房间数超过 ROOM_COALESCE_MAX 时，最早的房间提前（部分）写入。
+    主干片段带有列表页信息指纹时，房间片段齐全（且没有缺失的片段）、写入 mongo 成功后才将指纹记入 RoomIndex，
+    部分写入的房间下次仍完整抓取。
+    '''
+
+    parts = frozenset(('main', 'keeper', 'payment_air', 'allocation'))
+
+    def __init__(self, writer, index):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.writer = writer
+        self.index = index
+        self.ttl = project_settings.getint('ROOM_COALESCE_TTL', 300)
+        self.max_rooms = project_settings.getint('ROOM_COALESCE_MAX', 5000)
+        # {room_id: {'fields': {}, 'parts': set(), 'missing': set(), 'fingerprint': $str,
+        #   'sources': [(来源管道, 提交时间), ...], 'time': $int}}，最早的在前
+        self.pending = OrderedDict()
+        self.stats = {
+            'fragments': 0,     # 收到的片段数
+            'complete': 0,      # 片段齐全后写入的房间数
+            'expired': 0,       # 超时后（部分）写入的房间数
+            'evicted': 0,       # 超出上限、提前（部分）写入的房间数
+        }
+        self._loop = None
+
+    def add(self, room_id, part, fields, fingerprint=None, source=''):
+        '''加入一个片段（fields 为空：片段缺失），fingerprint 为列表页信息指纹（主干片段），
+        source 为来源管道（mongo 写入耗时按来源记录，默认为片段名）
+        '''
+        if self._loop is None:
+            self._loop = task.LoopingCall(self.expire)
+            self._loop.start(min(self.ttl, 10), now=False)
+        self.stats['fragments'] += 1
+        room = self.pending.get(room_id)
+        if room is None:
+            room = self.pending[room_id] = {
+                'fields': {}, 'parts': set(), 'missing': set(), 'fingerprint': None, 'sources': [],
+                'time': time.time()}
+        room['sources'].append((source or part, time.time()))
+        room['fields'].update(fields)
+        room['parts'].add(part)
+        if not fields:
+            room['missing'].add(part)
+        if fingerprint:
+            room['fingerprint'] = fingerprint
+        if room['parts'] >= self.parts:
+            self._write(room_id, 'complete')
+        elif len(self.pending) > self.max_rooms:
+            self._write(next(iter(self.pending)), 'evicted')
+
+    def expire(self):
+        '''写入等待超时的房间'''
+        deadline = time.time() - self.ttl
+        while self.pending:
+            room_id, room = next(iter(self.pending.items()))
+            if room['time'] > deadline:
+                break
+            self._write(room_id, 'expired')
+
+    def close(self):
+        '''写入全部待合并房间'''
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        while self.pending:
+            self._write(next(iter(self.pending)), 'expired')
+        self.logger.warning(f"房间片段合并统计：{self.stats}")
+
+    def _write(self, room_id, reason):
+        room = self.pending.pop(room_id)
+        self.stats[reason] += 1
+        room['fields']['uptime'] = int(time.time())
+        callback = None
+        if reason == 'complete' and not room['missing'] and room['fingerprint']:
+            callback = lambda: self.index.update(room_id, room['fingerprint'])
+        self.writer.update({'room_id': room_id}, {'$set': room['fields']},
+            callback=callback, sources=room['sources'])
+        if reason != 'complete':
+            self.logger.info(f"部分写入房间 {room_id}（{reason}）：{sorted(room['parts'])}")
+
+room_coalescer = RoomCoalescer(
+    mongo_writer,
+    RoomIndex(connection.from_settings(project_settings), project_settings.getint('INCREMENTAL_MAX_AGE', 259200)),
+)
+
+
+class SpritePipeline(FilesPipeline):
+    '''价格图片管道基类：下载完成后直接识别 response.body 中的图片（不经过磁盘读写），
+    识别结果记入 file_info['digits']。
+    图片是否保存到 FILES_STORE 由 OCR_PERSIST_SPRITES 决定：
+        always - 全部保存；failed - 仅识别失败时保存（便于排查）；never - 不保存
+    '''
+
+    persist_mode = project_settings.get('OCR_PERSIST_SPRITES', 'failed')
+
+    def media_to_download(self, request, info, **kwargs):
+        if self.persist_mode == 'always':
+            return super().media_to_download(request, info, **kwargs)
+        # 不检查 FILES_STORE 中是否已有该图片（省去一次文件系统操作），总是下载后在内存中识别
+        return None
+
+    def file_downloaded(self, response, request, info, **kwargs):
+        if self.persist_mode == 'always':
+            self._persist(self.file_path(request, response=response, info=info), response, info)
+        return hashlib.md5(response.body).hexdigest()
+
+    def media_downloaded(self, response, request, info, **kwargs):
+        file_info = super().media_downloaded(response, request, info, **kwargs)
+        file_info['persisted'] = self.persist_mode == 'always'
+        d = ocr_service.recognize(response.body)
+        d.addCallback(self._recognized, file_info, response, info)
+        return d
+
+    def _recognized(self, digits, file_info, response, info):
+        file_info['digits'] = digits
+        if self.persist_mode == 'failed' and not (digits and len(digits) == 10):
+            self._persist(file_info['path'], response, info)
+            file_info['persisted'] = True
+        return file_info
+
+    def _persist(self, path, response, info):
+        self.store.persist_file(path, BytesIO(response.body), info)
+
+    def recognize(self, file_info):
+        '''识别结果（Deferred）：下载时已识别则直接返回，否则（图片来自 FILES_STORE）识别文件'''
+        if 'digits' in file_info:
+            return defer.succeed(file_info['digits'])
+        return ocr_service.recognize(self.store_path(file_info))
+
+    def store_path(self, file_info):
+        '''图片在 FILES_STORE 中的路径，未保存时为 None'''
+        if not file_info.get('persisted', True):
+            return None
+        return project_settings['FILES_STORE'].rstrip('/').rstrip('\\') + '/' + file_info['path']
+
+    def file_path(self, request, response=None, info=None):
+        media_guid = hashlib.sha1(to_bytes(request.url)).hexdigest()
+        media_ext = os.path.splitext(request.url)[1]
+        tail_dir_name = media_guid[0:2]
+        return '{}/{}{}'.format(
+            tail_dir_name, 
+            media_guid, 
+            media_ext
+        )
+
+
+class Price(SpritePipeline):
     '''下载价格图片，识别数值
     使用 FilesPipeline 而非 ImagesPipeline，便于图片识别。
+    价格通常已在列表页统一识别（见 ZiroomSpider.parse_price_sprite），此处仅处理识别失败的 item。
     '''
 
     logger = logging.getLogger(__name__ + '.' + 'Price')
-    img_cache = {}
 
     def get_media_requests(self, item, info):
-        if 'price' in item and item['price']:
+        # 列表页已识别出价格时无需下载
+        if item.get('price') and item['price']['num'] is None and item['price']['origin_src']:
             yield scrapy.Request(
                 copy.copy(item['price']['origin_src']),
                 headers={'referer': copy.copy(item['price']['referer'])},
             )
 
+    @profiled()
+    @inlineCallbacks
     def item_completed(self, results, item, info):
-        if item.get('price'):
+        if item.get('price') and results:
             is_success, file_info = results[0]
             if is_success:
-                img_path = project_settings['FILES_STORE'].rstrip('/')\
-                    .rstrip('\\') + '/' + file_info['path']
-                img_str = self.img_cache.get(file_info['path'])
+                img_path = self.store_path(file_info)
+                img_str = yield self.recognize(file_info)
                 price_num = None
                 if img_str:
-                    self.logger.info("图片已识别：{} - {} {}".format(
+                    self.logger.info("识别图片：{} - {} {}".format(
                         img_str,
                         item['room_id'],
                         img_path,
                     ))
                     price_num = combine_price(img_str, item['price']['position'])
                 else:
-                    img_str = orc_img(img_path)
-                    if img_str:
-                        self.logger.info("识别图片：{} - {} {}".format(
-                            img_str,
-                            item['room_id'],
-                            img_path,
-                        ))
-                        if len(self.img_cache) > 100:
-                            self.img_cache.clear()
-                        self.img_cache[file_info['path']] = img_str
-                        price_num = combine_price(img_str, item['price']['position'])
-                    else:
-                        self.logger.critical(f"识别图片失败：{img_path}")
+                    self.logger.critical(f"识别图片失败：{img_path}")
+                    info.spider.crawler.stats.inc_value('ocr/failed')
                 item['price']['path'] = img_path
                 item['price']['num'] = price_num
                 if price_num:
@@ -102,17 +360,14 @@ class Price(FilesPipeline):
                 self.logger.warning(f"下载 价格图片 {item['room_id']}：failed -- "\
                     f"{item['price']['origin_src']}")
                 self.logger.warning(file_info)
-        return item
+        returnValue(item)
+
+    def close_spider(self, spider):
+        '''识别结果缓存统计，关闭识别进程池（Price、PaymentAir 共用）'''
+        ocr_service.close()
+        ocr_cache.export_stats(spider.crawler.stats)
+        self.logger.warning(f"图片识别缓存统计：{ocr_cache.stats}")
 
-    def file_path(self, request, response=None, info=None):
-        media_guid = hashlib.sha1(to_bytes(request.url)).hexdigest()
-        media_ext = os.path.splitext(request.url)[1]
-        tail_dir_name = media_guid[0:2]
-        return '{}/{}{}'.format(
-            tail_dir_name, 
-            media_guid, 
-            media_ext
-        )
 
 
 class SaveMain(object):
@@ -121,24 +376,22 @@ class SaveMain(object):
     def __init__(self):
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
 
-    @inlineCallbacks
+    @profiled()
     def process_item(self, item, spider):
         if item.get('room_name'):
             self.format_item(item)
-            try:
-                item['uptime'] = int(time.time())
-                res = yield mongo.col.update(
-                    {'room_id': item['room_id']}, 
-                    {'$set': dict(item)}, 
-                    upsert=True
-                )
-                self.logger.warning(f"保存主干信息 {item['room_id']}")
-                self.logger.debug(res)
-            except Exception as e:
-                self.logger.critical(f"保存主干信息 Exception: ")
-                self.logger.critical(e)
-        returnValue(item)
+            fields = dict(item)
+            room_coalescer.add(item['room_id'], 'main', fields, fields.pop('fingerprint', None),
+                source=self.__class__.__name__)
+            self.logger.warning(f"保存主干信息 {item['room_id']}")
+        elif item.keys() == {'room_id', 'uptime'}:
+            # 增量抓取：房间未变化，只更新 uptime（不新建文档）
+            mongo_writer.update(
+                {'room_id': item['room_id']}, {'$set': {'uptime': item['uptime']}}, upsert=False,
+                source=self.__class__.__name__)
+        return item
 
+    @profiled()
     def format_item(self, item):
         item = deep_strip(item)
         # 地铁信息
@@ -189,35 +442,22 @@ class Keeper(object):
 
     logger = logging.getLogger(__name__ + '.' + 'Keeper')
 
-    @inlineCallbacks
+    @profiled()
     def process_item(self, item, spider):
         if item.get('keeper'):
             # 保存数据
-            try:
-                res = yield mongo.col.update(
-                    {'room_id': item['room_id']},
-                    {'$set': {'keeper': dict(item['keeper']), 'uptime': int(time.time())}},
-                    upsert=True
-                )
-                self.logger.warning(f"保存 管家信息 {item['room_id']}")
-                self.logger.debug(res)
-            except Exception as e:
-                self.logger.critical(f"保存管家信息 Exception: ")
-                self.logger.critical(e)
-        returnValue(item)
+            room_coalescer.add(item['room_id'], 'keeper', {'keeper': dict(item['keeper'])},
+                source=self.__class__.__name__)
+            self.logger.warning(f"保存 管家信息 {item['room_id']}")
+        elif isinstance(item, RoomPartMissing) and item['part'] == 'keeper':
+            room_coalescer.add(item['room_id'], 'keeper', {}, source=self.__class__.__name__)
+        return item
 
 
-class PaymentAir(FilesPipeline):
+class PaymentAir(SpritePipeline):
     '''支付详情 && 空气质量'''
 
     logger = logging.getLogger(__name__ + '.' + 'PaymentAir')
-    img_str = None
-
-    def end_ocr(self, img_str):
-        if not isinstance(img_str, Failure):
-            self.img_str = img_str
-        else:
-            self.img_str = None
 
     def get_media_requests(self, item, info):
         if item.get('payment'):
@@ -228,6 +468,7 @@ class PaymentAir(FilesPipeline):
                 },
             )
 
+    @profiled()
     @inlineCallbacks
     def item_completed(self, results, item, info):
         if item.get('payment'):
@@ -239,13 +480,9 @@ class PaymentAir(FilesPipeline):
                         item['payment']['png']['origin_src']
                     )
                 )
-                img_path = project_settings['FILES_STORE'].rstrip('/').rstrip('\\') \
-                    + '/' + file_info['path']
+                img_path = self.store_path(file_info)
                 item['payment']['png']['path'] = img_path
-                d = deferToThread(orc_img, img_path)
-                d.addBoth(self.end_ocr)
-                yield d
-                img_str = self.img_str
+                img_str = yield self.recognize(file_info)
                 if img_str:
                     self.logger.info("识别图片：{} - {} {}".format(
                         img_str,
@@ -276,6 +513,7 @@ class PaymentAir(FilesPipeline):
                         )
                 else:
                     self.logger.critical(f"识别图片失败：{img_path}")
+                    info.spider.crawler.stats.inc_value('ocr/failed')
             else:
                 self.logger.warning(
                     "下载 支付详情价格图片 {}：failed -- {}".format(
@@ -284,32 +522,14 @@ class PaymentAir(FilesPipeline):
                     )
                 )
                 self.logger.warning(file_info)
-            # 保存数据
-            try:
-                item['uptime'] = int(time.time())
-                res = yield mongo.col.update(
-                    {'room_id': item['room_id']},
-                    {'$set': dict(item)},
-                    upsert=True
-                )
-                self.logger.warning(f"保存 支付详情&&空气质量信息 {item['room_id']}")
-                self.logger.debug(res)
-            except Exception as e:
-                self.logger.critical(f"保存支付详情 Exception: ")
-                self.logger.critical(e)
+        if 'payment' in item:
+            # 保存数据（无支付详情时，仍保存空气质量、视频地址）
+            room_coalescer.add(item['room_id'], 'payment_air', dict(item), source=self.__class__.__name__)
+            self.logger.warning(f"保存 支付详情&&空气质量信息 {item['room_id']}")
+        elif isinstance(item, RoomPartMissing) and item['part'] == 'payment_air':
+            room_coalescer.add(item['room_id'], 'payment_air', {}, source=self.__class__.__name__)
         returnValue(item)
 
-    def file_path(self, request, response=None, info=None):
-        media_guid = hashlib.sha1(to_bytes(request.url)).hexdigest()
-        media_ext = os.path.splitext(request.url)[1]
-        tail_dir_name = media_guid[0:2]
-        settings = get_project_settings()
-        return '{}/{}{}'.format(
-            tail_dir_name, 
-            media_guid, 
-            media_ext
-        )
-
 
 class Allocation(object):
     '''房间配置'''
@@ -317,22 +537,15 @@ class Allocation(object):
     def __init__(self):
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
 
-    @inlineCallbacks
+    @profiled()
     def process_item(self, item, spider):
-        if item.get('allocation'):
-            try:
-                item['uptime'] = int(time.time())
-                res = yield mongo.col.update(
-                    {'room_id': item['room_id']},
-                    {'$set': dict(item)},
-                    upsert=True
-                )
-                self.logger.warning(f"保存 房屋配置信息 {item['room_id']}")
-                self.logger.debug(res)
-            except Exception as e:
-                self.logger.critical(f"保存房屋配置 Exception: ")
-                self.logger.critical(e)
-        returnValue(item)
+        if 'allocation' in item:
+            # 配置为空时也加入片段，房间才能齐全
+            room_coalescer.add(item['room_id'], 'allocation', dict(item), source=self.__class__.__name__)
+            self.logger.warning(f"保存 房屋配置信息 {item['room_id']}")
+        elif isinstance(item, RoomPartMissing) and item['part'] == 'allocation':
+            room_coalescer.add(item['room_id'], 'allocation', {}, source=self.__class__.__name__)
+        return item
 
 
 
@@ -0,0 +1,166 @@
+'''运行时按需性能分析
+
+profiler 默认关闭：@profiled 装饰的函数只多一次属性判断。开启后（ProfilerExtension：redis key 或 SIGUSR2，
+持续固定时长）：
+    1) @profiled 的函数记录调用次数、CPU 时间（本线程，time.thread_time）与墙钟时间；
+       生成器（spider 回调）按每次 next 累计；返回 Deferred 的函数只统计同步部分。
+    2) 采样线程每隔 sample_interval 秒记录所有线程的调用栈，
+       结束时写出 collapsed stacks（每行 "线程;栈帧;...;栈帧 次数"），可直接用 flamegraph.pl、speedscope 生成火焰图。
+结束时写出 <前缀>.json（各函数耗时，按 CPU 时间降序）与 <前缀>.collapsed。
+'''
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import threading
+import functools
+from collections import Counter
+
+
+class Profiler(object):
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.enabled = False
+        self.timings = {}           # {name: [调用次数, CPU 时间, 墙钟时间]}
+        self.stacks = Counter()     # {collapsed stack: 采样次数}
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def start(self, sample_interval=0.005):
+        '''开始记录（已在记录时忽略）'''
+        if self.enabled:
+            return False
+        self.timings = {}
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self.stopped_at = None
+        self.enabled = True
+        if sample_interval:
+            self._sampler = threading.Thread(
+                target=self._sample, args=(sample_interval,), name='ziroom-profiler', daemon=True)
+            self._sampler.start()
+        return True
+
+    def stop(self, output_dir):
+        '''停止记录，写出结果
+        @:return (json 路径, collapsed 路径)
+        '''
+        self.enabled = False
+        self.stopped_at = time.time()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        os.makedirs(output_dir, exist_ok=True)
+        prefix = os.path.join(output_dir, '{}-{}-{}'.format(
+            socket.gethostname(), os.getpid(), time.strftime('%Y%m%d_%H%M%S', time.localtime(self.started_at))))
+        report = self.report()
+        with open(prefix + '.json', 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        with open(prefix + '.collapsed', 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return prefix + '.json', prefix + '.collapsed'
+
+    def report(self):
+        seconds = (self.stopped_at or time.time()) - self.started_at
+        functions = [
+            {
+                'name': name,
+                'calls': calls,
+                'cpu_seconds': round(cpu, 4),
+                'wall_seconds': round(wall, 4),
+                'cpu_per_call_ms': round(cpu / calls * 1000, 4) if calls else None,
+                'cpu_share': round(cpu / seconds, 4) if seconds else None,
+            }
+            for name, (calls, cpu, wall) in self.timings.items()
+        ]
+        functions.sort(key=lambda x: x['cpu_seconds'], reverse=True)
+        return {
+            'started_at': int(self.started_at),
+            'seconds': round(seconds, 1),
+            'samples': self.samples,
+            'functions': functions,
+        }
+
+    def record(self, name, cpu, wall, calls=1):
+        with self._lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = [0, 0.0, 0.0]
+            timing[0] += calls
+            timing[1] += cpu
+            timing[2] += wall
+
+    def _sample(self, interval):
+        me = threading.get_ident()
+        names = {}
+        while self.enabled:
+            time.sleep(interval)
+            for ident in names.keys() - {t.ident for t in threading.enumerate()}:
+                names.pop(ident)
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    names[ident] = next(
+                        (t.name for t in threading.enumerate() if t.ident == ident), str(ident))
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names[ident])
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+profiler = Profiler()
+
+
+def profiled(name=None):
+    '''记录函数耗时（profiler 开启时），name 默认为 类名.函数名'''
+
+    def decorator(func):
+        label = name or func.__qualname__
+
+        def _generator(gen):
+            cpu, wall = 0.0, 0.0
+            try:
+                while True:
+                    cpu_start, wall_start = time.thread_time(), time.perf_counter()
+                    try:
+                        value = next(gen)
+                    finally:
+                        cpu += time.thread_time() - cpu_start
+                        wall += time.perf_counter() - wall_start
+                    yield value
+            except StopIteration:
+                return
+            finally:
+                profiler.record(label, cpu, wall)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            cpu_start, wall_start = time.thread_time(), time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                cpu, wall = time.thread_time() - cpu_start, time.perf_counter() - wall_start
+            if hasattr(result, '__next__') and hasattr(result, 'throw'):
+                # 生成器：调用本身几乎不耗时，按迭代累计
+                return _generator(result)
+            profiler.record(label, cpu, wall)
+            return result
+
+        return wrapper
+
+    return decorator
@@ -2,37 +2,125 @@
 
 代理策略
 --------------
-每个 request 都会在下载时（通过自定义的下载器）添加代理。
-发现 403、302 等状态码时，认定为代理失效，重发当前请求。
-下载失败时：检测代理，scrapy 自带 retrymiddleware 接手
+维护一个包含 N 个可用代理的代理池（PROXY_POOL_SIZE）：
+每个代理有独立的下载槽位（slot）与并发上限、滚动健康评分（成功率/延迟/被 ban 次数）、
+以及租期（lease）。每个 request 都会在下载时（通过自定义的下载器）分配评分最高且
+仍有空闲并发的代理。
+代理的获取与检测在线程池中进行，等待中的请求共享同一批 Deferred，不阻塞 reactor。
+租期临近结束时提前获取替补代理；发现 403、302 等状态码时，认定该代理已被 ban，
+仅将其移出代理池并重发当前请求，其余代理不受影响。
+后台 validator 定期并发检测代理池与候选代理（检测目标站点），提前移除失效代理；
+下载失败时：通知 validator 复检代理（不阻塞），scrapy 自带 retrymiddleware 接手
 
-使用redis统一调度多个spider的api请求：
+使用redis统一调度多个spider的api请求（lua 脚本保证原子性）：
 ------------------------------------------
-    proxy_api_locked - 是否锁定api请求（'1'：锁定/禁止请求）
-    last_request_time - 上次请求api时间
+    api_bucket - 令牌桶，每 api_request_interval 秒生成一个令牌
+    api_lease - api 租约（持有者标识 + 过期时间，持有者崩溃后自动失效）
+    published - 最近获取的代理，未获得租约的节点直接使用，不再各自请求 api
 '''
 
 from scrapy_redis import connection
 
+from twisted.internet import defer, task
+from twisted.internet.endpoints import TCP4ClientEndpoint
+from twisted.internet.threads import deferToThread
+from twisted.python.failure import Failure
+from twisted.web.client import ProxyAgent, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+
 from scrapy.exceptions import IgnoreRequest
 from scrapy.utils.project import get_project_settings
 
 import requests
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-# request库禁用安全请求警告
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)      
 
 from fake_useragent import UserAgent
 import json
 import time
+import uuid
 import logging
+from collections import deque
 
+from ziroom import metrics
+from ziroom.anomaly import anomaly_recorder
+from ziroom.profiling import profiled
 from ziroom.utils import mysleep
 
+
+class ProxyLease(object):
+    '''代理池中的一个代理：租期 + 滚动健康评分'''
+
+    ewma_alpha = 0.2    # 滚动评分平滑系数
+
+    def __init__(self, url, lease_seconds, concurrency):
+        self.url = url
+        self.create_time = time.time()
+        self.expire_time = self.create_time + lease_seconds
+        self.concurrency = concurrency  # 并发上限（下载槽位，AdaptiveConcurrencyExtension 动态调整）
+        self.inflight = 0           # 正在使用该代理的请求数
+        self.success_rate = 1.0     # 滚动成功率
+        self.latency = None         # 滚动下载延迟（秒）
+        self.bans = 0               # 被 ban 次数（302/403）
+
+    def remaining(self, now=None):
+        '''剩余租期（秒）'''
+        return self.expire_time - (now or time.time())
+
+    def score(self):
+        '''健康评分：成功率越高、延迟越低、被 ban 次数越少，评分越高'''
+        latency = self.latency if self.latency is not None else 1.0
+        return self.success_rate / (1.0 + latency) / (1 + self.bans)
+
+    def record(self, success, latency=None):
+        self.success_rate += self.ewma_alpha * ((1.0 if success else 0.0) - self.success_rate)
+        if latency is not None:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.ewma_alpha * (latency - self.latency)
+
+    def __repr__(self):
+        return f"<ProxyLease {self.url} score={self.score():.3f} inflight={self.inflight}/{self.concurrency} "\
+            f"remaining={int(self.remaining())}s>"
+
+
 class Proxy(object):
 
-    _REDIS_KEY_LOCKED = 'proxy:proxy_api_locked'    # redis key：代理API是否被锁定
-    _REDIS_KEY_TIME = 'proxy:last_request_time'     # redis key：代理API上次请求时间戳
+    _REDIS_KEY_BUCKET = 'proxy:api_bucket'          # redis key：代理API令牌桶
+    _REDIS_KEY_LEASE = 'proxy:api_lease'            # redis key：代理API租约（持有者标识，带过期时间）
+    _REDIS_KEY_PUBLISHED = 'proxy:published'        # redis key：最近获取的代理（供其他节点使用）
+
+    # 获取令牌与租约（原子操作）。
+    # 返回 0：成功；> 0：需等待的毫秒数（租约被其他节点持有，或令牌不足）
+    _LUA_ACQUIRE = '''
+    if redis.replicate_commands then redis.replicate_commands() end
+    local holder = redis.call('GET', KEYS[2])
+    if holder and holder ~= ARGV[1] then
+        return math.max(redis.call('PTTL', KEYS[2]), 1)
+    end
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+    local interval = tonumber(ARGV[2])
+    local capacity = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + (now - ts) / interval)
+    if tokens < 1 then
+        redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+        return math.max(math.ceil((1 - tokens) * interval), 1)
+    end
+    redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens - 1), 'ts', now)
+    redis.call('PEXPIRE', KEYS[1], interval * capacity * 2)
+    redis.call('SET', KEYS[2], ARGV[1], 'PX', ARGV[4])
+    return 0
+    '''
+    # 释放租约：仅持有者可释放
+    _LUA_RELEASE = '''
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    '''
 
     def __init__(self):
         project_settings = get_project_settings()
@@ -41,149 +129,401 @@ class Proxy(object):
         self.ua = UserAgent(path=project_settings['FAKE_JSON_PATH'])
         # 获取代理配置/状态值
         self.proxy = {
-            'url': None,            # 代理 url
-            'valid': None,          # 代理是否有效（None：未检测/未知，True：有效，False：无效）
             'used_proxy_num': 0,    # 已使用 xxx 个代理
             'api_url': project_settings.get('PROXY_API_URL', None),
                                         # 请求该地址，从代理池获取一个代理
-            'api_request_interval': 6,  # 两次请求 api 最短时间间隔         
-            'recheck_interval': 10,     # 抓取页面失败时：两次检测代理最小时间间隔
-            'rechecked': False,         # 抓取页面失败时：是否重新检测过代理
-            'last_check_time': 0,       # 上次检测代理时间
+            'api_request_interval': project_settings.getfloat('PROXY_API_INTERVAL', 6),
+                                        # 两次请求 api 最短时间间隔（令牌桶生成一个令牌的时间）
+            'api_burst': 1,             # 令牌桶容量
+            'api_timeout': 10,          # 请求 api 超时时间
+            'api_lease_seconds': 15,    # api 租约时长：持有者崩溃后，租约到期自动释放
+        }
+        # 代理池配置
+        self.pool_settings = {
+            'size': project_settings.getint('PROXY_POOL_SIZE', 4),
+                                        # 代理池中保持的代理数量
+            'lease_seconds': project_settings.getint('PROXY_LEASE_SECONDS', 180),
+                                        # 代理租期（有效时长）
+            'prefetch_seconds': project_settings.getint('PROXY_PREFETCH_SECONDS', 30),
+                                        # 剩余租期小于该值时，提前获取替补代理
+            'slot_concurrency': project_settings.getint('PROXY_SLOT_CONCURRENCY', 16),
+                                        # 每个代理（下载槽位）的并发上限
+            'slot_start_concurrency': project_settings.getint('PROXY_SLOT_CONCURRENCY', 16),
+                                        # 新代理的初始并发（AdaptiveConcurrencyExtension 按已学习到的可持续并发调整）
+            'maintain_interval': 5,     # 代理池维护（清理过期代理、补充代理）间隔
         }
         # 检测代理配置
         self.check_settings = {
-            'timeout': 5,                       # 超时时间
-            'max_elapsed_seconds': 10,          # 最大响应时间（响应时间大于该值，则判定代理失效）
-            'url': 'https://www.baidu.com/',    # 用于检测的 url    
+            'timeout': 5,                       # 超时时间（超时则判定检测失败）
+            'url': project_settings.get('PROXY_CHECK_URL', 'http://www.ziroom.com/robots.txt'),
+                                                # 用于检测的 url（目标站点的廉价页面，仅支持 http）
+            'interval': project_settings.getint('PROXY_CHECK_INTERVAL', 15),
+                                                # 后台检测代理池的间隔
+            'max_failures': 2,                  # 连续检测失败次数达到该值，判定代理失效
             'request_header': dict(project_settings.get('DEFAULT_REQUEST_HEADERS'))
                                                 # 请求header
         }
+        self.validator = ProxyValidator(self, self.check_settings)
+        self.pool = {}              # 代理池：{url: ProxyLease}
+        self._refreshing = False    # 是否正在（线程中）获取新代理
+        self._waiters = []          # 代理池为空时，等待"下一个代理"的 Deferred
+        self._maintain_loop = None
+        self._seen_published = set()    # 已使用过的、其他节点发布的代理
+        self._candidate_failures = 0    # 候选代理连续检测失效次数
+        self._acquire_api = self.server.register_script(self._LUA_ACQUIRE)
+        self._release_api = self.server.register_script(self._LUA_RELEASE)
+
+    @profiled()
+    def get_proxy_async(self):
+        '''异步获取一个可用代理，返回 Deferred（结果为代理 url，失败为 None）。
+        代理池中有可用代理时立即返回评分最高的代理；否则所有请求共享同一次获取：
+        只在线程池中运行一次 get_proxy()（请求 api + 检测），其余请求等待结果，
+        reactor 线程不会被阻塞。
+        调用方在请求结束后须调用 release(url)。
+        '''
+        self._start_maintain()
+        lease = self.best_lease()
+        if lease:
+            lease.inflight += 1
+            return defer.succeed(lease.url)
+        d = defer.Deferred()
+        self._waiters.append(d)
+        self._refill()
+        return d
+
+    def best_lease(self):
+        '''评分最高且仍有空闲并发的代理（都已满时，取评分最高的代理）'''
+        now = time.time()
+        leases = [x for x in self.pool.values() if x.remaining(now) > 0]
+        if not leases:
+            return None
+        return max(leases, key=lambda x: (x.inflight < x.concurrency, x.score()))
+
+    def release(self, url):
+        '''请求结束，释放代理的一个并发'''
+        lease = self.pool.get(url)
+        if lease and lease.inflight > 0:
+            lease.inflight -= 1
+
+    def report_success(self, url, latency=None):
+        lease = self.pool.get(url)
+        if lease:
+            lease.record(True, latency)
+
+    def report_failure(self, url, latency=None):
+        lease = self.pool.get(url)
+        if lease:
+            lease.record(False, latency)
+
+    def report_ban(self, url):
+        '''代理被 ban：移出代理池，并补充新代理'''
+        lease = self.pool.get(url)
+        if lease:
+            lease.bans += 1
+            self.remove(url, reason='被 ban')
+
+    def remove(self, url, reason=''):
+        lease = self.pool.pop(url, None)
+        if lease:
+            self.logger.warning(f"移除代理（{reason}）：{lease} - 代理池剩余：{len(self.pool)}")
+            self.validator.forget(url)
+            self._refill()
+
+    def _start_maintain(self):
+        if self._maintain_loop is None:
+            self._maintain_loop = task.LoopingCall(self._maintain)
+            self._maintain_loop.start(self.pool_settings['maintain_interval'], now=False)
+            self.validator.start()
+
+    def _maintain(self):
+        '''清理过期代理，租期临近结束时提前补充代理'''
+        now = time.time()
+        for url, lease in list(self.pool.items()):
+            if lease.remaining(now) <= 0:
+                self.remove(url, reason='租期结束')
+        self._refill()
+
+    def _pool_shortage(self):
+        '''代理池缺少的代理数（即将到期的代理不计入）'''
+        now = time.time()
+        fresh = [x for x in self.pool.values() \
+            if x.remaining(now) > self.pool_settings['prefetch_seconds']]
+        return self.pool_settings['size'] - len(fresh)
+
+    def _refill(self):
+        '''代理不足时，在线程池中获取一个新代理（同一时间只进行一次获取），
+        候选代理由 validator 异步检测通过后才加入代理池'''
+        if self._refreshing:
+            return
+        if self._waiters or self._pool_shortage() > 0:
+            self._refreshing = True
+            d = deferToThread(self.get_proxy)
+            d.addCallback(self._validate_candidate)
+            d.addBoth(self._on_new_proxy)
+
+    def _validate_candidate(self, proxy):
+        if not proxy:
+            return None
+        d = self.validator.check(proxy)
+        d.addCallback(self._candidate_checked, proxy)
+        return d
+
+    def _candidate_checked(self, valid, proxy):
+        if valid:
+            return proxy
+        self.validator.forget(proxy)
+        return False
+
+    def _on_new_proxy(self, result):
+        '''获取新代理结束：加入代理池，通知所有等待中的请求'''
+        self._refreshing = False
+        if isinstance(result, Failure):
+            self.logger.critical(f"更新代理：异常 - {result.getErrorMessage()}")
+            result = None
+        if result is False:
+            # 候选代理检测失效：继续获取（连续失效过多则放弃）
+            self._candidate_failures += 1
+            if self._candidate_failures <= 10:
+                self._refill()
+                return
+            self.logger.info(f"更新代理：失败（候选代理连续检测失效）")
+            result = None
+        self._candidate_failures = 0
+        if result:
+            self.pool[result] = ProxyLease(result, self.pool_settings['lease_seconds'],
+                self.pool_settings['slot_start_concurrency'])
+            self.logger.warning(f"更新代理：成功 - 加入 {result} - 当前 {len(self.pool)} 个")
+        waiters, self._waiters = self._waiters, []
+        for d in waiters:
+            lease = self.best_lease()
+            if lease:
+                lease.inflight += 1
+                d.callback(lease.url)
+            else:
+                d.callback(None)
+        if result:
+            self._refill()
 
+    @profiled()
     def get_proxy(self):
-        '''获取一个可用代理。
-        从redis中检查已保存的代理，失效或不存在则重新获取（获取新代理后会进行可用性检查）。
+        '''获取一个新代理（阻塞，在线程池中调用），不检测可用性。
+        @:return 代理 url，失败返回 None
         '''
-        if self.proxy['valid'] == True:
-            return self.proxy['url']
-        else:
-            cnt = 0
-            while self.proxy['valid'] != True:
-                res_fetch = self._fetch_new_proxy()    # 获取新代理
-                if res_fetch == -1:
-                    return None
-                elif res_fetch == 0:
-                    continue
-                elif res_fetch == 1:
-                    cnt += 1
-                    if cnt > 10:
-                        self.logger.info(f"更新代理：失败（检测代理时意外死循环）")
-                        return None
-                    # 检测代理可用性
-                    if self.check_proxy():
-                        self.logger.warning(f"更新代理：成功 - {self.proxy['url']}")
-                        return self.proxy['url']
+        while True:
+            res_fetch, proxy = self._fetch_new_proxy()    # 获取新代理
+            if res_fetch == -1:
+                return None
+            elif res_fetch == 1:
+                return proxy
 
     def _fetch_new_proxy(self):
         '''获取新代理（讯代理 ：http://www.xdaili.cn/）
         1) 不检测可用性
-        2) 获取成功后，自动设置：
-            self.proxy['url'] = 新代理
-            self.proxy['valid'] = None
-        @:return int 1：成功 0：失败（允许继续请求） -1:失败（不再继续请求）
+        2) 多节点通过 redis 令牌桶 + 租约统一调度 api 请求：
+            获得令牌与租约的节点请求 api，并将新代理发布到 redis；
+            未获得的节点直接使用已发布的代理，而非各自请求 api。
+        @:return (int, url) int - 1：成功 0：失败（允许继续请求） -1:失败（不再继续请求）
         '''
         rtn = -1
-        # 检测 api 请求是否锁定
-        proxy_api_locked = self.server.get(self._REDIS_KEY_LOCKED)
-        if proxy_api_locked and proxy_api_locked.decode() == '1':
-            self.logger.warning(f"proxy api 已锁定，sleep：{self.proxy['api_request_interval']} s")
-            time.sleep(self.proxy['api_request_interval'])
+        proxy = None
+        owner = uuid.uuid4().hex
+        wait_ms = self._acquire_api(
+            keys=[self._REDIS_KEY_BUCKET, self._REDIS_KEY_LEASE],
+            args=[
+                owner,
+                int(self.proxy['api_request_interval'] * 1000),
+                self.proxy['api_burst'],
+                self.proxy['api_lease_seconds'] * 1000,
+            ]
+        )
+        if wait_ms > 0:
+            # 未获得令牌/租约：优先使用其他节点刚获取的代理
+            proxy = self._take_published_proxy()
+            if proxy:
+                self.logger.warning(f"使用其他节点获取的代理：{proxy}")
+                return 1, proxy
+            sleep_seconds = min(wait_ms / 1000, self.proxy['api_request_interval'])
+            self.logger.warning(f"proxy api 令牌不足或已被其他节点占用，sleep：{sleep_seconds:.1f} s")
+            time.sleep(sleep_seconds)
+            return 0, None
+        # 请求 api
+        try:
+            start_time = time.time()
+            res = requests.get(self.proxy['api_url'], timeout=self.proxy['api_timeout'])
+            metrics.proxy_fetch_seconds.observe(time.time() - start_time)
+            res_info = json.loads(res.text)
+        except Exception as e:
+            self.logger.critical(f"获取新代理失败：请求出错。")
+            self.logger.critical(e)
             rtn = 0
         else:
-            self.server.set(self._REDIS_KEY_LOCKED, 1)
-            last_request_time = self.server.get(self._REDIS_KEY_TIME)
-            last_request_time = int(last_request_time.decode()) if last_request_time else 0
-            interval = int(time.time()) - last_request_time
-            if interval < self.proxy['api_request_interval']:
-                sleep_seconds = self.proxy['api_request_interval'] - interval
-                self.logger.warning(f"请求代理 API 间隔 < "\
-                    f"{self.proxy['api_request_interval']} s，sleep：{sleep_seconds} s")
-                time.sleep(sleep_seconds)
-            # 请求 api
-            self.server.set(self._REDIS_KEY_TIME, int(time.time()))
-            try:
-                res = requests.get(self.proxy['api_url'])
-                res_info = json.loads(res.text)
-            except Exception as e:
-                self.logger.critical(f"获取新代理失败：请求出错。")
-                self.logger.critical(e)
+            self.logger.debug(res_info)
+            if res.status_code == 200 and res_info['ERRORCODE'] == '0':
+                proxy = ''.join(['http://', res_info['RESULT'][0]['ip'], \
+                    ':', res_info['RESULT'][0]['port']])
+                self.proxy['used_proxy_num'] += 1
+                metrics.proxy_rotations.inc()
+                self._publish_proxy(proxy)
+                self.logger.warning(f"获取新代理成功")
+                self.logger.warning(f"proxy: {proxy}" \
+                    f" used_proxy_num: {self.proxy['used_proxy_num']}")
+                rtn = 1
+            elif res.status_code == 200 and res_info['ERRORCODE'] == '10001':
+                self.logger.warning(f"获取新代理失败：系统繁忙。")
                 rtn = 0
             else:
-                self.logger.debug(res_info)
-                if res.status_code == 200 and res_info['ERRORCODE'] == '0':
-                    proxy = ''.join(['http://', res_info['RESULT'][0]['ip'], \
-                        ':', res_info['RESULT'][0]['port']])
-                    self.proxy['valid'] = None
-                    self.proxy['url'] = proxy
-                    self.proxy['used_proxy_num'] += 1
-                    self.proxy['rechecked'] = False
-                    self.proxy['last_check_time'] = 0
-                    self.logger.warning(f"获取新代理成功")
-                    self.logger.warning(f"proxy: {self.proxy['url']}" \
-                        f" used_proxy_num: {self.proxy['used_proxy_num']}")
-                    rtn = 1
-                elif res.status_code == 200 and res_info['ERRORCODE'] == '10001':
-                    self.logger.warning(f"获取新代理失败：系统繁忙。")
-                    rtn = 0
-                else:
-                    self.logger.critical(f"获取新代理失败：其他原因。")
-                    self.logger.critical(res_info)
-                    rtn = -1
-            finally:
-                self.server.set(self._REDIS_KEY_LOCKED, '0')
-        return rtn
-
-    def check_proxy(self):
-        '''检测代理是否失效，并自动设置代理状态
-        @:return bool
+                self.logger.critical(f"获取新代理失败：其他原因。")
+                self.logger.critical(res_info)
+                rtn = -1
+        finally:
+            self._release_api(keys=[self._REDIS_KEY_LEASE], args=[owner])
+        return rtn, proxy
+
+    def _publish_proxy(self, proxy):
+        '''将新代理发布到 redis，供其他节点使用'''
+        self._seen_published.add(proxy)
+        self.server.set(
+            self._REDIS_KEY_PUBLISHED,
+            json.dumps({'url': proxy, 'time': int(time.time())}),
+            ex=max(self.pool_settings['lease_seconds'] - self.pool_settings['prefetch_seconds'], 1)
+        )
+
+    def _take_published_proxy(self):
+        '''取得其他节点发布的、本节点未使用过的代理'''
+        published = self.server.get(self._REDIS_KEY_PUBLISHED)
+        if not published:
+            return None
+        proxy = json.loads(published.decode())['url']
+        if proxy in self._seen_published or proxy in self.pool:
+            return None
+        self._seen_published.add(proxy)
+        return proxy
+
+
+class ProxyValidator(object):
+    '''后台代理检测
+    定期并发检测代理池中的代理，以及新获取的候选代理；检测地址为目标站点（ziroom）的
+    廉价页面，使用 twisted 连接池（非阻塞）。记录延迟分位数，在抓取请求失败前提前移除失效代理。
+    下载异常只需调用 report_error()，检测异步进行，不阻塞调用方。
+    '''
+
+    def __init__(self, proxy, check_settings):
+        self.proxy = proxy          # 代理池（Proxy）
+        self.check_settings = check_settings
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.http_pool = None       # 检测用连接池（所有代理共用）
+        self.agents = {}            # {url: ProxyAgent}
+        self.latencies = {}         # {url: deque([latency, ...])}
+        self.failures = {}          # {url: 连续检测失败次数}
+        self.checking = {}          # {url: Deferred} 检测中的代理
+        self._loop = None
+
+    def start(self):
+        if self._loop is None:
+            self._loop = task.LoopingCall(self.check_all)
+            self._loop.start(self.check_settings['interval'], now=False)
+
+    def check_all(self):
+        '''并发检测代理池中的所有代理'''
+        for url in list(self.proxy.pool):
+            self.check(url)
+        percentiles = self.latency_percentiles()
+        if percentiles:
+            self.logger.info(f"代理检测延迟：{percentiles}")
+
+    def report_error(self, url):
+        '''下载异常：尽快复检该代理（异步）'''
+        from twisted.internet import reactor
+        if url in self.proxy.pool and url not in self.checking:
+            reactor.callLater(0, self.check, url)
+
+    def check(self, url):
+        '''检测代理是否可用，返回 Deferred（结果为 bool）。
+        检测失败次数达到 max_failures、或被目标站点 ban（302/403）时，移出代理池。
         '''
-        proxy = self.proxy['url']
-        self.check_settings['request_header']['User-Agent'] = self.ua.random
-        try:
-            self.proxy['last_check_time'] = int(time.time())
-            r = requests.get(
-                url=self.check_settings['url'],
-                headers=self.check_settings['request_header'],
-                proxies={
-                    "https": proxy.replace('http://', ''), 
-                    'http': proxy.replace('http://', '')
-                },
-                timeout=self.check_settings['timeout'],
-                verify=False
-            )
-        except Exception as e:
-            self.proxy['valid'] = False
-            self.logger.warning(f"检测代理：失效（请求检测地址异常） - {proxy}")
-            self.logger.warning(e)
-            return False
+        from twisted.internet import reactor
+        if url in self.checking:
+            return self._chain(self.checking[url])
+        start_time = time.time()
+        headers = Headers({k: [v] for k, v in self.check_settings['request_header'].items()})
+        headers.setRawHeaders('User-Agent', [self.proxy.ua.random])
+        d = self._agent(url).request(b'GET', self.check_settings['url'].encode(), headers)
+        self.checking[url] = d
+        d.addCallback(self._read_response)
+        d.addTimeout(self.check_settings['timeout'], reactor)
+        d.addBoth(self._checked, url, start_time)
+        return self._chain(d)
+
+    def _chain(self, d):
+        '''同一代理的并发检测共享一次请求'''
+        result = defer.Deferred()
+
+        def _fire(valid):
+            result.callback(valid)
+            return valid
+        d.addBoth(_fire)
+        return result
+
+    def _agent(self, url):
+        from twisted.internet import reactor
+        if self.http_pool is None:
+            self.http_pool = HTTPConnectionPool(reactor, persistent=True)
+            self.http_pool.maxPersistentPerHost = 2
+        if url not in self.agents:
+            host, port = url.replace('http://', '').split(':')
+            endpoint = TCP4ClientEndpoint(reactor, host, int(port),
+                timeout=self.check_settings['timeout'])
+            self.agents[url] = ProxyAgent(endpoint, reactor=reactor, pool=self.http_pool)
+        return self.agents[url]
+
+    def _read_response(self, response):
+        d = readBody(response)
+        d.addCallback(lambda _: response.code)
+        return d
+
+    def _checked(self, result, url, start_time):
+        self.checking.pop(url, None)
+        elapsed = time.time() - start_time
+        if isinstance(result, Failure):
+            reason = f"请求检测地址异常：{result.getErrorMessage()}"
+            status = None
         else:
-            if r.status_code == 200:
-                if r.elapsed.seconds > self.check_settings['max_elapsed_seconds']:
-                    self.proxy['valid'] = False
-                    self.logger.warning(f"检测代理：失效（超时） - {proxy}")
-                    self.logger.warning(f"max_elapsed_seconds："\
-                        f"{self.check_settings['max_elapsed_seconds']} " \
-                            f"elapsed_seconds: {r.elapsed.seconds}")
-                    return False
-                else:
-                    self.proxy['valid'] = True
-                    self.logger.warning(f"检测代理：有效 ok - {proxy} - {r.elapsed.seconds}")
-                    return True
-            else:
-                self.proxy['valid'] = False
-                self.logger.warning(f"检测代理：失效（status_code != 200） - "\
-                    f"{r.status_code} - {proxy}")
-                return False
+            status = result
+            reason = f"status_code：{status}"
+        metrics.proxy_check_seconds.labels('ok' if status == 200 else 'failed').observe(elapsed)
+        if status == 200:
+            self.failures[url] = 0
+            self.latencies.setdefault(url, deque(maxlen=50)).append(elapsed)
+            self.logger.debug(f"检测代理：有效 ok - {url} - {elapsed:.2f}s")
+            return True
+        self.failures[url] = self.failures.get(url, 0) + 1
+        self.logger.warning(f"检测代理：失败 - {url} - {reason}（连续 {self.failures[url]} 次）")
+        if status in (302, 403):
+            self.proxy.report_ban(url)
+            self.forget(url)
+        elif self.failures[url] >= self.check_settings['max_failures']:
+            self.proxy.remove(url, reason='检测失效')
+            self.forget(url)
+        return False
+
+    def forget(self, url):
+        '''代理已移出代理池：清理检测状态'''
+        self.agents.pop(url, None)
+        self.failures.pop(url, None)
+        self.latencies.pop(url, None)
+
+    def latency_percentiles(self, url=None):
+        '''检测延迟分位数（秒）：{'p50': x, 'p90': x, 'p99': x}'''
+        if url:
+            samples = sorted(self.latencies.get(url, ()))
+        else:
+            samples = sorted(x for v in self.latencies.values() for x in v)
+        if not samples:
+            return {}
+        return {
+            f"p{p}": round(samples[min(len(samples) - 1, int(len(samples) * p / 100))], 3)
+            for p in (50, 90, 99)
+        }
 
 proxy_ins = Proxy()
 
@@ -195,45 +535,35 @@ class ProxyDM(object):
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
 
     def process_response(self, request, response, spider):
+        proxy = request.meta.get('proxy')
+        latency = request.meta.get('download_latency')
         if response.status != 200:
-            self.logger.warning(f"发现 {response.status} 页面")
-            self.logger.warning(f"proxy：{request.meta['proxy']}")
-            self.logger.warning(f"request.url：{request.url}")
+            # 日志限流，页面内容抽样保存（scrapy anomalies 查看）
             if response.status in (302, 403):
-                self.logger.warning(f"{response.status} 页面认定为现ip已被ban，重发请求")
-                if proxy_ins.proxy['url'] == request.meta['proxy']:
-                    proxy_ins.proxy['valid'] = False
+                anomaly_recorder.record(f"status_{response.status}",
+                    f"发现 {response.status} 页面，认定为现ip已被ban，重发请求：{request.url} - proxy：{proxy}",
+                    response=response, request=request, logger=self.logger)
+                proxy_ins.report_ban(proxy)
                 new_request = request.copy()
                 new_request.dont_filter = True
                 return new_request
-            elif response.status in (503, 510, 478):
-                self.logger.warning(f"response.body：{response.body.decode()}")
-                #mysleep(3, interval=10)
-                pass
+            anomaly_recorder.record(f"status_{response.status}",
+                f"发现 {response.status} 页面：{request.url} - proxy：{proxy}",
+                response=response, request=request, logger=self.logger)
+            if response.status in (503, 510, 478):
+                proxy_ins.report_failure(proxy, latency)
+        else:
+            proxy_ins.report_success(proxy, latency)
         return response
 
     def process_exception(self, request, exception, spider):
         if not isinstance(exception, IgnoreRequest):
-            # 记录异常
-            self.logger.warning(f"---------- download 异常 -----------")
-            self.logger.warning(f"type(exception)：{type(exception)}")
-            self.logger.warning(f"str(exception)：{str(exception)}")
-            self.logger.warning(f"request.url：{request.url}")
-            self.logger.warning(f"请求代理：{request.meta['proxy']}")
-            self.logger.warning(f"当前代理：{proxy_ins.proxy}")
-            # 检测代理
-            if proxy_ins.proxy['url'] == request.meta['proxy'] and \
-                proxy_ins.proxy['valid'] == True:
-                if not proxy_ins.proxy['rechecked']:
-                    self.logger.warning(f"下载异常：首次复检代理")
-                    proxy_ins.check_proxy()
-                    proxy_ins.proxy['rechecked'] = True
-                else:
-                    if int(time.time()) - proxy_ins.proxy['last_check_time'] > \
-                        proxy_ins.proxy['recheck_interval']:
-                        self.logger.warning(f"下载异常：再次复检代理")
-                        proxy_ins.check_proxy()
-                    else:
-                        self.logger.warning(f"下载异常：复检代理时间未到")
-
-
+            proxy = request.meta.get('proxy')
+            # 记录异常（日志限流）
+            anomaly_recorder.record(f"exception_{type(exception).__name__}",
+                f"download 异常：{type(exception).__name__}：{exception} - {request.url}"
+                f" - 代理：{proxy_ins.pool.get(proxy) or proxy}",
+                request=request, logger=self.logger)
+            # 交由后台检测（不阻塞）
+            proxy_ins.report_failure(proxy)
+            proxy_ins.validator.report_error(proxy)
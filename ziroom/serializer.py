@@ -0,0 +1,137 @@
+'''调度队列请求序列化（SCHEDULER_SERIALIZER）
+
+scrapy-redis 默认用 pickle 序列化 request.to_dict()，每个请求都带有字段名、类名。
+这里使用 msgpack，按固定顺序编码为数组，字段名不写入队列：
+    请求        - [版本, url, callback, method, headers, body, cookies, meta, encoding, priority,
+                   dont_filter, errback, flags, cb_kwargs, _class]
+                  meta 的常用 key、回调名编码为 INTERNED 中的序号
+    RoomRecord  - 扩展类型 1：RoomRecord.__slots__ 顺序的字段值数组
+    房间引用    - 扩展类型 2：room_id，房间数据已移出队列（存入 redis hash，见 ziroom.squeue）
+    其他对象    - 扩展类型 3：pickle
+修改 INTERNED、字段顺序时需增加 VERSION；切换序列化方式前应清空调度队列。
+'''
+
+import pickle
+
+import msgpack
+
+from ziroom.items import RoomRecord
+
+VERSION = 1
+
+FIELDS = (
+    'url', 'callback', 'method', 'headers', 'body', 'cookies', 'meta', 'encoding', 'priority',
+    'dont_filter', 'errback', 'flags', 'cb_kwargs', '_class',
+)
+
+# 编码为序号的字符串：meta 的 key、回调名（只能在末尾追加）
+INTERNED = (
+    'item', 'rooms', 'referer', 'room_id', 'fingerprint', 'resblock_id', 'house_id',
+    'depth', 'retry_times', 'proxy', 'download_slot', 'download_timeout', 'download_latency',
+    'parse', 'parse_list', 'parse_price_sprite', 'price_sprite_failed', 'parse_detail',
+    'parse_keeper', 'parse_payment_air', 'parse_allocation', 'subresource_failed',
+)
+_INTERN_INDEX = {s: i for i, s in enumerate(INTERNED)}
+
+EXT_RECORD = 1
+EXT_ROOM_REF = 2
+EXT_PICKLE = 3
+
+
+class RoomRef(object):
+    '''已移出队列的房间（解码后由 resolve 替换为 RoomRecord）'''
+
+    __slots__ = ('room_id',)
+
+    def __init__(self, room_id):
+        self.room_id = room_id
+
+
+def _intern(value):
+    return _INTERN_INDEX.get(value, value) if isinstance(value, str) else value
+
+
+def _extern(value):
+    return INTERNED[value] if isinstance(value, int) else value
+
+
+def dumps(obj, offload=None):
+    '''@:param obj request.to_dict()
+    @:param offload 传入时，有 room_id 的 RoomRecord 交给 offload(record) 保存，队列中只保存 room_id
+    '''
+
+    def default(value):
+        if isinstance(value, RoomRecord):
+            if offload is not None and value.room_id is not None:
+                offload(value)
+                return msgpack.ExtType(EXT_ROOM_REF, msgpack.packb(value.room_id))
+            return msgpack.ExtType(EXT_RECORD, _packb(value.__getstate__()))
+        return msgpack.ExtType(EXT_PICKLE, pickle.dumps(value, protocol=-1))
+
+    def _packb(value):
+        return msgpack.packb(value, default=default, use_bin_type=True)
+
+    obj = dict(obj)
+    obj['callback'] = _intern(obj.get('callback'))
+    obj['errback'] = _intern(obj.get('errback'))
+    obj['meta'] = {_intern(k): v for k, v in (obj.get('meta') or {}).items()}
+    return _packb([VERSION] + [obj.get(field) for field in FIELDS])
+
+
+def loads(data, refs=None):
+    '''@:param refs 传入时，房间引用解码为 RoomRef 并加入 refs，否则不支持房间引用
+    @:return request.to_dict() 格式的 dict
+    '''
+
+    def ext_hook(code, data):
+        if code == EXT_RECORD:
+            record = RoomRecord.__new__(RoomRecord)
+            record.__setstate__(_unpackb(data))
+            return record
+        if code == EXT_ROOM_REF and refs is not None:
+            ref = RoomRef(msgpack.unpackb(data))
+            refs.append(ref)
+            return ref
+        if code == EXT_PICKLE:
+            return pickle.loads(data)
+        raise ValueError(f"unknown ext type: {code}")
+
+    def _unpackb(value):
+        return msgpack.unpackb(value, ext_hook=ext_hook, raw=False, strict_map_key=False)
+
+    values = _unpackb(data)
+    if values[0] != VERSION:
+        raise ValueError(f"unsupported serializer version: {values[0]}")
+    obj = dict(zip(FIELDS, values[1:]))
+    if obj['_class'] is None:
+        del obj['_class']
+    obj['callback'] = _extern(obj['callback'])
+    obj['errback'] = _extern(obj['errback'])
+    obj['meta'] = {_extern(k): v for k, v in obj['meta'].items()}
+    return obj
+
+
+def resolve(value, records):
+    '''将 value（meta）中的 RoomRef 替换为 records[room_id]'''
+    if isinstance(value, RoomRef):
+        return records[value.room_id]
+    if isinstance(value, dict):
+        return {k: resolve(v, records) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve(v, records) for v in value]
+    return value
+
+
+def record_to_hash(record):
+    '''RoomRecord -> redis hash 字段（record：__slots__ 顺序的字段值数组）'''
+    return {'record': msgpack.packb(record.__getstate__(), use_bin_type=True)}
+
+
+def record_from_hash(mapping):
+    '''redis hash -> RoomRecord，没有 record 字段时为 None'''
+    data = mapping.get(b'record', mapping.get('record'))
+    if data is None:
+        return None
+    record = RoomRecord.__new__(RoomRecord)
+    record.__setstate__(msgpack.unpackb(data, raw=False))
+    return record
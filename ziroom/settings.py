@@ -2,6 +2,7 @@ BOT_NAME = 'ziroom'
 
 SPIDER_MODULES = ['ziroom.spiders']
 NEWSPIDER_MODULE = 'ziroom.spiders'
+COMMANDS_MODULE = 'ziroom.commands'
 
 
 # Obey robots.txt rules
@@ -17,20 +18,93 @@ DEFAULT_REQUEST_HEADERS = {
 DOWNLOADER_MIDDLEWARES = {
     'ziroom.middlewares.RandomUserAgentDM': 450,
     'ziroom.proxy.ProxyDM': 755,
+    'ziroom.middlewares.FixtureRecorderDM': 750,    # 记录响应（FIXTURES_DIR 非空时启用）
+}
+
+SPIDER_MIDDLEWARES = {
+    'ziroom.middlewares.BatchDupeFilterSM': 10,     # 最后处理回调产出（之后直接进入调度器）
 }
 
 EXTENSIONS = {
     'ziroom.extensions.CloseSpiderExtension': 300,
+    'ziroom.extensions.StatsFileExtension': 310,    # STATS_FILE 非空时启用
+    'ziroom.extensions.MetricsExtension': 320,      # Prometheus 指标（需安装 prometheus_client）
+    'ziroom.extensions.ProfilerExtension': 330,     # 运行时性能分析（redis key 或 SIGUSR2 开启）
+    'ziroom.extensions.AdaptiveConcurrencyExtension': 340,  # 按代理自适应调整并发、延迟
+    'ziroom.extensions.FrontierExtension': 350,     # 调度队列低于水位线时放入延后的列表页
+}
+# 抓取前沿（ziroom.frontier）：列表页分页是否延后（写入 redis 列表 FRONTIER_KEY）、检查间隔（秒）、
+# 调度队列水位线（请求数，低于时放入列表页）、每次放入的列表页数
+FRONTIER_ENABLED = True
+FRONTIER_KEY = '%(spider)s:frontier'
+FRONTIER_INTERVAL = 1
+FRONTIER_LOW_WATERMARK = 2000
+FRONTIER_BATCH = 5
+# 请求优先级（数值大的先抓取），优先完成已发现的房间：管家、支付详情、房屋配置 > 价格图片 > 详情页 > 列表页
+REQUEST_PRIORITIES = {
+    'subresource': 30,
+    'sprite': 20,
+    'detail': 10,
+    'list': 0,
 }
+# 按代理自适应调整并发、延迟（AIMD）：调整周期（秒）、每周期最少响应数、限流状态码、限流比例阈值、
+# 目标下载延迟（秒）、限流时并发乘数、最小并发、新代理初始并发、延迟增加步长（秒）、最大延迟（秒）
+# 并发上限为 PROXY_SLOT_CONCURRENCY
+ADAPTIVE_CONCURRENCY_ENABLED = True
+ADAPTIVE_INTERVAL = 5
+ADAPTIVE_MIN_SAMPLES = 5
+ADAPTIVE_THROTTLE_CODES = [478, 510, 503]
+ADAPTIVE_ERROR_RATE = 0.05
+ADAPTIVE_TARGET_LATENCY = 3
+ADAPTIVE_DECREASE_FACTOR = 0.5
+ADAPTIVE_MIN_CONCURRENCY = 1
+ADAPTIVE_START_CONCURRENCY = 4
+ADAPTIVE_DELAY_STEP = 0.25
+ADAPTIVE_MAX_DELAY = 5
+# 运行时性能分析：是否允许开启、触发的 redis key（值为持续秒数）、检查间隔、SIGUSR2 开启时的持续秒数、
+# 调用栈采样间隔（秒，0 为不采样）、结果目录
+PROFILE_ENABLED = True
+PROFILE_REDIS_KEY = 'ziroom:profile'
+PROFILE_POLL_INTERVAL = 5
+PROFILE_SECONDS = 60
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_DIR = 'profiles'
+# Prometheus 指标：是否启用、监听地址、端口范围（使用范围内第一个可用端口）
+METRICS_ENABLED = True
+METRICS_HOST = '0.0.0.0'
+METRICS_PORT = [9410, 9450]
+# 集群 stats：各节点定期将 stats 写入 redis（scrapy clusterstats 汇总）
+STATS_CLASS = 'ziroom.statscollectors.RedisStatsCollector'
+STATS_REDIS_KEY = '%(spider)s:stats'
+STATS_PUSH_INTERVAL = 10    # 写入间隔（秒）
+STATS_FINISHED_TTL = 86400  # 结束的节点保留时长（秒）
+# 异常页面抽样记录（ziroom.anomaly，scrapy anomalies 查看）：
+# 保存位置（redis / disk）、redis key、目录、环形缓冲区容量（样本数）、每个样本 body 最大字节数、
+# 每个时间窗口每种异常全部保存的前 n 个、之后的保存概率、每种异常输出日志的条数、时间窗口（秒）
+ANOMALY_STORE = 'redis'
+ANOMALY_REDIS_KEY = 'ziroom:anomalies'
+ANOMALY_DIR = 'anomalies'
+ANOMALY_CAPACITY = 200
+ANOMALY_MAX_BODY = 65536
+ANOMALY_SAMPLE_BURST = 3
+ANOMALY_SAMPLE_RATE = 0.01
+ANOMALY_LOG_BURST = 3
+ANOMALY_WINDOW = 60
+# 关闭 spider 时写入 stats（json）的文件路径，为空时不写入
+STATS_FILE = ''
 # 超过 xxx 个空闲时间单位时，关闭spider
 IDLE_NUMBER = 30    
 
 DOWNLOADER = 'ziroom.mydownloader.MyDownloader'
 
-# 下载文件(FilesPipeline、ImagesPipeline)
+# 下载文件(FilesPipeline、ImagesPipeline)，价格图片的保存方式见 OCR_PERSIST_SPRITES
 FILES_EXPIRES = 1000
 FILES_STORE = 'your folder path'
 
+# 记录响应作为离线评测语料（scrapy parsebench）：保存目录（为空时不记录）、每种回调最多记录的响应数
+FIXTURES_DIR = ''
+FIXTURES_MAX_PER_CALLBACK = 200
+
 
 # ------------------------- scrapy 无关 -------------------------
 
@@ -38,8 +112,37 @@ FILES_STORE = 'your folder path'
 # 配置值为安装 pytesseract 后，tessdata 文件夹的路径
 TESSDATA_DIR = 'your folder path'
 
+# 价格图片数字模板（numpy .npz，可由 `scrapy ocrbench --train` 生成；不存在时运行中由 tesseract 结果学习）
+# 运行中学习的模板保存到该文件（识别进程池的子进程由此加载、主进程学习子进程返回的样本后保存）
+OCR_TEMPLATES_PATH = 'your file path'
+# 运行中每学习多少个样本（一张图片为一个样本）保存一次模板，爬虫关闭时也会保存
+OCR_TEMPLATES_SAVE_EVERY = 20
+# 模板匹配置信度低于该值时，回退 tesseract
+OCR_MIN_CONFIDENCE = 0.85
+# 识别结果缓存：进程内缓存条数、redis 共享缓存过期时间（秒）
+OCR_CACHE_SIZE = 1024
+OCR_CACHE_TTL = 86400
+# 识别进程池：进程数（0：cpu 核数）、最多提交到进程池的任务数（进行中与进程池中排队的，超出时管道在进程外等待）
+OCR_WORKERS = 0
+OCR_MAX_PENDING = 64
+# 价格图片直接在内存中识别，是否保存到 FILES_STORE：always - 全部保存；failed - 仅识别失败时保存；never - 不保存
+OCR_PERSIST_SPRITES = 'failed'
+
 MONGO_URI = 'your mogno uri'    # 格式：mongodb://localhost:27017
 MONGO_POOL_SIZE = 100
+# mongo 批量写入：每批最大操作数、定时提交间隔（秒）
+MONGO_BULK_SIZE = 200
+MONGO_BULK_INTERVAL = 2
+# 同一房间的 item 片段合并后再写入：最长等待时间（秒）、最多待合并房间数
+ROOM_COALESCE_TTL = 300
+ROOM_COALESCE_MAX = 5000
+# 增量抓取：列表页信息（价格、标签、风格、缩略图）未变化的房间只更新 uptime，不请求详情页；
+# 距上次完整抓取超过 INCREMENTAL_MAX_AGE 秒的房间仍完整抓取
+INCREMENTAL_ENABLED = True
+INCREMENTAL_MAX_AGE = 259200
+# 管家信息（按小区）、房屋配置（按房屋）在 redis 中的缓存时间（秒），0 表示不缓存
+STEWARD_CACHE_TTL = 86400
+CONFIG_CACHE_TTL = 86400
 MONGO_DATABASE = 'your mongo database'     
 MONGO_COLLECTION = 'your mongo collection'
 # mongo权限验证（不需要密码登录可留空）： 
@@ -49,8 +152,17 @@ MONGO_PASSWORD = 'your mongo passwd'
 # fake_user_agent 本地数据文件地址
 FAKE_JSON_PATH = 'your file path'
 
-# 代理获取地址
+# 代理获取地址、两次请求 api 的最短间隔（秒，所有节点共享）
 PROXY_API_URL = 'your proxy_api_url'
+PROXY_API_INTERVAL = 6
+# 代理池：保持的代理数量、代理租期（秒）、提前获取替补代理的剩余租期（秒）、每个代理的并发上限
+PROXY_POOL_SIZE = 4
+PROXY_LEASE_SECONDS = 180
+PROXY_PREFETCH_SECONDS = 30
+PROXY_SLOT_CONCURRENCY = 16
+# 后台检测代理：检测地址（目标站点的廉价页面，仅支持 http）、检测间隔（秒）
+PROXY_CHECK_URL = 'http://www.ziroom.com/robots.txt'
+PROXY_CHECK_INTERVAL = 15
 
 
 # ------------------------- scrapy-redis -------------------------
@@ -59,7 +171,16 @@ PROXY_API_URL = 'your proxy_api_url'
 SCHEDULER = "scrapy_redis.scheduler.Scheduler"
 
 # Ensure all spiders share same duplicates filter through redis.
-DUPEFILTER_CLASS = "scrapy_redis.dupefilter.RFPDupeFilter"
+# DUPEFILTER_CLASS = "scrapy_redis.dupefilter.RFPDupeFilter"
+# 布隆过滤器去重（ziroom.dupefilter）：第一个过滤器的容量（指纹数）、总误判率、
+# 满时新建过滤器的容量增长倍数、误判率收紧比例；不迁移原 RFPDupeFilter 的集合（<spider>:dupefilter，可删除）
+DUPEFILTER_CLASS = 'ziroom.dupefilter.BloomDupeFilter'
+BLOOM_CAPACITY = 1000000
+BLOOM_ERROR_RATE = 0.001
+BLOOM_GROWTH = 2
+BLOOM_TIGHTENING = 0.5
+# 回调产出的请求批量去重（BatchDupeFilterSM，去重器支持 requests_seen 时）
+DUPEFILTER_BATCH_ENABLED = True
 
 # Default requests serializer is pickle, but it can be changed to any module
 # with loads and dumps functions. Note that pickle is not compatible between
@@ -69,14 +190,19 @@ DUPEFILTER_CLASS = "scrapy_redis.dupefilter.RFPDupeFilter"
 # work by default. In python 2.x there is no such issue and you can use
 # 'json' or 'msgpack' as serializers.
 # SCHEDULER_SERIALIZER = "scrapy_redis.picklecompat"
+# msgpack 按固定字段顺序编码请求（ziroom.serializer），切换前应清空调度队列
+SCHEDULER_SERIALIZER = 'ziroom.serializer'
 
 # Don't cleanup redis queues, allows to pause/resume crawls.
 SCHEDULER_PERSIST = True
 
 # Schedule requests using a priority queue. (default)
-# 优先级队列 - 深度优先
-SCHEDULER_QUEUE_CLASS = 'scrapy_redis.queue.PriorityQueue'
-DEPTH_PRIORITY = -1     
+# 优先级队列 - 按请求种类（REQUEST_PRIORITIES），不按深度调整
+# ziroom.squeue.PriorityQueue：请求携带的房间数据存入 redis hash（key、过期时间），队列中只保存 room_id
+SCHEDULER_QUEUE_CLASS = 'ziroom.squeue.PriorityQueue'
+SCHEDULER_PAYLOAD_KEY = '%(spider)s:room:%(room_id)s'
+SCHEDULER_PAYLOAD_TTL = 86400
+DEPTH_PRIORITY = 0
 
 # Alternative queues.
 # 先进先出队列（广度优先）
@@ -1,18 +1,37 @@
 import scrapy
 from scrapy_redis.spiders import RedisSpider
 from scrapy.exceptions import CloseSpider
+from twisted.internet.defer import inlineCallbacks, returnValue
 
-import copy
 import json
 import time
+import logging
 from urllib.parse import urlparse
 
-from ziroom.items import ZiroomItem
+from ziroom.anomaly import anomaly_recorder
+from ziroom.cache import SubResourceCache
+from ziroom.incremental import RoomIndex
+from ziroom.frontier import Frontier, request_priorities
+from ziroom.extract import parse_html, extract_list, detail_ids, extract_detail
+from ziroom.items import ZiroomItem, RoomRecord, RoomPartMissing
+from ziroom.profiling import profiled
+from ziroom.ocr import ocr_service
+from ziroom.utils import combine_price
 
 
 class ZiroomSpider(RedisSpider):
 
     name = 'ziroom'
+    # 子资源回调 -> 房间片段（RoomCoalescer）
+    subresource_parts = {
+        'parse_keeper': 'keeper',
+        'parse_payment_air': 'payment_air',
+        'parse_allocation': 'allocation',
+    }
+    _room_index = None
+    _subresource_cache = None
+    _frontier = None
+    _priorities = None
     custom_settings = {
         'LOG_LEVEL': 'INFO',
         'COOKIES_ENABLED': False,
@@ -34,6 +53,7 @@ class ZiroomSpider(RedisSpider):
         }
     }
 
+    @profiled()
     def parse(self, response):
         ''''起始页'''
         url_parsed = urlparse(response.url)
@@ -43,27 +63,24 @@ class ZiroomSpider(RedisSpider):
             self.log_200_abnormal(response, close=True)
             return
         for url in urls_sel:
-            yield scrapy.Request(url_parsed.scheme + ':' + url, callback=self.parse_list)
+            yield self.list_request(url_parsed.scheme + ':' + url)
 
+    @profiled()
     def parse_list(self, response):
         '''列表页
         例：http://sh.ziroom.com/z/nl/z3-d310104-b611900103.html
         '''
-        self.logger.info(f"crawled 列表页：{response.url}")
+        self.logger.debug(f"crawled 列表页：{response.url}")
+        url_parsed = urlparse(response.url)
+        page = extract_list(parse_html(response), url_parsed.scheme)
         # 价格信息
         # 在列表页而非详情页匹配价格信息，尽量减少请求价格图片时的 request 数量
-        price_png_url = response.xpath('//script[contains(text(), \
-            "offset_unit")]').re_first(r'image":"//(.+)",')
-        price_positions_str = response.xpath('//script[contains(text(), \
-            "offset_unit")]').re_first(r'"offset":\[(.+)\]\};')
-        if price_png_url and price_positions_str:
-            price_png_url = urlparse(response.url).scheme + '://' + price_png_url
-            price_positions = list(map(
-                lambda x: list(map(int, x.split(','))), 
-                price_positions_str.strip('[').strip(']').split('],[')
-            ))
+        price_png_url = page['price_png_url']
+        price_positions = page['price_positions']
+        if price_png_url and price_positions:
+            price_png_url = url_parsed.scheme + '://' + price_png_url
         else:
-            if response.body.decode().find('我们找不到任何与您的搜索条件匹配的结果') == -1:
+            if response.text.find('我们找不到任何与您的搜索条件匹配的结果') == -1:
                 self.log_200_abnormal(
                     response, position='抓取：列表页', 
                     statement='未匹配到价格图片url、价格位置字符串', 
@@ -72,71 +89,113 @@ class ZiroomSpider(RedisSpider):
             return
 
         # 提取部分信息（部分信息只能在列表页提取到）
-        sel_info = response.xpath('//ul[@id="houseList"]/li')
-        city = response.xpath('//span[@id="curCityName"]/text()').extract_first()
-        url_parsed = urlparse(response.url)
-        for k, v in enumerate(sel_info):
-            item = ZiroomItem()
-            item['city'] = city
-            item['price'] = {
-                'num': None,
-                'payment': v.xpath('div[@class="priceDetail"]/p[@class="price"]\
-                    /span[@class="gray-6"]/text()').re_first(r'\((.+)\)'),
-                'path': None,
-                'origin_src': price_png_url,
-                'position': price_positions[k],
-                'referer':copy.copy(response.url)
-            }
-            item['title_thumb'] = {
-                'path': None,
-                'referer': copy.copy(response.url),
-                'origin_src': urlparse(response.url).scheme + '://' + \
-                    v.xpath('div[@class="img pr"]/a/img/@_src').re_first(r'^//(.+)')
-            }
-            item['room_id'] = int(v.xpath('div[@class="txt"]/h3/a/@href')\
-                .re_first(r'/(\d+)\.html'))
-            item['product'] = v.xpath('div[@class="txt"]/h3/a/text()')\
-                .re_first(r'(\S+) · .+')
-            item['room_name'] = v.xpath('div[@class="txt"]/h3/a/text()')\
-                .re_first(r'\S+ · (.+)')
-            item['room_style'] = v.xpath('div[@class="txt"]/p[@class="room_tags \
-                clearfix"]//span[@class="style"]/text()').extract_first()
-            item['is_first_rent'] = v.xpath('div[@class="txt"]/h4/span\
-                [@class="green"][contains(text(), "首次出租")]/text()').re_first(r'\S+')
-            item['is_near_subway'] = v.xpath('div[@class="txt"]/p[@class="room_tags \
-                clearfix"]//span[text()="离地铁近"]/text()').extract_first()
-            item['is_private_bathroom'] = v.xpath('div[@class="txt"]/\
-                p[@class="room_tags clearfix"]//span[text()="独卫"]/text()').extract_first()
-            item['is_private_balcony'] = v.xpath('div[@class="txt"]/\
-                p[@class="room_tags clearfix"]//span[text()="独立阳台"]/text()').extract_first()
-            item['heating'] = v.xpath('div[@class="txt"]/p[@class=\
-                "room_tags clearfix"]//span[text()="集体供暖" \
-                or text()="独立供暖" or text()="中央空调"]/text()').extract_first()
-            url = v.xpath('div[@class="txt"]/h3/a/@href').re_first(r'//(.+html)')
+        rooms = []
+        for k, room in enumerate(page['rooms']):
+            record = RoomRecord(
+                city=page['city'],
+                price_payment=room['payment'],
+                price_position=price_positions[k],
+                price_src=price_png_url,
+                thumb_src=room['thumb_src'],
+                referer=response.url,
+                **{field: room[field] for field in RoomRecord.item_fields if field in room}
+            )
+            rooms.append((record, room['url']))
+
+        # 整页共用一张价格图片：下载、识别一次，再为每个房间组合价格并请求详情页
+        if rooms:
             yield scrapy.Request(
-                url_parsed.scheme + '://' + url, 
-                meta={'item': item}, 
-                callback=self.parse_detail
+                price_png_url,
+                headers={'referer': response.url},
+                meta={'rooms': rooms},
+                callback=self.parse_price_sprite,
+                errback=self.price_sprite_failed,
+                dont_filter=True,
+                priority=self.priorities['sprite'],
             )
 
         # 每一页：page > 1
         if response.url.find('?p=') < 0:
-            total_page = response.xpath('//div[@id="page"]/span[contains(text(), \
-                "共")]/text()').re_first(r'共(\d+)页')
+            total_page = page['total_page']
             if total_page:
+                pages = []
                 for v in range(2, int(total_page) + 1):
                     # 为每个请求伪造更合理的 referer，而非都以本次请求地址为 referer
                     url = response.url + '?p=' + str(v)
                     if v == 2:
-                        referer = copy.copy(response.url)
+                        referer = response.url
                     else:
-                        referer = copy.copy(response.url) + '?p=' + str(v-1)
-                    yield scrapy.Request(
-                        url, 
-                        meta={'referer': referer}, 
-                        callback=self.parse_list
-                    )
+                        referer = response.url + '?p=' + str(v-1)
+                    pages.append((url, referer))
+                if self.settings.getbool('FRONTIER_ENABLED'):
+                    # 延后：调度队列低于水位线时由 FrontierExtension 放入
+                    self.frontier.push(pages)
+                    self.crawler.stats.inc_value('frontier/deferred', len(pages))
+                else:
+                    for url, referer in pages:
+                        yield self.list_request(url, referer)
+
+    def list_request(self, url, referer=None):
+        '''列表页请求（优先级最低）'''
+        meta = {'referer': referer} if referer else {}
+        return scrapy.Request(url, meta=meta, callback=self.parse_list, priority=self.priorities['list'])
 
+    @profiled()
+    @inlineCallbacks
+    def parse_price_sprite(self, response):
+        '''列表页价格图片：整页识别一次（识别进程池，不占用 reactor 线程），得到每个房间的价格后再请求详情页。
+        识别失败时交由 Price 管道逐个识别。
+        返回 Deferred，识别完成后结果为 item、详情页请求的列表。
+        '''
+        items, rooms, fingerprints = self._filter_unchanged(response.meta['rooms'])
+        if rooms:
+            img_str = yield ocr_service.recognize(response.body)
+            if img_str and len(img_str) == 10:
+                for record, url in rooms:
+                    record.price_num = combine_price(img_str, record.price_position)
+            else:
+                self.logger.warning(f"列表页价格图片识别失败，交由 Price 管道识别：{response.url}")
+                self.crawler.stats.inc_value('ocr/sprite_fallback')
+        returnValue(items + list(self._detail_requests(rooms, fingerprints)))
+
+    def _filter_unchanged(self, rooms):
+        '''增量抓取：列表页信息未变化、且上次完整抓取未过期的房间，只更新 uptime
+        指纹只用列表页信息（价格为价格图片与位置），不依赖价格图片的识别结果
+        @:return (未变化房间的 item, 需完整抓取的房间, 指纹)
+        '''
+        if not self.settings.getbool('INCREMENTAL_ENABLED'):
+            return [], rooms, {}
+        fingerprints = {record.room_id: RoomIndex.fingerprint(record) for record, _ in rooms}
+        unchanged = self.room_index.unchanged(fingerprints)
+        items = []
+        if unchanged:
+            uptime = int(time.time())
+            items = [ZiroomItem(room_id=room_id, uptime=uptime) for room_id in unchanged]
+            rooms = [(record, url) for record, url in rooms if record.room_id not in unchanged]
+            self.crawler.stats.inc_value('incremental/unchanged', len(unchanged))
+        return items, rooms, fingerprints
+
+    @property
+    def room_index(self):
+        if self._room_index is None:
+            self._room_index = RoomIndex(
+                self.server, self.settings.getint('INCREMENTAL_MAX_AGE', 259200))
+        return self._room_index
+
+    def price_sprite_failed(self, failure):
+        '''价格图片下载失败：仍请求详情页，价格交由 Price 管道识别'''
+        request = failure.request
+        self.logger.warning(f"列表页价格图片下载失败：{request.url} - {failure.getErrorMessage()}")
+        items, rooms, fingerprints = self._filter_unchanged(request.meta['rooms'])
+        return items + list(self._detail_requests(rooms, fingerprints))
+
+    def _detail_requests(self, rooms, fingerprints=None):
+        fingerprints = fingerprints or {}
+        for record, url in rooms:
+            meta = {'item': record, 'fingerprint': fingerprints.get(record.room_id)}
+            yield scrapy.Request(url, meta=meta, callback=self.parse_detail, priority=self.priorities['detail'])
+
+    @profiled()
     def parse_detail(self, response):
         '''详情页
         例（详情）：http://www.ziroom.com/z/vr/61230316.html
@@ -145,13 +204,12 @@ class ZiroomSpider(RedisSpider):
             61720868&house_id=60273906&ly_name=&ly_phone=
         例（房屋配置）：http://sh.ziroom.com/detail/config?house_id=60273906&id=61720868
         '''
-        self.logger.info(f"crawled 详情页：{response.url}")
+        self.logger.debug(f"crawled 详情页：{response.url}")
         url_parsed = urlparse(response.url)
 
-        # 检测是否正常页面
-        room_id = response.xpath('//input[@id="room_id"]/@value').extract_first()
-        house_id = response.xpath('//input[@id="house_id"]/@value').extract_first()
-        resblock_id = response.xpath('//input[@id="resblock_id"]/@value').extract_first()
+        # 检测是否正常页面（不构建 DOM）
+        ids = detail_ids(response.text)
+        room_id, house_id, resblock_id = ids['room_id'], ids['house_id'], ids['resblock_id']
         if not(room_id and house_id and resblock_id):
             self.log_200_abnormal(
                 response, 
@@ -162,63 +220,13 @@ class ZiroomSpider(RedisSpider):
             return
 
         # 主信息
-        item = copy.deepcopy(response.meta['item'])
-        item['room_link'] = copy.copy(response.url)
-        item['district'] = response.xpath('//span[@class="ellipsis"]/text()')\
-            .re(r'\[?(\S+)\s+(\S+)\]?')
+        item = response.meta['item'].to_item()
+        item['room_link'] = response.url
         item['house_id'] = int(house_id)
-        item['room_sn'] = response.xpath('//h3[@class="fb"]/text()').re_first(r'\S+')
-        item['room_introduce'] = response.xpath('//p/strong[text()="房源介绍："]\
-            /parent::node()/text()').extract_first()
-        item['community'] = response.xpath('//div[@class="node_infor area"]/\
-            a[last()]/text()').re_first('(.+)租房信息')
-        detail_room = response.xpath('//ul[@class="detail_room"]')
-        item['subway'] = detail_room.xpath('li[contains(text(), "交通：")]/span/text() | \
-            li[contains(text(), "交通：")]/span/span/p/text()').re(r'距[\s\S+]+米')
-        item['rent_type'] = detail_room.xpath('//span[@class="icons"]/text()').extract_first()
-        item['area'] = detail_room.xpath('li[contains(text(), "面积：")]/text()')\
-            .re_first(r'面积：\s*(\S+)\s+')
-        item['floor'] = detail_room.xpath('li[contains(text(), "楼层：")]/text()')\
-            .re(r'楼层：\s*(\d+)/(\d+)层')
-        item['towards'] = detail_room.xpath('li[contains(text(), "朝向：")]/text()')\
-            .re_first(r'朝向：\s*(\S+)\s*')
-        item['house_type'] = detail_room.xpath('li[contains(text(), "户型：")]/text()')\
-            .re(r'户型：\s*(\d+)室(?:(\d+)厅)?')
-        item['rent_status'] = response.xpath('//a[@id="zreserve"]/text()').extract_first()
-        img_sel =  response.xpath('//div[@id="lofslidecontent45"]//\
-            ul[@class="lof-main-wapper"]/li/a/img')
-        if img_sel:
-            item['photos'] = []
-            for img in img_sel:
-                tmp_src = img.xpath('@src').extract_first()
-                if tmp_src.find('http:') == -1:
-                    tmp_src = url_parsed.scheme + '://' + tmp_src.strip('//').strip('/')
-                img_info = {
-                    'path': None,
-                    'thumb_path': None,
-                    'title': img.xpath('@title').extract_first(),
-                    'origin_src': tmp_src.replace('v180x135', 'v800x600'),
-                }
-                item['photos'].append(img_info)
-        item['map_position'] = response.xpath('//input[@id="mapsearchText"]/\
-            @data-lng | //input[@id="mapsearchText"]/@data-lat').extract()
-        roommates_sel = response.xpath('//div[@class="greatRoommate"]/ul/li/div')
-        if roommates_sel:
-            item['roommates'] = []
-            for mate_sel in roommates_sel:
-                mate = {}
-                mate['gender'] = mate_sel.xpath('parent::node()/@class').re_first(r'\S+')
-                mate['room'] = mate_sel.xpath('div[@class="user_top clearfix"]/\
-                    p/text()').extract_first()
-                mate['status'] = mate_sel.xpath('div[@class="user_top clearfix"]/\
-                    span[@class="tags"]/text()').extract_first()
-                mate['sign'] = mate_sel.xpath('div[@class="user_center"]/p[1]/\
-                    text()').extract_first()
-                mate['jobs'] = mate_sel.xpath('div[@class="user_center"]/p[2]/\
-                    span[1]/text()').extract_first()
-                mate['check_in_time'] = mate_sel.xpath('div[@class="user_bottom"]/\
-                    p/text()').re_first(r'\S+')
-                item['roommates'].append(mate)
+        item.update(extract_detail(parse_html(response), url_parsed.scheme))
+        if response.meta.get('fingerprint'):
+            # 房间完整写入 mongo 后才记录指纹（见 RoomCoalescer）
+            item['fingerprint'] = response.meta['fingerprint']
         yield item
 
         # 继续抓取管家、房间配置、支付详情、空气
@@ -227,64 +235,111 @@ class ZiroomSpider(RedisSpider):
             f"&room_id={room_id}&house_id={house_id}&ly_name=&ly_phone="
         payment_and_air_url = http_prfix + f"/detail/info?id={room_id}&house_id={house_id}"
         allocation_url = http_prfix + f"/detail/config?house_id={house_id}&id={room_id}"
-        yield scrapy.Request(
-            keeper_url, 
-            meta={'referer': copy.copy(response.url), 'room_id':int(room_id)}, 
-            callback=self.parse_keeper
-        )
+        # 管家信息（按小区）、房屋配置（按房屋）：优先使用缓存
+        meta = {'referer': response.url, 'room_id': int(room_id)}
+        steward, config = self.subresource_cache.get_many(
+            [('steward', resblock_id), ('config', house_id)])
+        if steward is not None:
+            self.crawler.stats.inc_value('subresource_cache/steward_hits')
+            yield self._keeper_item(steward, meta)
+        else:
+            yield scrapy.Request(
+                keeper_url,
+                meta=dict(meta, resblock_id=resblock_id),
+                callback=self.parse_keeper,
+                errback=self.subresource_failed,
+                priority=self.priorities['subresource']
+            )
         yield scrapy.Request(
             payment_and_air_url, 
-            meta={'referer': copy.copy(response.url), 'room_id':int(room_id)}, 
-            callback=self.parse_payment_air
-        )
-        yield scrapy.Request(
-            allocation_url, 
-            meta={'referer': copy.copy(response.url), 'room_id':int(room_id)}, 
-            callback=self.parse_allocation
+            meta={'referer': response.url, 'room_id':int(room_id)}, 
+            callback=self.parse_payment_air,
+            errback=self.subresource_failed,
+            priority=self.priorities['subresource']
         )
+        if config is not None:
+            self.crawler.stats.inc_value('subresource_cache/config_hits')
+            yield self._allocation_item(config, meta)
+        else:
+            yield scrapy.Request(
+                allocation_url,
+                meta=dict(meta, house_id=house_id),
+                callback=self.parse_allocation,
+                errback=self.subresource_failed,
+                priority=self.priorities['subresource']
+            )
 
+    @property
+    def subresource_cache(self):
+        if self._subresource_cache is None:
+            self._subresource_cache = SubResourceCache(self.server, {
+                'steward': self.settings.getint('STEWARD_CACHE_TTL', 86400),
+                'config': self.settings.getint('CONFIG_CACHE_TTL', 86400),
+            })
+        return self._subresource_cache
+
+    @property
+    def frontier(self):
+        if self._frontier is None:
+            self._frontier = Frontier(self.server,
+                self.settings.get('FRONTIER_KEY', '%(spider)s:frontier') % {'spider': self.name})
+        return self._frontier
+
+    @property
+    def priorities(self):
+        if self._priorities is None:
+            self._priorities = request_priorities(self.settings)
+        return self._priorities
+
+    @profiled()
     def parse_keeper(self, response):
         '''管家信息'''
-        self.logger.info(f"crawled 管家信息：{response.url}")
+        self.logger.debug(f"crawled 管家信息：{response.url}")
         try:
             body = response.body.decode()
             body_dict = json.loads(body)
             if body_dict['code'] == 200 and body_dict['message'] == 'success':
                 data = body_dict['data']
-                item = ZiroomItem()
-                item['room_id'] = copy.copy(response.meta['room_id'])
-                item['keeper'] = {
-                    'keeper_id': int(data['keeperId']),
-                    'keeper_name': data['keeperName'],
-                    'keeper_phone': data['keeperPhone'],
-                    'keeper_header': {
-                        'path': None,
-                        'origin_src': data['headCorn'],
-                        'referer': copy.copy(response.meta['referer']),
-                    },
-                }
-                yield item
+                yield self._keeper_item(data, response.meta)
+                self.subresource_cache.set('steward', response.meta['resblock_id'], data)
             else:
                 raise UserWarning(f"管家信息： body_dict['code'] != 200")
         except Exception as e:
             self.log_200_abnormal(response, position='抓取：管家信息', statement=e, close=False)
+            yield self._part_missing(response.meta['room_id'], 'keeper')
 
+    def _keeper_item(self, data, meta):
+        item = ZiroomItem()
+        item['room_id'] = meta['room_id']
+        item['keeper'] = {
+            'keeper_id': int(data['keeperId']),
+            'keeper_name': data['keeperName'],
+            'keeper_phone': data['keeperPhone'],
+            'keeper_header': {
+                'path': None,
+                'origin_src': data['headCorn'],
+                'referer': meta['referer'],
+            },
+        }
+        return item
+
+    @profiled()
     def parse_payment_air(self, response):
         '''付款详细信息 && 空气质量'''
-        self.logger.info(f"crawled 付款+空气：{response.url}")
+        self.logger.debug(f"crawled 付款+空气：{response.url}")
         try:
             body = response.body.decode()
             body_dict = json.loads(body)
             if body_dict['code'] == 200 and body_dict['message'] == 'success':
                 data = body_dict['data']
                 item = ZiroomItem()
-                item['room_id'] = copy.copy(response.meta['room_id'])
+                item['room_id'] = response.meta['room_id']
                 if 'payment' in data and len(data['payment']):
                     url_parsed = urlparse(response.url)
                     item['payment'] = {
                         'png': {
                             'origin_src': url_parsed.scheme + ':' + data['payment'][0]['rent'][1], 
-                            'referer': copy.copy(response.url), 
+                            'referer': response.url, 
                             'path': None
                         },
                         'info': []
@@ -312,30 +367,51 @@ class ZiroomSpider(RedisSpider):
                 raise UserWarning(f"付款详细信息： body_dict['code'] != 200")
         except Exception as e:
             self.log_200_abnormal(response, position='抓取：付款详细信息', statement=e, close=False)
+            yield self._part_missing(response.meta['room_id'], 'payment_air')
 
+    @profiled()
     def parse_allocation(self, response):
         '''房屋配置'''
-        self.logger.info(f"crawled 房屋配置：{response.url}")
+        self.logger.debug(f"crawled 房屋配置：{response.url}")
         try:
             body = response.body.decode()
             body_dict = json.loads(body)
             if body_dict['code'] == 200 and body_dict['message'] == 'success':
                 data = body_dict['data']
-                item = ZiroomItem()
-                item['room_id'] = copy.copy(response.meta['room_id'])
-                item['allocation'] = data
-                yield item
+                yield self._allocation_item(data, response.meta)
+                self.subresource_cache.set('config', response.meta['house_id'], data)
             else:
                 raise UserWarning(f"房屋配置： body_dict['code'] != 200")
         except Exception as e:
             self.log_200_abnormal(response, position='抓取：房屋配置', statement=e, close=False)
+            yield self._part_missing(response.meta['room_id'], 'allocation')
+
+    def subresource_failed(self, failure):
+        '''管家信息、支付详情、房屋配置下载失败（重试后）：房间片段记为缺失，房间不必等待合并超时'''
+        self.logger.debug(f"子资源下载失败：{failure.request.url} - {failure.getErrorMessage()}")
+        request = failure.request
+        return [self._part_missing(
+            request.meta['room_id'], self.subresource_parts[request.callback.__name__])]
+
+    def _part_missing(self, room_id, part):
+        self.crawler.stats.inc_value(f"room_part_missing/{part}")
+        return RoomPartMissing(room_id=room_id, part=part)
+
+    def _allocation_item(self, data, meta):
+        item = ZiroomItem()
+        item['room_id'] = meta['room_id']
+        item['allocation'] = data
+        return item
 
     def log_200_abnormal(self, response, *, position='未知', statement='', close=True):
-        ''''记录疑似非正常页面：response.status_code==200，但是返回的页面内容貌似不是我们想要的内容'''
-        self.logger.critical(f"发现疑似非正常页面")
-        self.logger.critical(f"url : {response.url}")
-        self.logger.critical(f"position : {position}")
-        self.logger.critical(f"statement : {statement}")
-        self.logger.critical(f"response.body : {response.body.decode()}")
+        ''''记录疑似非正常页面：response.status_code==200，但是返回的页面内容貌似不是我们想要的内容
+        页面内容抽样保存（scrapy anomalies 查看），不写入日志
+        '''
+        anomaly_recorder.record(
+            'abnormal_200',
+            f"发现疑似非正常页面：{response.url} - position：{position} - statement：{statement}",
+            response=response, logger=self.logger, level=logging.CRITICAL,
+            position=position, statement=statement,
+        )
         if close:
             raise CloseSpider(f"发现疑似非正常页面")
@@ -0,0 +1,103 @@
+'''调度队列（SCHEDULER_QUEUE_CLASS）
+
+scrapy_redis PriorityQueue，使用 ziroom.serializer 时请求携带的房间数据（meta 中的 RoomRecord）不进入队列：
+    SCHEDULER_PAYLOAD_KEY（默认 <spider>:room:<room_id>）- hash：record 为房间数据（msgpack），_refs 为引用计数，
+                                                           过期时间 SCHEDULER_PAYLOAD_TTL 秒
+队列中的请求只保存 room_id；取出请求时读取房间数据，引用计数为 0 时删除。
+房间数据已过期的请求被丢弃（不以缺失列表页信息的房间继续抓取），计入 scheduler/payload_missing，
+房间未记录指纹（见 ziroom.incremental），下次抓取时仍会请求。
+stats：scheduler/queue_bytes、scheduler/payload_bytes - 写入队列、房间数据的字节数。
+'''
+
+import logging
+from collections import Counter
+
+from scrapy.utils.request import request_from_dict
+from scrapy_redis import queue
+
+# 读取房间数据并减少引用计数（ARGV[1]：请求中引用该房间的次数），为 0 时删除
+_TAKE_PAYLOAD = '''
+local data = redis.call('HGETALL', KEYS[1])
+if redis.call('HINCRBY', KEYS[1], '_refs', -tonumber(ARGV[1])) <= 0 then
+    redis.call('DEL', KEYS[1])
+end
+return data
+'''
+
+
+class PriorityQueue(queue.PriorityQueue):
+
+    def __init__(self, server, spider, key, serializer=None):
+        super().__init__(server, spider, key, serializer)
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        settings = spider.settings
+        self.payload_key = settings.get('SCHEDULER_PAYLOAD_KEY', '%(spider)s:room:%(room_id)s')
+        self.payload_ttl = settings.getint('SCHEDULER_PAYLOAD_TTL', 86400)
+        # 序列化方式不支持房间引用时（如 pickle），与 scrapy_redis PriorityQueue 相同
+        self.offload = hasattr(self.serializer, 'resolve')
+        self.stats = spider.crawler.stats
+        self._take_payload = server.register_script(_TAKE_PAYLOAD)
+
+    def _payload_key(self, room_id):
+        return self.payload_key % {'spider': self.spider.name, 'room_id': room_id}
+
+    def push(self, request):
+        '''Push a request'''
+        if not self.offload:
+            data = self._encode_request(request)
+            self.server.zadd(self.key, {data: -request.priority})
+            self.stats.inc_value('scheduler/queue_bytes', len(data))
+            return
+        records = []
+        data = self.serializer.dumps(request.to_dict(spider=self.spider), offload=records.append)
+        pipe = self.server.pipeline()
+        payload_bytes = 0
+        for record in records:
+            key = self._payload_key(record.room_id)
+            mapping = self.serializer.record_to_hash(record)
+            payload_bytes += sum(len(k) + len(v) for k, v in mapping.items())
+            pipe.hset(key, mapping=mapping)
+            pipe.hincrby(key, '_refs', 1)
+            pipe.expire(key, self.payload_ttl)
+        pipe.zadd(self.key, {data: -request.priority})
+        pipe.execute()
+        self.stats.inc_value('scheduler/queue_bytes', len(data))
+        if payload_bytes:
+            self.stats.inc_value('scheduler/payload_bytes', payload_bytes)
+
+    def pop(self, timeout=0):
+        '''Pop a request，跳过房间数据已过期（被丢弃）的请求'''
+        while True:
+            pipe = self.server.pipeline()
+            pipe.multi()
+            pipe.zrange(self.key, 0, 0).zremrangebyrank(self.key, 0, 0)
+            results, _ = pipe.execute()
+            if not results:
+                return None
+            request = self._decode_request(results[0])
+            if request is not None:
+                return request
+
+    def _decode_request(self, encoded_request):
+        '''房间数据已过期时返回 None'''
+        if not self.offload:
+            return super()._decode_request(encoded_request)
+        refs = []
+        obj = self.serializer.loads(encoded_request, refs=refs)
+        if refs:
+            # push 时每个 RoomRecord 增加一次引用计数：按引用次数减少
+            counts = Counter(ref.room_id for ref in refs)
+            room_ids = list(counts)
+            pipe = self.server.pipeline()
+            for room_id in room_ids:
+                self._take_payload(keys=[self._payload_key(room_id)], args=[counts[room_id]], client=pipe)
+            records = {}
+            for room_id, data in zip(room_ids, pipe.execute()):
+                records[room_id] = self.serializer.record_from_hash(dict(zip(data[::2], data[1::2])))
+            missing = sorted(room_id for room_id, record in records.items() if record is None)
+            if missing:
+                self.logger.warning(f"房间数据已过期，丢弃请求：{obj['url']} - room_id：{missing}")
+                self.stats.inc_value('scheduler/payload_missing')
+                return None
+            obj['meta'] = self.serializer.resolve(obj['meta'], records)
+        return request_from_dict(obj, spider=self.spider)
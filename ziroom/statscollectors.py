@@ -0,0 +1,85 @@
+'''集群 stats
+
+RedisStatsCollector（STATS_CLASS）：每个节点每隔 STATS_PUSH_INTERVAL 秒将本节点的 stats 写入 redis，
+    <STATS_REDIS_KEY>:<节点>   - json：stats、本次间隔的 items/s、requests/s、代理更换次数、状态（running/finished）
+    <STATS_REDIS_KEY>:nodes    - zset：节点 -> 最后写入时间
+运行中的节点 key 过期时间为 3 个间隔（进程异常退出后自动清理），结束的节点保留 STATS_FINISHED_TTL 秒。
+scrapy clusterstats 读取并汇总。
+'''
+
+import os
+import json
+import time
+import socket
+import logging
+
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy_redis import connection
+from twisted.internet import task
+
+# 节点标识
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def stats_key(settings, spider_name):
+    return settings.get('STATS_REDIS_KEY', '%(spider)s:stats') % {'spider': spider_name}
+
+
+class RedisStatsCollector(MemoryStatsCollector):
+
+    def __init__(self, crawler):
+        super().__init__(crawler)
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.crawler = crawler
+        self.interval = crawler.settings.getfloat('STATS_PUSH_INTERVAL', 10)
+        self.finished_ttl = crawler.settings.getint('STATS_FINISHED_TTL', 86400)
+        self.server = None
+        self.key = None
+        self._loop = None
+        self._last = None       # 上次写入时的 (时间, items, requests)
+
+    def open_spider(self, spider):
+        super().open_spider(spider)
+        self.server = connection.from_settings(self.crawler.settings)
+        self.key = stats_key(self.crawler.settings, spider.name)
+        self._last = (time.time(), 0, 0)
+        self._loop = task.LoopingCall(self.push, spider)
+        self._loop.start(self.interval, now=False)
+
+    def close_spider(self, spider, reason):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self.set_value('finish_reason', reason, spider=spider)
+        self.push(spider, status='finished')
+        super().close_spider(spider, reason)
+
+    def push(self, spider, status='running'):
+        '''写入本节点的 stats（redis 出错时只记录日志）'''
+        try:
+            self._push(spider, status)
+        except Exception as e:
+            self.logger.warning(f"写入集群 stats 失败：{e}")
+
+    def _push(self, spider, status):
+        from ziroom.proxy import proxy_ins
+        now = time.time()
+        stats = self.get_stats(spider)
+        items = stats.get('item_scraped_count', 0)
+        requests = stats.get('downloader/request_count', 0)
+        last_time, last_items, last_requests = self._last
+        elapsed = max(now - last_time, 1e-6)
+        self._last = (now, items, requests)
+        node = {
+            'node': NODE_ID,
+            'status': status,
+            'time': now,
+            'items_per_second': round((items - last_items) / elapsed, 2),
+            'requests_per_second': round((requests - last_requests) / elapsed, 2),
+            'proxy_rotations': proxy_ins.proxy['used_proxy_num'],
+            'stats': stats,
+        }
+        ttl = int(self.interval * 3) if status == 'running' else self.finished_ttl
+        pipe = self.server.pipeline()
+        pipe.setex(f"{self.key}:{NODE_ID}", ttl, json.dumps(node, ensure_ascii=False, default=str))
+        pipe.zadd(f"{self.key}:nodes", {NODE_ID: now})
+        pipe.execute()
@@ -17,12 +17,13 @@ def combine_price(img_str, position):
     if len(img_str) == 10 and len(position) > 0:
         return int(reduce(lambda x, y: x + img_str[y], position, ''))
 
-# 识别图片中数字
+# 识别图片中数字（tesseract），img_path 为图片路径或 PIL Image
 def orc_img(img_path):
     config = f'--tessdata-dir {project_settings["TESSDATA_DIR"]} -psm 8 -c '\
         f'tessedit_char_whitelist=1234567890'
     try:
-        orc_str = pytesseract.image_to_string(Image.open(img_path), config=config)
+        img = img_path if isinstance(img_path, Image.Image) else Image.open(img_path)
+        orc_str = pytesseract.image_to_string(img, config=config)
     except Exception as e:
         logger.critical(f"orc image failed: {img_path}")
         logger.critical(e)